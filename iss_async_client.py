@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+    Asyncio version of MicexISSClient.
+
+    Many instruments can be tracked from one event loop: every
+    AsyncMicexISSClient of a session shares the connection pool, the MOEX
+    Passport cookie and one limit of concurrent requests. The network
+    requests and the parsing of pages are done by the page methods of
+    MicexISSClient in a thread pool of the session, so the event loop is
+    never blocked.
+
+    Example:
+
+        session = AsyncMicexISSSession( config, auth, concurrency = 8 )
+        clients = [ AsyncMicexISSClient( session, MyDataHandler, MyData ) for sec in secs ]
+        await asyncio.gather( *( cl.get_trades_for_session( 'futures', 'forts', sec, 1 )
+                                 for cl, sec in zip( clients, secs ) ) )
+"""
+
+import asyncio
+import concurrent.futures
+
+from iss_columns import TradeColumns, CandleColumns
+from iss_simple_client import ( MicexISSClient, INTRADAY_TIMEFRAMES,
+                                trade_shards, cut_trade_page, make_opener )
+
+
+class AsyncMicexISSSession:
+    """ Resources shared by the async clients: opener (connection pool
+    with the passport cookie of auth), concurrency limit and threads.
+    """
+
+    def __init__( self, config, auth = None, concurrency = None ):
+        """ config: instance of the Config class
+            auth: instance of the MicexAuth class or None
+            concurrency: max number of requests in progress for all the
+                         clients together, Config.max_workers by default
+        """
+        self.config = config
+        self.auth = auth
+        self.concurrency = concurrency or max( config.max_workers, 1 )
+        self.opener = make_opener( config, auth )
+        self.limiter = asyncio.Semaphore( self.concurrency )
+        self.executor = concurrent.futures.ThreadPoolExecutor( max_workers = self.concurrency )
+
+    async def run( self, func, *args ):
+        """ Call blocking func in the thread pool within the concurrency limit.
+        """
+        async with self.limiter:
+            return await asyncio.get_running_loop().run_in_executor( self.executor, func, *args )
+
+    def close( self ):
+        self.executor.shutdown()
+
+
+class AsyncMicexISSClient:
+    """ Coroutine versions of the MicexISSClient methods.
+    """
+
+    def __init__( self, session, handler, container ):
+        """ session: AsyncMicexISSSession shared by the clients
+            handler: user's handler class inherited from MicexISSDataHandler
+            container: user's container class
+        """
+        self.session = session
+        self.client = MicexISSClient( session.config, handler, container, opener = session.opener )
+        self.handler = self.client.handler
+
+    def add_listener( self, listener ):
+        """ See MicexISSClient.add_listener.
+        """
+        self.client.add_listener( listener )
+
+    async def get_history_securities( self, engine, market, board, date ):
+        start = 0
+        cnt = 1
+        while cnt > 0:
+            result = await self.session.run( self.client._history_page, engine, market, board, date, start )
+            self.client._handle( result )
+            cnt = len( result )
+            start = start + cnt
+        return True
+
+    async def get_security_trades( self, engine, market, security, prevSession, isReversed, limit ):
+        return await self.session.run( self.client.get_security_trades,
+                                       engine, market, security, prevSession, isReversed, limit )
+
+    async def get_session_start_end_tradenos( self, engine, market, security, prevSession ):
+        return await self.session.run( self.client.get_session_start_end_tradenos,
+                                       engine, market, security, prevSession )
+
+    async def get_trades_for_session( self, engine, market, security, prevSession, workers = None, columnar = False ):
+        """ Shards of the session are requested concurrently (each one page
+        by page), the pages of all the clients share the session limit.
+        """
+        startTradeNo, endTradeNo = await self.get_session_start_end_tradenos( engine, market, security, prevSession )
+        shards = trade_shards( startTradeNo, endTradeNo, workers or self.session.concurrency )
+
+        async def fetch_shard( shard ):
+            trades = TradeColumns() if columnar else []
+            trim = shard is not shards[-1]
+            currTradeNo = shard[0]
+            while currTradeNo <= shard[1]:
+                page = await self.session.run( self.client._trades_page,
+                                               engine, market, security, prevSession, currTradeNo )
+                if len( page ) == 0:
+                    break
+                page, currTradeNo = cut_trade_page( page, shard[1], trim )
+                self.client._convert_trades( page, trades )
+            return trades
+
+        result = TradeColumns() if columnar else []
+        for chunk in await asyncio.gather( *( fetch_shard( shard ) for shard in shards ) ):
+            result.extend( chunk )
+
+        self.client._handle( result )
+        return True
+
+    async def get_security_candleborders( self, engine, market, board, security, timeFrames ):
+        return await self.session.run( self.client.get_security_candleborders,
+                                       engine, market, board, security, timeFrames )
+
+    async def get_security_candles( self, engine, market, board, security, dateFrom, dateTill, timeFrame,
+                                    reverse = False, workers = None, columnar = False ):
+        """ Date subranges of intraday timeframes are requested concurrently
+        and joined as in MicexISSClient.get_security_candles.
+        """
+        ranges = None
+        if not reverse and timeFrame in INTRADAY_TIMEFRAMES:
+            ranges = await self.session.run( self.client._split_candle_dates, engine, market, board, security,
+                                             dateFrom, dateTill, timeFrame, ( workers or self.session.concurrency ) * 4 )
+        if not ranges:
+            ranges = [ ( dateFrom, dateTill ) ]
+
+        async def fetch_range( dates ):
+            dataChunk = []
+            while True:
+                page = await self.session.run( self.client._candles_page, engine, market, board, security,
+                                               dates[0], dates[1], timeFrame, reverse, len( dataChunk ) )
+                if len( page ) == 0:
+                    return dataChunk
+                dataChunk += page
+
+        candles = CandleColumns() if columnar else []
+        lastBegin = ''
+        for dataChunk in await asyncio.gather( *( fetch_range( dates ) for dates in ranges ) ):
+            dataChunk = [ cd for cd in dataChunk if cd[6] > lastBegin ] if lastBegin else dataChunk
+            if dataChunk:
+                lastBegin = dataChunk[-1][6]
+            if columnar:
+                candles.append_rows( dataChunk )
+            else:
+                candles += dataChunk
+        return candles
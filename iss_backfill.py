@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+"""
+    Backfill of the trades of many sessions by a pool of processes.
+
+    Parsing and conversion of trades take a core per download, so threads
+    of one process don't go faster than that. Here every session is cut
+    into tradeno ranges, the ranges are downloaded by worker processes,
+    and each one is written into its own shard file:
+
+        <out>/shards/<security>.<first tradeno>.<from>-<to>.bin
+
+    When all the shards of a session are there, they are joined into
+
+        <out>/<security>.<first tradeno>.trades.bin
+
+    (the same records as save_trades_for_session writes) and the session is
+    added to <out>/index.json with its rows, first and last time and tradeno.
+    The first tradeno names a session whatever day it is downloaded on, so
+    a re-run skips the sessions in the index and the shards already saved.
+    The current session (previous session 0) is indexed as incomplete, as
+    in iss_trade_archive: a re-run downloads its trades after the last saved one.
+
+        backfill = MicexISSBackfill( config, 'trades', processes = 4 )
+        backfill.run( [ ( 'futures', 'forts', 'RIH8', 1 ), ( 'futures', 'forts', 'SiH8', 1 ) ] )
+
+    or from the command line:
+
+        python iss_backfill.py --out trades --processes 4 futures forts RIH8:1 SiH8:1 SiH8:2
+
+    Workers authenticate by themselves; with Config.passport_file they
+    share the passport of the parent process instead (see iss_passport).
+"""
+
+import argparse
+import concurrent.futures
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+
+from iss_simple_client import ( Config, MicexAuth, MicexISSClient, MicexISSDataHandler, ordered_map,
+                                split_range, TRADES_PAGE_SIZE )
+from iss_store import BinaryWriter, HEADER_SIZE, TRADE_FIELDS, trades_summary
+
+
+log = logging.getLogger( 'iss.backfill' )
+
+
+def make_client( config ):
+    """ Client of a process: authenticated if the config has a user.
+    """
+    auth = MicexAuth( config ) if config.user else None
+    return MicexISSClient( config, MicexISSDataHandler, list, auth = auth )
+
+
+# client of a worker process, made by _init_worker
+_client = None
+
+
+def _init_worker( config ):
+    global _client
+    logging.basicConfig( level = logging.WARNING )
+    _client = make_client( config )
+
+
+def _fetch_shard( task ):
+    """ Download the tradeno range of the task into its shard file. Returns the number of trades.
+    """
+    engine, market, security, prevSession, fromTradeNo, toTradeNo, trim, fname = task
+    tmp = '%s.%d.tmp' % ( fname, os.getpid() )
+    with BinaryWriter( tmp, 'trades', TRADE_FIELDS, security = security ) as writer:
+        for page in _client._iter_trade_pages( engine, market, security, prevSession, fromTradeNo, toTradeNo, trim ):
+            writer.write_rows( _client._convert_trades( page, [] ) )
+        rows = writer.rows
+    os.replace( tmp, fname )
+    return rows
+
+
+class BackfillSession:
+    """ Trades of one session of a security split into shards.
+    """
+
+    def __init__( self, engine, market, security, prevSession ):
+        self.engine = engine
+        self.market = market
+        self.security = security
+        self.prevSession = prevSession
+        self.startTradeNo = None
+        self.endTradeNo = None
+        # the first tradeno to download and the records to keep of an incomplete session
+        self.fromTradeNo = None
+        self.keepRows = 0
+        self.shards = []
+        self.fname = None
+        self.error = None
+
+    @property
+    def key( self ):
+        return '%s.%d' % ( self.security, self.startTradeNo )
+
+    def __repr__( self ):
+        return '%s/%d' % ( self.security, self.prevSession )
+
+
+class MicexISSBackfill:
+    """ Backfill of trade sessions with worker processes.
+    """
+
+    def __init__( self, config, out, processes = None, parts = None ):
+        """ config: Config of the clients of the parent and the workers
+            out: output directory
+            processes: number of worker processes, the number of cores by default
+            parts: tradeno ranges of a session, 2 per process by default
+        """
+        self.config = config
+        self.out = out
+        self.processes = processes or os.cpu_count() or 1
+        self.parts = parts or 2 * self.processes
+        self.indexFile = os.path.join( out, 'index.json' )
+        self.index = {}
+        if os.path.isfile( self.indexFile ):
+            with open( self.indexFile ) as f:
+                self.index = json.load( f )
+
+    def run( self, sessions ):
+        """ Download the sessions, given as BackfillSession or tuples
+        ( engine, market, security, prevSession ). Returns the sessions;
+        session.fname is the joined file, session.error the exception if it failed.
+        """
+        sessions = [ s if isinstance( s, BackfillSession ) else BackfillSession( *s ) for s in sessions ]
+        os.makedirs( os.path.join( self.out, 'shards' ), exist_ok = True )
+        client = make_client( self.config )
+        for _ in ordered_map( lambda session: self.plan( client, session ), sessions, self.config.max_workers ):
+            pass
+
+        tasks = {}
+        for session in sessions:
+            if session.error is None and session.fname is None:
+                for shard in session.shards:
+                    if not os.path.isfile( shard[-1] ):
+                        tasks[ shard ] = session
+        log.info( '%d sessions, %d shards to download with %d processes', len( sessions ), len( tasks ), self.processes )
+
+        waiting = { session: sum( 1 for s in tasks.values() if s is session ) for session in set( tasks.values() ) }
+        for session in sessions:
+            if session.error is None and session.fname is None and session not in waiting:
+                self.join( session )
+        ctx = multiprocessing.get_context( 'spawn' )
+        with concurrent.futures.ProcessPoolExecutor( self.processes, mp_context = ctx, initializer = _init_worker,
+                                                     initargs = ( self.config, ) ) as pool:
+            futures = { pool.submit( _fetch_shard, shard ): shard for shard in tasks }
+            for future in concurrent.futures.as_completed( futures ):
+                session = tasks[ futures[ future ] ]
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    log.error( '%s: shard failed: %r', session, e )
+                    session.error = e
+                    continue
+                waiting[ session ] -= 1
+                log.debug( '%s: shard of %d trades, %d shards left', session, rows, waiting[ session ] )
+                if waiting[ session ] == 0 and session.error is None:
+                    self.join( session )
+        return sessions
+
+    def plan( self, client, session ):
+        """ Find the tradenos of the session and cut them into shards.
+        """
+        try:
+            session.startTradeNo, session.endTradeNo = client.get_session_start_end_tradenos(
+                session.engine, session.market, session.security, session.prevSession )
+        except Exception as e:
+            log.error( '%s: %r', session, e )
+            session.error = e
+            return
+        entry = self.index.get( session.key )
+        if entry is not None and entry.get( 'complete', False ):
+            session.fname = os.path.join( self.out, entry[ 'file' ] )
+            return
+        session.fromTradeNo = session.startTradeNo
+        if entry is not None and entry[ 'rows' ]:
+            # continue an incomplete session; trades written after the last index update are dropped
+            session.fromTradeNo = entry[ 'last_tradeno' ] + 1
+            session.keepRows = entry[ 'rows' ]
+        ranges = []
+        if session.fromTradeNo <= session.endTradeNo:
+            ranges = split_range( session.fromTradeNo, session.endTradeNo, self.parts, TRADES_PAGE_SIZE )
+        for i, ( first, last ) in enumerate( ranges ):
+            # the range is in the name, so a shard of another split is never taken
+            fname = os.path.join( self.out, 'shards', '%s.%d-%d.bin' % ( session.key, first, last ) )
+            # only the last range keeps the trades past its end, as save_trades_for_session
+            session.shards.append( ( session.engine, session.market, session.security, session.prevSession,
+                                     first, last, i < len( ranges ) - 1, fname ) )
+        self.discard_stale( session )
+
+    def discard_stale( self, session ):
+        """ Remove the shards of the session left by a run with another split
+        (other processes or parts, or a longer current session).
+        """
+        planned = set( os.path.basename( shard[-1] ) for shard in session.shards )
+        shardDir = os.path.join( self.out, 'shards' )
+        for name in os.listdir( shardDir ):
+            if name.startswith( session.key + '.' ) and name.endswith( '.bin' ) and name not in planned:
+                log.info( '%s: dropping the shard %s of another split', session, name )
+                os.remove( os.path.join( shardDir, name ) )
+
+    def join( self, session ):
+        """ Join the shards of the session into its file and add it to the index.
+        """
+        name = session.key + '.trades.bin'
+        fname = os.path.join( self.out, name )
+        if session.keepRows:
+            target = fname
+            writer = BinaryWriter( fname, 'trades', TRADE_FIELDS, append = True, security = session.security )
+            writer.truncate( session.keepRows )
+        else:
+            target = fname + '.tmp'
+            writer = BinaryWriter( target, 'trades', TRADE_FIELDS, security = session.security )
+        with writer:
+            for shard in session.shards:
+                with open( shard[-1], 'rb' ) as f:
+                    f.seek( HEADER_SIZE )
+                    shutil.copyfileobj( f, writer.f )
+        if target != fname:
+            os.replace( target, fname )
+        complete = session.prevSession > 0
+        self.index[ session.key ] = dict( trades_summary( fname ), file = name, security = session.security,
+                                          engine = session.engine, market = session.market, complete = complete )
+        self.save_index()
+        for shard in session.shards:
+            os.remove( shard[-1] )
+        session.fname = fname
+        log.info( '%s: %d trades in %s%s', session, self.index[ session.key ][ 'rows' ], name,
+                  '' if complete else ' so far' )
+
+    def save_index( self ):
+        tmp = self.indexFile + '.tmp'
+        with open( tmp, 'w' ) as f:
+            json.dump( self.index, f, indent = 1, sort_keys = True )
+        os.replace( tmp, self.indexFile )
+
+
+def main():
+    parser = argparse.ArgumentParser( description = 'Backfill of trade sessions with worker processes' )
+    parser.add_argument( 'engine' )
+    parser.add_argument( 'market' )
+    parser.add_argument( 'sessions', nargs = '+', help = 'SECURITY:previous_session, e.g. RIH8:1' )
+    parser.add_argument( '--out', default = 'trades', help = 'output directory' )
+    parser.add_argument( '--processes', type = int, default = None, help = 'worker processes, cores by default' )
+    parser.add_argument( '--parts', type = int, default = None, help = 'tradeno ranges of a session' )
+    parser.add_argument( '--iss-url', default = '', help = 'ISS other than iss.moex.com, e.g. iss_mock_server' )
+    parser.add_argument( '--user', default = '' )
+    parser.add_argument( '--password', default = '' )
+    parser.add_argument( '--passport-file', default = '' )
+    parser.add_argument( '--requests-per-second', type = float, default = 0,
+                         help = 'request rate limit of every process' )
+    args = parser.parse_args()
+    logging.basicConfig( level = logging.INFO, format = '%(message)s' )
+
+    config = Config( user = args.user, password = args.password, iss_url = args.iss_url, max_workers = 4,
+                     passport_file = args.passport_file, requests_per_second = args.requests_per_second )
+    sessions = []
+    for item in args.sessions:
+        security, _, prevSession = item.partition( ':' )
+        sessions.append( ( args.engine, args.market, security, int( prevSession or 0 ) ) )
+    backfill = MicexISSBackfill( config, args.out, args.processes, args.parts )
+    failed = [ session for session in backfill.run( sessions ) if session.error is not None ]
+    if failed:
+        raise SystemExit( 'failed: %s' % ', '.join( map( repr, failed ) ) )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+    Batch download of candles for many securities.
+
+    Every job is planned first: candleborders give the date window, which
+    is cut into date ranges of a few pages each. Then the ranges of all the
+    jobs go through one pool of worker threads. They are taken round-robin
+    across the jobs, so a long history doesn't hold the short ones back.
+    Requests toward ISS are limited by a token bucket; replies from the disk
+    cache of the client take no tokens. The ranges of a job are written to
+    its file in order as soon as they are complete, so the files are the
+    same as made by MicexISSClient.save_security_candles.
+
+    Example:
+
+        batch = MicexISSBatch( iss, workers = 8, requests_per_second = 20 )
+        batch.run( [ ( 'currency', 'selt', 'CETS', 'USD000000TOD', 'm1' ),
+                     ( 'stock', 'shares', 'TQBR', 'SBER', 'H1' ) ] )
+"""
+
+import concurrent.futures
+import itertools
+import logging
+
+from iss_cache import MicexISSCache
+from iss_simple_client import ( MicexISSClient, MicexISSDataHandler, INTRADAY_TIMEFRAMES, CANDLE_LINE,
+                                candle_date_ranges )
+from iss_store import BinaryWriter, CANDLE_FIELDS, candle_record
+from iss_throttle import TokenBucket, ThrottledOpener
+
+
+log = logging.getLogger( 'iss.batch' )
+
+# days in one planned date range of a job: a few pages of 500 candles
+RANGE_DAYS = { 'm1': 5, 'm10': 60, 'H1': 180 }
+
+
+class CandleJob:
+    """ Candles of one security and timeframe to be saved to a file.
+    """
+
+    def __init__( self, engine, market, board, security, timeFrame, dateFrom = '', dateTill = '', fmt = 'txt' ):
+        """ dateFrom, dateTill: window to download, candleborders of the timeframe if empty
+            fmt: 'txt' or 'bin' as for save_security_candles
+        """
+        self.engine = engine
+        self.market = market
+        self.board = board
+        self.security = security
+        self.timeFrame = timeFrame
+        self.dateFrom = dateFrom
+        self.dateTill = dateTill
+        self.fmt = fmt
+        self.ranges = []
+        self.fname = None
+        self.done = 0
+        self.rows = 0
+        self.error = None
+        # finished ranges waiting for the previous ones: index -> candles
+        self.ready = {}
+        self.written = 0
+        self.lastBegin = ''
+        self.out = None
+
+    def __repr__( self ):
+        return '%s/%s/%s' % ( self.board, self.security, self.timeFrame )
+
+
+class CacheOverThrottle:
+    """ Disk cache of a client with a rate limit on the requests it passes to ISS.
+    """
+
+    def __init__( self, cache, bucket ):
+        self.cache = cache
+        self.throttled = ThrottledOpener( cache.opener, bucket )
+
+    def open( self, url, headers = None ):
+        return self.cache.open( url, headers, opener = self.throttled )
+
+
+def print_progress( job, done, total, rows ):
+    log.info( '%s: %d/%d ranges, %d candles', job, done, total, rows )
+
+
+class MicexISSBatch:
+    """ Scheduler of candle jobs over a shared worker pool.
+    """
+
+    def __init__( self, client, workers = None, requests_per_second = None, progress = print_progress ):
+        """ client: MicexISSClient whose opener (pool, auth, cache) is used
+            workers: number of worker threads, Config.max_workers by default
+            requests_per_second: limit of the request rate toward ISS, None - no limit
+            progress: called as progress( job, doneRanges, totalRanges, candles ) or None
+        """
+        opener = client.opener
+        if requests_per_second:
+            if isinstance( opener, MicexISSCache ):
+                # the limit goes under the cache as in make_opener, cache hits take no tokens
+                opener = CacheOverThrottle( opener, TokenBucket( requests_per_second ) )
+            else:
+                opener = ThrottledOpener( opener, TokenBucket( requests_per_second ) )
+        self.client = MicexISSClient( client.config, MicexISSDataHandler, list, opener = opener )
+        self.workers = workers or client.config.max_workers
+        self.progress = progress
+
+    def run( self, jobs ):
+        """ Download all the jobs, given as CandleJob or as tuples
+        ( engine, market, board, security, timeFrame ). Returns the jobs;
+        job.fname is the saved file, job.error the exception if it failed.
+        """
+        jobs = [ job if isinstance( job, CandleJob ) else CandleJob( *job ) for job in jobs ]
+        with concurrent.futures.ThreadPoolExecutor( max_workers = self.workers ) as pool:
+            for job, future in [ ( job, pool.submit( self.plan, job ) ) for job in jobs ]:
+                try:
+                    future.result()
+                except Exception as e:
+                    job.error = e
+
+            # round-robin over the jobs: first ranges of all jobs, then the second ones...
+            tasks = [ task for task in itertools.chain.from_iterable(
+                          itertools.zip_longest( *[ [ ( job, i ) for i in range( len( job.ranges ) ) ]
+                                                    for job in jobs if job.error is None ] ) )
+                      if task is not None ]
+            tasks = iter( tasks )
+            running = {}
+
+            def submit():
+                for job, i in tasks:
+                    if job.error is None:
+                        running[ pool.submit( self.fetch, job, i ) ] = ( job, i )
+                        return
+
+            for _ in range( 2 * self.workers ):
+                submit()
+            while running:
+                done, _ = concurrent.futures.wait( running, return_when = concurrent.futures.FIRST_COMPLETED )
+                for future in done:
+                    job, i = running.pop( future )
+                    try:
+                        self.store( job, i, future.result() )
+                    except Exception as e:
+                        job.error = e
+                    submit()
+
+        for job in jobs:
+            if job.out is not None:
+                job.out.close()
+        return jobs
+
+    def plan( self, job ):
+        """ Find the window of the job and cut it into date ranges.
+        """
+        first, last = job.dateFrom, job.dateTill
+        if first == '' or last == '':
+            limits = self.client.get_security_candleborders( job.engine, job.market, job.board,
+                                                             job.security, ( job.timeFrame, ) )
+            if job.timeFrame not in limits:
+                raise ValueError( 'no candles of %s' % job )
+            first = first or limits[ job.timeFrame ][0][ :10 ]
+            last = last or limits[ job.timeFrame ][1][ :10 ]
+
+        ranges = None
+        if job.timeFrame in INTRADAY_TIMEFRAMES:
+            ranges = candle_date_ranges( job.dateFrom, job.dateTill, first, last,
+                                         days = RANGE_DAYS[ job.timeFrame ] )
+        job.ranges = ranges or [ ( job.dateFrom, job.dateTill ) ]
+        job.fname = '%s.%s.%s.%s.%s' % ( job.security, first, last, job.timeFrame, job.fmt )
+
+    def fetch( self, job, i ):
+        dataChunk = []
+        for page in self.client._iter_candle_pages( job.engine, job.market, job.board, job.security,
+                                                    job.ranges[ i ][0], job.ranges[ i ][1], job.timeFrame, False ):
+            dataChunk += page
+        return dataChunk
+
+    def store( self, job, i, dataChunk ):
+        """ Keep the finished range and write all the ranges which are
+        complete from the start of the job, dropping the candles of the
+        day shared with the previous range.
+        """
+        job.ready[ i ] = dataChunk
+        job.done += 1
+        if job.out is None:
+            if job.fmt == 'bin':
+                job.out = BinaryWriter( job.fname, 'candles', CANDLE_FIELDS, security = job.security,
+                                        board = job.board, timeframe = job.timeFrame )
+            else:
+                job.out = open( job.fname, 'w' )
+
+        while job.written in job.ready:
+            dataChunk = [ cd for cd in job.ready.pop( job.written ) if cd[6] > job.lastBegin ]
+            if dataChunk:
+                job.lastBegin = dataChunk[-1][6]
+            if job.fmt == 'bin':
+                job.out.write_rows( [ candle_record( cd ) for cd in dataChunk ] )
+            else:
+                job.out.write( ''.join( [ CANDLE_LINE % tuple( cd ) for cd in dataChunk ] ) )
+            job.rows += len( dataChunk )
+            job.written += 1
+
+        if self.progress is not None:
+            self.progress( job, job.done, len( job.ranges ), job.rows )
@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+"""
+    Throughput benchmarks of MicexISSClient against the local mock server
+    (iss_mock_server), no access to iss.moex.com is needed.
+
+    The server runs in its own process and every benchmark runs in a fresh
+    process, so the peak RSS reported is the one of that benchmark only.
+    Requests and bytes are counted on the client side, bytes are the ones
+    of the reply bodies.
+
+        python iss_bench.py --trades 200000 --days 60 --workers 4 --latency 0.01
+        python iss_bench.py --only trades,candles --format csv
+        python iss_bench.py --parse
+
+    --parse times only the parsing of a page of trades, json.loads of the
+    whole body against iss_json_stream, without the server.
+"""
+
+import argparse
+import io
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+import iss_mock_server
+from iss_json_stream import iter_rows
+from iss_simple_client import ( Config, MicexISSClient, MicexISSDataHandler, make_opener,
+                                TRADE_COLUMNS, TRADES_PAGE_SIZE )
+from iss_mock_server import MockISSServer, LAST_DAY, trading_days
+
+
+class CountingOpener:
+    """ Opener counting the requests and the bytes of the replies read.
+    """
+
+    def __init__( self, opener ):
+        self.opener = opener
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+
+    def open( self, url, headers = None ):
+        res = self.opener.open( url, headers )
+        with self.lock:
+            self.requests += 1
+        return CountingResponse( res, self )
+
+    def add( self, size ):
+        with self.lock:
+            self.bytes += size
+
+
+class CountingResponse:
+    def __init__( self, res, counter ):
+        self.res = res
+        self.counter = counter
+
+    def read( self, *args ):
+        data = self.res.read( *args )
+        self.counter.add( len( data ) )
+        return data
+
+    def __getattr__( self, name ):
+        return getattr( self.res, name )
+
+
+class RowCounter( MicexISSDataHandler ):
+    """ Handler keeping only the number of rows passed to it.
+    """
+
+    def __init__( self ):
+        self.rows = 0
+
+    def do( self, market_data ):
+        self.rows += len( market_data )
+
+
+def bench_trades( client, args ):
+    client.get_trades_for_session( 'futures', 'forts', 'RIH8', 1, workers = args.workers )
+    return client.handler.rows
+
+
+def bench_candles( client, args ):
+    return len( client.get_security_candles( 'stock', 'shares', 'TQBR', 'SBER', '', '', 'm1',
+                                             workers = args.workers ) )
+
+
+def bench_save_candles( client, args ):
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        os.chdir( tmp )
+        try:
+            client.save_security_candles( 'stock', 'shares', 'TQBR', 'SBER', 'm1', workers = args.workers )
+            fname, = os.listdir( tmp )
+            with open( fname ) as f:
+                return sum( 1 for line in f )
+        finally:
+            os.chdir( cwd )
+
+
+def bench_history( client, args ):
+    for date in trading_days( LAST_DAY, args.days ):
+        client.get_history_securities( 'stock', 'shares', 'TQBR', date )
+    return client.handler.rows
+
+
+BENCHMARKS = ( ( 'trades', bench_trades ),
+               ( 'candles', bench_candles ),
+               ( 'save_candles', bench_save_candles ),
+               ( 'history', bench_history ) )
+
+
+def peak_rss():
+    """ Peak resident set size of this process in bytes or None.
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage( resource.RUSAGE_SELF ).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def run_benchmark( name, url, args ):
+    """ Run one benchmark in this process, return its measurements.
+    """
+    config = Config( max_workers = args.workers, pool_size = max( args.workers, 4 ), iss_url = url,
+                     iss_format = args.format, select_columns = not args.all_columns )
+    opener = CountingOpener( make_opener( config ) )
+    client = MicexISSClient( config, RowCounter(), None, opener = opener )
+    stdout = sys.stdout
+    sys.stdout = open( os.devnull, 'w' )
+    try:
+        started = time.perf_counter()
+        rows = dict( BENCHMARKS )[ name ]( client, args )
+        seconds = time.perf_counter() - started
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    return { 'name': name, 'rows': rows, 'requests': opener.requests, 'bytes': opener.bytes,
+             'seconds': seconds, 'rss': peak_rss() }
+
+
+def serve( conn, args ):
+    server = MockISSServer( latency = args.latency, trades = args.trades, days = args.days,
+                            securities = args.securities )
+    # the series are made before the measurements
+    for prevSession in ( 0, 1 ):
+        server.data.session( 'RIH8', prevSession )
+    server.data.border_rows( 'SBER' )
+    conn.send( server.url )
+    server.serve_forever()
+
+
+def print_result( r ):
+    seconds = max( r[ 'seconds' ], 1e-9 )
+    rss = '%.1f' % ( r[ 'rss' ] / 2**20 ) if r[ 'rss' ] is not None else '-'
+    print( '%-13s %10d %9d %9.1f %8.2f %11.0f %8.1f %8.2f %10s' % (
+           r[ 'name' ], r[ 'rows' ], r[ 'requests' ], r[ 'bytes' ] / 2**20, r[ 'seconds' ],
+           r[ 'rows' ] / seconds, r[ 'requests' ] / seconds, r[ 'bytes' ] / 2**20 / seconds, rss ) )
+
+
+def parse_loads( body, block, columns ):
+    """ Rows of the block as the client got them before iss_json_stream.
+    """
+    jdata = json.loads( body.decode( 'utf-8' ) )[ block ]
+    idx = [ jdata[ 'columns' ].index( col ) for col in columns ]
+    return [ tuple( row[i] for i in idx ) for row in jdata[ 'data' ] ]
+
+
+def bench_parse( number = 50 ):
+    """ Milliseconds to parse a page of trades with all the columns and
+    with the columns of the client only (Config.select_columns).
+    """
+    data = iss_mock_server.MockISSData( trades = TRADES_PAGE_SIZE )
+    rows = data.trade_rows( 'RIH8', { 'previous_session': '1' } )
+    print( '%-13s %9s %12s %12s' % ( 'page', 'KB', 'json.loads', 'json_stream' ) )
+    for name, query in ( ( 'all columns', {} ), ( '%d columns' % len( TRADE_COLUMNS ),
+                                                  { 'trades.columns': ','.join( TRADE_COLUMNS ) } ) ):
+        body, contentType = iss_mock_server.encode_reply( [ ( 'trades', iss_mock_server.TRADE_COLUMNS, rows ) ],
+                                                          query, '.json' )
+        loads = lambda: parse_loads( io.BytesIO( body ).read(), 'trades', TRADE_COLUMNS )
+        stream = lambda: list( iter_rows( io.BytesIO( body ), 'trades', TRADE_COLUMNS ) )
+        if loads() != stream():
+            raise AssertionError( 'the parsers give different rows' )
+        times = [ min( timeit.repeat( func, number = number, repeat = 5 ) ) / number for func in ( loads, stream ) ]
+        print( '%-13s %9.0f %12.2f %12.2f' % ( name, len( body ) / 1024, times[0] * 1000, times[1] * 1000 ) )
+
+
+def main():
+    parser = argparse.ArgumentParser( description = 'Benchmarks of MicexISSClient with the local mock ISS' )
+    parser.add_argument( '--only', default = '', help = 'comma separated benchmarks: ' +
+                         ', '.join( name for name, func in BENCHMARKS ) )
+    parser.add_argument( '--workers', type = int, default = 1 )
+    parser.add_argument( '--latency', type = float, default = 0.0, help = 'delay of every reply, seconds' )
+    parser.add_argument( '--trades', type = int, default = 200000, help = 'trades in a session' )
+    parser.add_argument( '--days', type = int, default = 60, help = 'trading days of candles and history' )
+    parser.add_argument( '--securities', type = int, default = 300, help = 'securities of a board in history' )
+    parser.add_argument( '--format', choices = ( 'json', 'csv' ), default = 'json' )
+    parser.add_argument( '--all-columns', action = 'store_true', help = 'don\'t select the columns on the server' )
+    parser.add_argument( '--parse', action = 'store_true', help = 'time the parsing of a page only' )
+    args = parser.parse_args()
+
+    if args.parse:
+        bench_parse()
+        return
+
+    names = [ name for name, func in BENCHMARKS if not args.only or name in args.only.split( ',' ) ]
+
+    # fresh interpreters: nothing is inherited, RSS of each benchmark is its own
+    ctx = multiprocessing.get_context( 'spawn' )
+    conn, childConn = ctx.Pipe()
+    server = ctx.Process( target = serve, args = ( childConn, args ), daemon = True )
+    server.start()
+    url = conn.recv()
+
+    print( '%-13s %10s %9s %9s %8s %11s %8s %8s %10s' % ( 'benchmark', 'rows', 'requests', 'MB', 'seconds',
+                                                       'rows/s', 'req/s', 'MB/s', 'peak RSS MB' ) )
+    try:
+        for name in names:
+            with ctx.Pool( 1, maxtasksperchild = 1 ) as pool:
+                print_result( pool.apply( run_benchmark, ( name, url, args ) ) )
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
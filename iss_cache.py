@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+"""
+    On-disk cache of ISS replies which can't change any more.
+
+    The cache wraps an opener (MicexHTTPPool) and has the same open( url )
+    call. Replies are stored zlib-compressed under the SHA-1 of the full
+    request URL. The total size is bounded; the least recently used
+    entries are removed first.
+
+    Only the requests for the past are cached:
+      - trades pages of a previous session requested by tradeno;
+      - history of securities for a date at least HISTORY_MARGIN_DAYS
+        (iss_time) ago, as ISS may publish it later, and only a page
+        with rows: an empty one may be a day not published yet;
+      - candles with 'till' before the current period of their interval:
+        the current day for intraday and daily candles, the current week,
+        month or quarter for W1, M1 and Q1, whose last candle still changes.
+    The Content-Type of the reply is kept with the body, so a cached CSV
+    reply is decoded with the same charset as a live one.
+    Current session, today's data and open-ended requests always go to ISS.
+"""
+
+import datetime
+import hashlib
+import http.client
+import io
+import json
+import os
+import threading
+import time
+import urllib.parse
+import zlib
+
+from iss_time import last_final_history_date, msk_today
+
+
+class CachedResponse( io.BytesIO ):
+    """ Reply read from the cache (or stored into it) with the interface of a response.
+    """
+
+    status = 200
+    reason = 'OK'
+
+    def __init__( self, data, url, contentType = '' ):
+        super().__init__( data )
+        self.url = url
+        self.headers = http.client.HTTPMessage()
+        if contentType:
+            self.headers[ 'Content-Type' ] = contentType
+
+    def info( self ):
+        return self.headers
+
+    def getheader( self, name, default = None ):
+        return self.headers.get( name, default )
+
+    def geturl( self ):
+        return self.url
+
+    def __repr__( self ):
+        return '<CachedResponse %d bytes %s>' % ( len( self.getbuffer() ), self.url )
+
+
+# interval codes of candles and the periods whose last candle isn't final while they last
+_candlePeriods = { 1: 'D', 10: 'D', 60: 'D', 24: 'D', 7: 'W', 31: 'M', 4: 'Q' }
+
+
+def period_start( date, period ):
+    """ First day ('YYYY-MM-DD') of the day, week, month or quarter ('D', 'W', 'M', 'Q') of date.
+    """
+    day = datetime.date.fromisoformat( date )
+    if period == 'W':
+        day -= datetime.timedelta( days = day.weekday() )
+    elif period == 'M':
+        day = day.replace( day = 1 )
+    elif period == 'Q':
+        day = day.replace( month = ( day.month - 1 ) // 3 * 3 + 1, day = 1 )
+    return day.isoformat()
+
+
+def is_immutable( url, today = None ):
+    """ Freshness policy: True if the reply for url can be cached forever.
+    """
+    if today is None:
+        today = msk_today()
+    parts = urllib.parse.urlsplit( url )
+    query = dict( urllib.parse.parse_qsl( parts.query, keep_blank_values = True ) )
+    # the same policy for JSON and CSV replies
+    path = parts.path.rsplit( '.', 1 )[0]
+
+    if path.endswith( '/trades' ):
+        # previous_session counts back from today, so only the pages
+        # requested by tradeno keep their meaning on the next days
+        return 'tradeno' in query and int( query.get( 'previous_session', '0' ) ) > 0
+    if path.startswith( '/iss/history/' ):
+        date = query.get( 'date', '' )
+        return date != '' and date[ :10 ] <= last_final_history_date( today )
+    if path.endswith( '/candles' ):
+        till = query.get( 'till', '' )
+        # ISS takes 10 minutes if there is no interval
+        period = _candlePeriods.get( int( query.get( 'interval', '' ) or 10 ) )
+        return till != '' and period is not None and till[ :10 ] < period_start( today, period )
+    return False
+
+
+def has_history_rows( data ):
+    """ True if the 'history' block of a JSON or CSV reply has rows.
+    """
+    if data.lstrip()[ :1 ] == b'{':
+        try:
+            return bool( json.loads( data )[ 'history' ][ 'data' ] )
+        except ( ValueError, KeyError, TypeError ):
+            return False
+    lines = iter( data.splitlines() )
+    for line in lines:
+        if line.strip() == b'history':
+            break
+    # the column names after the empty line, then the rows up to an empty line
+    header = next( ( line for line in lines if line.strip() ), b'' )
+    return header != b'' and next( lines, b'' ).strip() != b''
+
+
+class MicexISSCache:
+    """ Content-addressed LRU cache of immutable ISS replies on disk.
+    """
+
+    def __init__( self, opener, path, max_bytes = 1 << 30, level = 6 ):
+        """ opener: object with open( url ) method to get missing replies
+            path: cache directory
+            max_bytes: limit for the total size of compressed entries
+            level: zlib compression level
+        """
+        self.opener = opener
+        self.path = path
+        self.max_bytes = max_bytes
+        self.level = level
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        # file name -> [ size, last use time ]
+        self.entries = {}
+        self.total = 0
+        os.makedirs( path, exist_ok = True )
+        for fname in os.listdir( path ):
+            if fname.endswith( '.z' ):
+                st = os.stat( os.path.join( path, fname ) )
+                self.entries[ fname ] = [ st.st_size, st.st_mtime ]
+                self.total += st.st_size
+        for name in self._evict():
+            os.remove( os.path.join( path, name ) )
+
+    def open( self, url, headers = None, opener = None ):
+        """ Reply for url from the cache or from opener (self.opener by default).
+        """
+        opener = opener or self.opener
+        if not is_immutable( url ):
+            return opener.open( url, headers )
+
+        cached = self.get( url )
+        if cached is not None:
+            return CachedResponse( cached[1], url, cached[0] )
+
+        res = opener.open( url, headers )
+        data = res.read()
+        contentType = res.getheader( 'Content-Type', '' ) if hasattr( res, 'getheader' ) else ''
+        if not urllib.parse.urlsplit( url ).path.startswith( '/iss/history/' ) or has_history_rows( data ):
+            self.put( url, data, contentType )
+        return CachedResponse( data, url, contentType )
+
+    def get( self, url ):
+        """ Return the cached ( content type, body ) of the reply for url or None.
+        """
+        fname = self._fname( url )
+        with self.lock:
+            entry = self.entries.get( fname )
+            if entry is None:
+                self.misses += 1
+                return None
+            entry[1] = time.time()
+            self.hits += 1
+        fpath = os.path.join( self.path, fname )
+        try:
+            with open( fpath, 'rb' ) as f:
+                contentType, _, data = zlib.decompress( f.read() ).partition( b'\n' )
+            # mtime keeps the last use between runs
+            os.utime( fpath )
+        except ( OSError, zlib.error ):
+            self._remove( fname )
+            return None
+        return contentType.decode( 'latin-1' ), data
+
+    def put( self, url, data, contentType = '' ):
+        """ Store the body of the reply for url after a line with its content type.
+        """
+        fname = self._fname( url )
+        packed = zlib.compress( contentType.encode( 'latin-1' ) + b'\n' + data, self.level )
+        fpath = os.path.join( self.path, fname )
+        tmp = '%s.%d.%d.tmp' % ( fpath, os.getpid(), threading.get_ident() )
+        with open( tmp, 'wb' ) as f:
+            f.write( packed )
+        os.replace( tmp, fpath )
+
+        with self.lock:
+            old = self.entries.get( fname )
+            if old is not None:
+                self.total -= old[0]
+            self.entries[ fname ] = [ len( packed ), time.time() ]
+            self.total += len( packed )
+            evicted = self._evict()
+        for name in evicted:
+            try:
+                os.remove( os.path.join( self.path, name ) )
+            except OSError:
+                pass
+
+    def clear( self ):
+        with self.lock:
+            names = list( self.entries )
+        for name in names:
+            self._remove( name )
+
+    def _evict( self ):
+        """ Drop the least recently used entries from the index
+        until the size limit holds; returns their file names.
+        """
+        if self.total <= self.max_bytes:
+            return []
+        evicted = []
+        for name, entry in sorted( self.entries.items(), key = lambda item: item[1][1] ):
+            if self.total <= self.max_bytes:
+                break
+            del self.entries[ name ]
+            self.total -= entry[0]
+            evicted.append( name )
+        return evicted
+
+    def _remove( self, fname ):
+        with self.lock:
+            entry = self.entries.pop( fname, None )
+            if entry is not None:
+                self.total -= entry[0]
+        try:
+            os.remove( os.path.join( self.path, fname ) )
+        except OSError:
+            pass
+
+    @staticmethod
+    def _fname( url ):
+        # entries of the format without the content type are never found and age out
+        return hashlib.sha1( ( 'v2 ' + url ).encode( 'utf-8' ) ).hexdigest() + '.z'
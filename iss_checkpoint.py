@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+"""
+    Checkpoints of long downloads saved to files.
+
+    A download writing to a file with resume = True saves its cursor (the
+    next tradeno, the last candle saved...) and the size of the output
+    after every page into <output>.ckpt. When it is started again with
+    resume = True and the checkpoint belongs to the same task, the output
+    is cut back to the saved size and the download goes on from the
+    cursor. The checkpoint is removed when the download is complete.
+    Without resume no checkpoint is saved, and the output isn't synced
+    after every page.
+"""
+
+import json
+import os
+
+
+class Checkpoint:
+    """ State of the download of a task into the file fname.
+    """
+
+    def __init__( self, fname, task ):
+        """ fname: output file of the download
+            task: dict with the parameters identifying the download
+        """
+        self.fname = fname + '.ckpt'
+        self.task = task
+
+    def load( self ):
+        """ Saved state as a dict, or None if there is no checkpoint of this task.
+        """
+        try:
+            with open( self.fname ) as f:
+                saved = json.load( f )
+        except ( OSError, ValueError ):
+            return None
+        if saved.get( 'task' ) != self.task:
+            return None
+        return saved[ 'state' ]
+
+    def save( self, **state ):
+        """ Replace the saved state. The output must be flushed before.
+        """
+        tmp = self.fname + '.tmp'
+        with open( tmp, 'w' ) as f:
+            json.dump( { 'task': self.task, 'state': state }, f )
+        os.replace( tmp, self.fname )
+
+    def remove( self ):
+        try:
+            os.remove( self.fname )
+        except OSError:
+            pass
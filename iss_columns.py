@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+    Columnar containers for trades and candles downloaded from ISS.
+
+    Rows are kept in typed NumPy arrays, one per column, instead of
+    Python tuples or lists. The arrays grow geometrically, so appending
+    a page costs amortized O(page) and no Python object is kept per row.
+
+    NumPy is needed only for this module.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from iss_time import iss_times_to_epoch
+
+INITIAL_CAPACITY = 1024
+
+
+class ColumnBuffer:
+    """ Set of growable typed columns of equal length.
+    Columns are available as buffer[ name ] or buffer.name,
+    both are views of the filled part of the arrays.
+    """
+
+    # ( name, dtype ) of every column, set by subclasses
+    fields = ()
+
+    def __init__( self, capacity = INITIAL_CAPACITY ):
+        if np is None:
+            raise ImportError( 'numpy is required for the columnar mode' )
+        self.size = 0
+        self.arrays = { name: np.empty( capacity, dtype ) for name, dtype in self.fields }
+
+    def __len__( self ):
+        return self.size
+
+    def __getitem__( self, name ):
+        return self.arrays[ name ][ :self.size ]
+
+    def __getattr__( self, name ):
+        arrays = self.__dict__.get( 'arrays' )
+        if arrays is None or name not in arrays:
+            raise AttributeError( name )
+        return arrays[ name ][ :self.size ]
+
+    def reserve( self, size ):
+        """ Make room for size rows, at least doubling the capacity.
+        """
+        capacity = len( self.arrays[ self.fields[0][0] ] )
+        if size <= capacity:
+            return
+        capacity = max( size, 2 * capacity )
+        for name, arr in self.arrays.items():
+            grown = np.empty( capacity, arr.dtype )
+            grown[ :self.size ] = arr[ :self.size ]
+            self.arrays[ name ] = grown
+
+    def append_columns( self, columns ):
+        """ Append equal length sequences given in the order of fields.
+        """
+        count = len( columns[0] )
+        self.reserve( self.size + count )
+        for ( name, dtype ), values in zip( self.fields, columns ):
+            self.arrays[ name ][ self.size: self.size + count ] = values
+        self.size += count
+
+    def extend( self, other ):
+        """ Append all the rows of another buffer of the same kind.
+        """
+        self.append_columns( [ other[ name ] for name, dtype in self.fields ] )
+
+    def trim( self ):
+        """ Release the unused capacity.
+        """
+        for name in self.arrays:
+            self.arrays[ name ] = self.arrays[ name ][ :self.size ].copy()
+
+
+class TradeColumns( ColumnBuffer ):
+    """ Trades as columns: time (epoch seconds), price, qty, tradeno.
+    """
+
+    fields = ( ( 'time', 'int64' ),
+               ( 'price', 'float64' ),
+               ( 'qty', 'int64' ),
+               ( 'tradeno', 'int64' ) )
+
+    def append_rows( self, rows ):
+        """ Append a page of ( SYSTIME, PRICE, QUANTITY, TRADENO ) rows as they come from ISS.
+        """
+        if len( rows ) == 0:
+            return
+        systime, price, qty, tradeno = zip( *rows )
+        self.append_columns( ( iss_times_to_epoch( systime ),
+                               nulls_to_zero( price, 'float64' ),
+                               nulls_to_zero( qty, 'int64' ),
+                               nulls_to_zero( tradeno, 'int64' ) ) )
+
+
+class CandleColumns( ColumnBuffer ):
+    """ Candles as columns: open, close, high, low, value, volume and
+    begin, end as UTC datetime64[s].
+    """
+
+    fields = ( ( 'open', 'float64' ),
+               ( 'close', 'float64' ),
+               ( 'high', 'float64' ),
+               ( 'low', 'float64' ),
+               ( 'value', 'float64' ),
+               ( 'volume', 'float64' ),
+               ( 'begin', 'datetime64[s]' ),
+               ( 'end', 'datetime64[s]' ) )
+
+    def append_rows( self, rows ):
+        """ Append a page of [open, close, high, low, value, volume, begin, end] rows.
+        """
+        if len( rows ) == 0:
+            return
+        columns = list( zip( *rows ) )
+        self.append_columns( [ nulls_to_zero( col, 'float64' ) for col in columns[ :6 ] ] +
+                             [ iss_times_to_epoch( col ).astype( 'datetime64[s]' ) for col in columns[ 6: ] ] )
+
+
+def nulls_to_zero( values, dtype ):
+    """ Same as del_null over the whole column.
+    """
+    if None in values:
+        values = [ 0 if v is None else v for v in values ]
+    return np.array( values, dtype = dtype )
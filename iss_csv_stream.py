@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+"""
+    Incremental parser of ISS CSV replies.
+
+    A CSV reply (the same request with .csv instead of .json) has a block
+    per table: the block name on its own line, the column names and the
+    rows separated by ';', and an empty line after the last row:
+
+        trades
+
+        TRADENO;SYSTIME;PRICE;QUANTITY
+        1;2018-03-01 10:00:00;125000;1
+        ...
+
+    There is no quoting of numbers and no nested lists, so the rows are
+    cheaper to decode than JSON. The reply is read by pieces as in
+    iss_json_stream and only the requested columns are converted.
+"""
+
+import codecs
+import csv
+import functools
+import itertools
+
+
+CHUNK_SIZE = 64 * 1024
+# ISS sends CSV in windows-1251 unless the reply says otherwise
+DEFAULT_ENCODING = 'cp1251'
+
+
+def _iter_lines( res, chunkSize ):
+    """ Yield the decoded lines of the body without line ends.
+    """
+    encoding = DEFAULT_ENCODING
+    info = res.info() if hasattr( res, 'info' ) else None
+    if hasattr( info, 'get_content_charset' ):
+        encoding = info.get_content_charset() or encoding
+    textDecoder = codecs.getincrementaldecoder( encoding )()
+    tail = ''
+    while True:
+        data = res.read( chunkSize )
+        text = tail + textDecoder.decode( data, not data )
+        lines = text.split( '\n' )
+        tail = lines.pop()
+        for line in lines:
+            yield line.rstrip( '\r' )
+        if not data:
+            break
+    if tail:
+        yield tail.rstrip( '\r' )
+
+
+@functools.lru_cache( maxsize = 256 )
+def _converters( header, columns, types ):
+    """ ( position, type ) of the columns in the header line, found once
+    for all the pages of an endpoint.
+    """
+    jcols = next( csv.reader( [ header ], delimiter = ';' ) )
+    try:
+        return tuple( ( jcols.index( col ), conv ) for col, conv in zip( columns, types ) )
+    except ValueError:
+        raise ValueError( 'ISS reply: no columns %s in the block' % ( columns, ) )
+
+
+def iter_csv_rows( res, block, columns, types, chunkSize = CHUNK_SIZE ):
+    """ Yield the rows of the given block as tuples with the values of
+    the requested columns only, in the order of columns. Every value is
+    converted with the function from types at the same position, empty
+    values become None. res is anything with read( size ) method.
+    Raises ValueError if a column is missing in the reply.
+    """
+    lines = _iter_lines( res, chunkSize )
+    eof = False
+    try:
+        for line in lines:
+            if line.strip() == block:
+                break
+        else:
+            eof = True
+            return
+
+        header = next( ( line for line in lines if line.strip() ), '' )
+        convs = _converters( header, tuple( columns ), tuple( types ) )
+
+        for row in csv.reader( itertools.takewhile( lambda line: line.strip() != '', lines ), delimiter = ';' ):
+            yield tuple( None if row[ i ] == '' else conv( row[ i ] ) for i, conv in convs )
+
+        # read the rest of the body so the connection can be reused
+        for line in lines:
+            pass
+        eof = True
+    finally:
+        if not eof and hasattr( res, 'close' ):
+            res.close()
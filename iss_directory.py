@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+"""
+    Directory of engines, markets, boards and securities of ISS.
+
+    To request data of a security one has to know its engine, market and
+    board (see the links in iss_simple_main.py). MicexISSDirectory gets
+    these lists from ISS, keeps them in memory and in a JSON file, and
+    requests a list again only when it is older than ttl seconds. Once the
+    lists are loaded, questions like "where is RIH8 traded" are answered
+    without requests:
+
+        directory = MicexISSDirectory( iss, 'iss_directory.json' )
+        directory.find( 'RIH8' )                 # [ ( 'futures', 'forts', 'RFUD' ) ]
+        directory.boards( 'stock', 'shares' )    # [ ( 'TQBR', <title>, 1 ), ... ]
+
+    If ISS can't be reached, an outdated list is used with a warning.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+
+from iss_simple_client import ordered_map
+
+
+log = logging.getLogger( 'iss.directory' )
+
+# lists older than this number of seconds are requested again
+DIRECTORY_TTL = 24 * 3600
+
+ENGINE_COLUMNS = ( 'name', 'title' )
+MARKET_COLUMNS = ( 'NAME', 'title' )
+BOARD_COLUMNS = ( 'boardid', 'title', 'is_traded' )
+SECURITY_COLUMNS = ( 'SECID', 'BOARDID', 'SHORTNAME' )
+
+
+class MicexISSDirectory:
+    """ Lists of engines, markets, boards and securities with a persisted cache.
+    """
+
+    def __init__( self, client, fname = '', ttl = DIRECTORY_TTL ):
+        """ client: MicexISSClient used for the requests
+            fname: JSON file keeping the lists between runs, '' - memory only
+            ttl: age in seconds after which a list is requested again
+        """
+        self.client = client
+        self.fname = fname
+        self.ttl = ttl
+        self.lock = threading.RLock()
+        # 'engines', 'markets/<engine>', ... -> { 'time': epoch of the request, 'rows': [...] }
+        self.lists = {}
+        # SECID -> [ ( engine, market, board ) ], made from the loaded securities lists
+        self.index = None
+        if fname:
+            try:
+                with open( fname, encoding = 'utf-8' ) as f:
+                    self.lists = json.load( f )
+            except ( OSError, ValueError ):
+                pass
+
+    def engines( self ):
+        """ ( name, title ) of the engines.
+        """
+        return self._list( 'engines', 'engines', 'engines', {}, ENGINE_COLUMNS, ( str, str ) )
+
+    def markets( self, engine ):
+        """ ( name, title ) of the markets of the engine.
+        """
+        return self._list( 'markets/' + engine, 'markets', 'markets', { 'engine': engine },
+                           MARKET_COLUMNS, ( str, str ) )
+
+    def boards( self, engine, market ):
+        """ ( boardid, title, is_traded ) of the boards of the market.
+        """
+        return self._list( 'boards/%s/%s' % ( engine, market ), 'boards', 'boards',
+                           { 'engine': engine, 'market': market }, BOARD_COLUMNS, ( str, str, int ) )
+
+    def securities( self, engine, market ):
+        """ ( SECID, BOARDID, SHORTNAME ) of the securities of the market.
+        """
+        return self._list( 'securities/%s/%s' % ( engine, market ), 'market_secs', 'securities',
+                           { 'engine': engine, 'market': market }, SECURITY_COLUMNS, ( str, str, str ) )
+
+    def find( self, secId, engines = None ):
+        """ ( engine, market, board ) where the security is traded. The
+        securities of all the markets of the engines (all engines if None)
+        are loaded on the first call, later calls use the index.
+        """
+        markets = [ ( engine, market ) for engine in ( engines or [ row[0] for row in self.engines() ] )
+                    for market, title in self.markets( engine ) ]
+        with self.lock:
+            fresh = all( self._is_fresh( 'securities/%s/%s' % key ) for key in markets )
+        if not fresh:
+            # the markets are independent requests
+            for _ in ordered_map( lambda key: self.securities( *key ), markets, self.client.config.max_workers ):
+                pass
+        with self.lock:
+            if self.index is None:
+                self.index = self._make_index()
+            return [ place for place in self.index.get( secId, () ) if place[ :2 ] in markets ]
+
+    def refresh( self ):
+        """ Make all the lists outdated, they are requested again when needed.
+        """
+        with self.lock:
+            for saved in self.lists.values():
+                saved[ 'time' ] = 0
+
+    def _is_fresh( self, key ):
+        saved = self.lists.get( key )
+        return saved is not None and time.time() - saved[ 'time' ] < self.ttl
+
+    def _list( self, key, request, block, args, columns, types ):
+        """ Rows of the list key from the cache or from the block of the request.
+        """
+        with self.lock:
+            if self._is_fresh( key ):
+                return [ tuple( row ) for row in self.lists[ key ][ 'rows' ] ]
+        url = self.client.requests[ request ] % args
+        try:
+            rows = self.client._rows( url, block, columns, types )
+        except Exception as e:
+            with self.lock:
+                saved = self.lists.get( key )
+            if saved is None:
+                raise
+            log.warning( 'using the list of %s from %s: %r', key,
+                         time.strftime( '%Y-%m-%d %H:%M', time.localtime( saved[ 'time' ] ) ), e )
+            return [ tuple( row ) for row in saved[ 'rows' ] ]
+        with self.lock:
+            self.lists[ key ] = { 'time': time.time(), 'rows': rows }
+            if key.startswith( 'securities/' ):
+                self.index = None
+            self._save()
+        return rows
+
+    def _make_index( self ):
+        index = {}
+        for key, saved in self.lists.items():
+            if key.startswith( 'securities/' ):
+                engine, market = key.split( '/' )[ 1: ]
+                for secId, board, name in saved[ 'rows' ]:
+                    index.setdefault( secId, [] ).append( ( engine, market, board ) )
+        return index
+
+    def _save( self ):
+        if not self.fname:
+            return
+        tmp = '%s.%d.tmp' % ( self.fname, os.getpid() )
+        with open( tmp, 'w', encoding = 'utf-8' ) as f:
+            json.dump( self.lists, f, ensure_ascii = False )
+        os.replace( tmp, self.fname )
@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+"""
+    Bulk download of the history of whole boards over a range of dates.
+
+    The grid of ( board, date ) partitions is fetched by a pool of worker
+    threads, every partition with all its pages. Each day of a board is
+    kept as a binary file of iss_store in a partitioned tree:
+
+        <root>/<engine>/<market>/<board>/<YYYY>/<YYYY-MM-DD>.bin
+
+    A file is written under a temporary name and renamed when complete, so
+    a partition on disk is always whole and a re-run fetches only the
+    missing ones. A day without history (weekends, holidays) is kept as a
+    file without records, so it isn't requested again; this is done only
+    for the days at least HISTORY_MARGIN_DAYS (iss_time) ago, as the history
+    of the last days may be not published yet.
+
+        bulk = MicexISSHistoryBulk( iss, 'history', workers = 8 )
+        bulk.run( 'stock', 'shares', ( 'TQBR', 'TQTF' ), '2015-01-01', '2018-03-07' )
+        records = bulk.store.read( 'stock', 'shares', 'TQBR', '2018-01-01', '2018-03-07' )
+        records[ 'secid' ], records[ 'legalcloseprice' ], records[ 'date' ]...
+"""
+
+import concurrent.futures
+import datetime
+import logging
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from iss_simple_client import HISTORY_COLUMNS, HISTORY_TYPES
+from iss_store import BinaryWriter, load
+from iss_time import iss_day_to_epoch, last_final_history_date
+
+
+log = logging.getLogger( 'iss.history' )
+
+# bytes kept of the string columns, SECID is at most 36 characters
+STRING_SIZE = 36
+_storeTypes = { str: '|S%d' % STRING_SIZE, float: '<f8', int: '<i8' }
+
+
+def history_fields( columns, types ):
+    """ ( name, dtype ) of the stored records: the date of the partition
+    and the given ISS columns in lower case.
+    """
+    return ( ( 'date', '<M8[s]' ), ) + tuple( ( col.lower(), _storeTypes[ tp ] ) for col, tp in zip( columns, types ) )
+
+
+def date_range( dateFrom, dateTill ):
+    """ 'YYYY-MM-DD' dates from dateFrom to dateTill inclusive.
+    """
+    day = datetime.date.fromisoformat( dateFrom )
+    last = datetime.date.fromisoformat( dateTill )
+    dates = []
+    while day <= last:
+        dates.append( day.isoformat() )
+        day += datetime.timedelta( days = 1 )
+    return dates
+
+
+class HistoryStore:
+    """ Partitions of history saved under the root directory.
+    """
+
+    def __init__( self, root, columns = HISTORY_COLUMNS, types = HISTORY_TYPES ):
+        self.root = root
+        self.columns = columns
+        self.types = types
+        self.fields = history_fields( columns, types )
+
+    def path( self, engine, market, board, date ):
+        return os.path.join( self.root, engine, market, board, date[ :4 ], date + '.bin' )
+
+    def has( self, engine, market, board, date ):
+        return os.path.isfile( self.path( engine, market, board, date ) )
+
+    def write( self, engine, market, board, date, rows ):
+        """ Save the rows (tuples of the columns) of a day, replacing the partition at once.
+        """
+        fname = self.path( engine, market, board, date )
+        os.makedirs( os.path.dirname( fname ), exist_ok = True )
+        tmp = '%s.%d.tmp' % ( fname, os.getpid() )
+        day = iss_day_to_epoch( date )
+        with BinaryWriter( tmp, 'history', self.fields, engine = engine, market = market,
+                           board = board, date = date ) as out:
+            out.write_rows( [ ( day, ) + tuple( self._value( v, tp ) for v, tp in zip( row, self.types ) )
+                              for row in rows ] )
+        os.replace( tmp, fname )
+
+    @staticmethod
+    def _value( value, tp ):
+        if tp is str:
+            return ( value or '' ).encode( 'utf-8' )[ :STRING_SIZE ]
+        return 0 if value is None else value
+
+    def read( self, engine, market, board, dateFrom, dateTill ):
+        """ Records of the saved days from dateFrom to dateTill as one NumPy
+        structured array; string columns are bytes.
+        """
+        if np is None:
+            raise ImportError( 'numpy is required to read history' )
+        parts = [ load( self.path( engine, market, board, date ), 'history' )
+                  for date in date_range( dateFrom, dateTill ) if self.has( engine, market, board, date ) ]
+        parts = [ part for part in parts if len( part ) ]
+        if not parts:
+            return np.zeros( 0, list( self.fields ) )
+        return np.concatenate( parts )
+
+
+class MicexISSHistoryBulk:
+    """ Download of the history of boards over a grid of dates into a HistoryStore.
+    """
+
+    def __init__( self, client, root, workers = None, columns = HISTORY_COLUMNS, types = HISTORY_TYPES ):
+        """ client: MicexISSClient whose opener (pool, auth, cache, rate limit) is used
+            root: directory of the store
+            workers: number of worker threads, Config.max_workers by default
+            columns, types: ISS columns of the 'history' block to keep and their types
+        """
+        self.client = client
+        self.store = HistoryStore( root, columns, types )
+        self.workers = workers or client.config.max_workers
+
+    def run( self, engine, market, boards, dateFrom, dateTill ):
+        """ Fetch the missing partitions of the boards from dateFrom to dateTill.
+        Returns the counters: fetched (partitions with history), empty,
+        skipped (already saved) and failed.
+        """
+        # history of the last days may be not published yet
+        lastEmpty = last_final_history_date()
+        counts = { 'fetched': 0, 'empty': 0, 'skipped': 0, 'failed': 0 }
+        tasks = []
+        for date in date_range( dateFrom, dateTill ):
+            for board in boards:
+                if self.store.has( engine, market, board, date ):
+                    counts[ 'skipped' ] += 1
+                else:
+                    tasks.append( ( board, date ) )
+        log.info( '%d partitions to fetch, %d saved before', len( tasks ), counts[ 'skipped' ] )
+
+        with concurrent.futures.ThreadPoolExecutor( max_workers = self.workers ) as pool:
+            futures = { pool.submit( self.fetch, engine, market, board, date ): ( board, date )
+                        for board, date in tasks }
+            for future in concurrent.futures.as_completed( futures ):
+                board, date = futures[ future ]
+                try:
+                    rows = future.result()
+                except Exception as e:
+                    counts[ 'failed' ] += 1
+                    log.error( '%s %s failed: %r', board, date, e )
+                    continue
+                if rows:
+                    self.store.write( engine, market, board, date, rows )
+                    counts[ 'fetched' ] += 1
+                else:
+                    if date <= lastEmpty:
+                        self.store.write( engine, market, board, date, rows )
+                    counts[ 'empty' ] += 1
+                log.debug( '%s %s: %d securities', board, date, len( rows ) )
+        log.info( '%(fetched)d partitions fetched, %(empty)d empty, %(skipped)d skipped, %(failed)d failed', counts )
+        return counts
+
+    def fetch( self, engine, market, board, date ):
+        """ All the rows of the history of a board for a date.
+        """
+        url = self.client.requests[ 'history_secs' ] % { 'engine': engine, 'market': market,
+                                                         'board': board, 'date': date }
+        rows = []
+        pageSize = None
+        while True:
+            page = self.client._rows( url + '&start=' + str( len( rows ) ), 'history',
+                                      self.store.columns, self.store.types )
+            rows += page
+            # a page shorter than the first one is the last
+            if not page or ( pageSize is not None and len( page ) < pageSize ):
+                return rows
+            pageSize = pageSize or len( page )
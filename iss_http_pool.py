@@ -0,0 +1,194 @@
+#!/usr/bin/env python
+"""
+    Pool of persistent (keep-alive) HTTP connections used by the ISS client.
+
+    A urllib opener creates a new TCP+TLS connection for every request,
+    so during a pagination loop most of the time is spent on handshakes.
+    The pool keeps idle connections per host and reuses them for the
+    following requests. It understands the 'open( url )' call of an
+    opener, so it can be used in place of one.
+"""
+
+import http.client
+import io
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+REDIRECT_CODES = ( 301, 302, 303, 307, 308 )
+MAX_REDIRECTS = 5
+
+
+class PooledResponse:
+    """ Response returned by MicexHTTPPool.open. The connection goes
+    back to the pool as soon as the body has been read to the end.
+    """
+
+    def __init__( self, pool, key, conn, response, url, connect_time = 0.0 ):
+        self.pool = pool
+        self.key = key
+        self.conn = conn
+        self.response = response
+        self.url = url
+        self.status = response.status
+        self.reason = response.reason
+        self.headers = response.msg
+        # seconds spent to open the connection, 0 for a reused one
+        self.connect_time = connect_time
+
+    def read( self, amt = None ):
+        data = self.response.read( amt )
+        if self.response.isclosed():
+            self._release( reuse = True )
+        return data
+
+    def info( self ):
+        return self.headers
+
+    def geturl( self ):
+        return self.url
+
+    def getheader( self, name, default = None ):
+        return self.response.getheader( name, default )
+
+    def close( self ):
+        """ Closing before the end of the body makes the connection unusable
+        for the next request, so it is dropped in that case.
+        """
+        self._release( reuse = self.response.isclosed() )
+        self.response.close()
+
+    def _release( self, reuse ):
+        if self.conn is not None:
+            self.pool._put( self.key, self.conn, reuse )
+            self.conn = None
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *exc ):
+        self.close()
+
+    def __repr__( self ):
+        return '<PooledResponse %d %s>' % ( self.status, self.url )
+
+
+class MicexHTTPPool:
+    """ Reusable keep-alive connections grouped by (scheme, host, port).
+    """
+
+    def __init__( self, cookie_jar = None, pool_size = 4, timeout = 30, proxy_url = '', debug_level = 0 ):
+        """ cookie_jar: http.cookiejar.CookieJar shared with MicexAuth or None
+            pool_size: max number of idle connections kept per host;
+                       more connections are opened when needed but
+                       the extra ones are closed after use
+            timeout: socket timeout in seconds
+            proxy_url: proxy for plain http requests, http://proxy:port
+            debug_level: debug level of http.client connections
+        """
+        self.cookie_jar = cookie_jar
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.proxy = urllib.parse.urlsplit( proxy_url ) if proxy_url else None
+        self.debug_level = debug_level
+        self.idle = {}
+        self.lock = threading.Lock()
+
+    def open( self, url, headers = None ):
+        """ Send GET request and return PooledResponse. Redirects are
+        followed (without the Authorization header if the host changes),
+        HTTP errors raise urllib.error.HTTPError like an opener does.
+        """
+        headers = dict( headers or {} )
+        for _ in range( MAX_REDIRECTS + 1 ):
+            req = urllib.request.Request( url, headers = headers )
+            if self.cookie_jar is not None:
+                self.cookie_jar.add_cookie_header( req )
+            res = self._request( req )
+            if self.cookie_jar is not None:
+                self.cookie_jar.extract_cookies( res, req )
+
+            if res.status in REDIRECT_CODES and res.getheader( 'Location' ):
+                res.read()
+                target = urllib.parse.urljoin( url, res.getheader( 'Location' ) )
+                if urllib.parse.urlsplit( target ).netloc != urllib.parse.urlsplit( url ).netloc:
+                    # credentials are not sent to another host
+                    headers = { name: value for name, value in headers.items()
+                                if name.lower() != 'authorization' }
+                url = target
+                continue
+            if res.status >= 400:
+                body = res.read()
+                raise urllib.error.HTTPError( url, res.status, res.reason, res.headers, io.BytesIO( body ) )
+            return res
+        raise urllib.error.HTTPError( url, res.status, 'too many redirects', res.headers, None )
+
+    def close( self ):
+        """ Close all idle connections.
+        """
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def _request( self, req ):
+        parts = urllib.parse.urlsplit( req.full_url )
+        key = ( parts.scheme, parts.hostname, parts.port )
+        if self.proxy and parts.scheme == 'http':
+            # plain http goes through the proxy with the absolute URL
+            target = req.full_url
+        else:
+            target = parts.path + ( '?' + parts.query if parts.query else '' )
+
+        # a kept connection may have been closed by the server in the meantime,
+        # in this case the request is repeated once over a fresh connection
+        for attempt in ( 0, 1 ):
+            conn, reused = self._get( key )
+            connectTime = 0.0
+            try:
+                if not reused:
+                    started = time.perf_counter()
+                    conn.connect()
+                    connectTime = time.perf_counter() - started
+                conn.request( 'GET', target, headers = dict( req.header_items() ) )
+                response = conn.getresponse()
+            except ( http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError ):
+                conn.close()
+                if reused and attempt == 0:
+                    continue
+                raise
+            except Exception:
+                conn.close()
+                raise
+            return PooledResponse( self, key, conn, response, req.full_url, connectTime )
+
+    def _get( self, key ):
+        with self.lock:
+            conns = self.idle.get( key )
+            if conns:
+                return conns.pop(), True
+        return self._connect( key ), False
+
+    def _put( self, key, conn, reuse ):
+        if reuse:
+            with self.lock:
+                conns = self.idle.setdefault( key, [] )
+                if len( conns ) < self.pool_size:
+                    conns.append( conn )
+                    return
+        conn.close()
+
+    def _connect( self, key ):
+        scheme, host, port = key
+        if scheme == 'https':
+            conn = http.client.HTTPSConnection( host, port, timeout = self.timeout )
+        elif self.proxy:
+            conn = http.client.HTTPConnection( self.proxy.hostname, self.proxy.port, timeout = self.timeout )
+        else:
+            conn = http.client.HTTPConnection( host, port, timeout = self.timeout )
+        conn.set_debuglevel( self.debug_level )
+        return conn
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+"""
+    Incremental parser of ISS JSON replies.
+
+    An ISS reply looks like
+        { "trades": { "metadata": {...}, "columns": [...], "data": [ [...], ... ] }, ... }
+    Instead of reading the whole body, decoding it and building the nested
+    lists with json.loads, the reply is read by pieces of CHUNK_SIZE and
+    the complete rows of the 'data' block in a piece are decoded with one
+    json.loads. Only the requested columns are handed out, so neither the
+    body nor all the columns of a big page exist in memory as a whole.
+"""
+
+import codecs
+import functools
+import json
+import operator
+
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\n\r'
+# cuts of the rows in a piece tried before decoding the rows one by one
+BATCH_TRIES = 3
+
+_decoder = json.JSONDecoder()
+
+
+class _Reader:
+    """ Text buffer over a response with the JSON tokens needed to walk an ISS reply.
+    """
+
+    def __init__( self, res, chunkSize ):
+        self.res = res
+        self.chunkSize = chunkSize
+        self.textDecoder = codecs.getincrementaldecoder( 'utf-8' )()
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill( self ):
+        """ Append the next piece of the body to the buffer, drop the consumed part.
+        """
+        if self.eof:
+            return False
+        data = self.res.read( self.chunkSize )
+        if not data:
+            self.eof = True
+            self.buf = self.buf[ self.pos: ] + self.textDecoder.decode( b'', True )
+        else:
+            self.buf = self.buf[ self.pos: ] + self.textDecoder.decode( data )
+        self.pos = 0
+        return True
+
+    def peek( self ):
+        """ Skip whitespace and return the next char ('' at the end of the body).
+        """
+        while True:
+            while self.pos < len( self.buf ) and self.buf[ self.pos ] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len( self.buf ):
+                return self.buf[ self.pos ]
+            if not self.fill():
+                return ''
+
+    def expect( self, char ):
+        if self.peek() != char:
+            raise ValueError( 'ISS reply: "%s" expected at %d' % ( char, self.pos ) )
+        self.pos += 1
+
+    def skip( self, char ):
+        """ Consume the char if it comes next.
+        """
+        if self.peek() == char:
+            self.pos += 1
+            return True
+        return False
+
+    def value( self ):
+        """ Decode one complete JSON value. A value reaching the end of
+        the buffer may be cut (a number, for instance), so more data is
+        read before accepting it.
+        """
+        self.peek()
+        while True:
+            try:
+                obj, end = _decoder.raw_decode( self.buf, self.pos )
+            except json.JSONDecodeError:
+                if self.fill():
+                    continue
+                raise
+            if end >= len( self.buf ) and self.fill():
+                continue
+            self.pos = end
+            return obj
+
+    def rows( self ):
+        """ Decode the complete rows at the position with one json.loads:
+        the text up to the last ']' followed by ',' is taken as a list of rows.
+        ISS rows are flat, so that ']' ends a row unless it is in a string or
+        past the 'data' node; then the text doesn't decode and an earlier ']'
+        is tried. Returns None if no rows were decoded this way.
+        """
+        buf = self.buf
+        end = len( buf )
+        tries = BATCH_TRIES
+        while tries:
+            cut = buf.rfind( ']', self.pos, end )
+            if cut < 0:
+                return None
+            end = cut
+            comma = cut + 1
+            while comma < len( buf ) and buf[ comma ] in WHITESPACE:
+                comma += 1
+            if comma == len( buf ) or buf[ comma ] != ',':
+                continue
+            try:
+                rows = json.loads( '[' + buf[ self.pos:cut + 1 ] + ']' )
+            except ValueError:
+                tries -= 1
+                continue
+            self.pos = comma + 1
+            return rows
+        return None
+
+    def drain( self ):
+        while self.res.read( self.chunkSize ):
+            pass
+        self.eof = True
+
+
+def iter_rows( res, block, columns, chunkSize = CHUNK_SIZE ):
+    """ Yield the rows of the 'data' node of the given block as tuples
+    with the values of the requested columns only, in the order of columns.
+    res is anything with read( size ) method (a response or a file).
+    Raises ValueError if a column is missing in the reply.
+    """
+    reader = _Reader( res, chunkSize )
+    try:
+        reader.expect( '{' )
+        while not reader.skip( '}' ):
+            key = reader.value()
+            reader.expect( ':' )
+            if key == block:
+                yield from _iter_block( reader, columns )
+                # read the rest of the body so the connection can be reused
+                reader.drain()
+                return
+            reader.value()
+            reader.skip( ',' )
+    finally:
+        if not reader.eof and hasattr( res, 'close' ):
+            res.close()
+
+
+def _iter_block( reader, columns ):
+    jcols = None
+    getter = None
+    early = []
+    reader.expect( '{' )
+    while not reader.skip( '}' ):
+        key = reader.value()
+        reader.expect( ':' )
+        if key == 'columns':
+            jcols = reader.value()
+            getter = _make_getter( tuple( jcols ), tuple( columns ) )
+            # rows which came before the columns (not the case for ISS)
+            for row in early:
+                yield getter( row )
+            early = None
+        elif key == 'data':
+            reader.expect( '[' )
+            while not reader.skip( ']' ):
+                rows = reader.rows()
+                if rows is None:
+                    # a row cut by the end of the piece or the last one
+                    rows = [ reader.value() ]
+                    reader.skip( ',' )
+                if getter is not None:
+                    yield from map( getter, rows )
+                else:
+                    early += rows
+        else:
+            reader.value()
+        reader.skip( ',' )
+    if jcols is None:
+        raise ValueError( 'ISS reply: no columns in the block' )
+
+
+@functools.lru_cache( maxsize = 256 )
+def _make_getter( jcols, columns ):
+    """ Getter of the columns from a row with the columns jcols. All the
+    pages of an endpoint have the same columns, so it is made once.
+    """
+    idx = [ jcols.index( col ) for col in columns ]
+    if len( idx ) == 1:
+        return lambda row: ( row[ idx[0] ], )
+    return operator.itemgetter( *idx )
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+"""
+    Instrumentation of MicexISSClient.
+
+    Listeners added with MicexISSClient.add_listener get a RequestStats
+    for every request to ISS and the time of the stages done with the
+    rows after that: conversion of trades ('convert') and the calls of
+    the handler ('handler'). RequestMetrics collects all of them into
+    counters and histograms:
+
+        metrics = RequestMetrics()
+        iss.add_listener( metrics )
+        iss.get_trades_for_session( 'futures', 'forts', 'RIH8', 1 )
+        print( metrics.format() )
+        metrics.export( 'metrics.json' )
+
+    Rows are parsed while the body is being read, so the time of a request
+    is split as: connect (new connections only), ttfb (from sending the
+    request to the headers of the reply, waits of the rate limit included),
+    download (time in reads of the body) and parse (the rest of the time
+    spent in getting the rows). Replies from the disk cache have zero
+    connect and ttfb.
+"""
+
+import json
+import math
+import threading
+
+
+class RequestStats:
+    """ Measurements of one request.
+    """
+
+    __slots__ = ( 'url', 'connect', 'ttfb', 'download', 'parse', 'bytes', 'rows', 'error' )
+
+    def __init__( self, url ):
+        self.url = url
+        self.connect = 0.0
+        self.ttfb = 0.0
+        self.download = 0.0
+        self.parse = 0.0
+        self.bytes = 0
+        self.rows = 0
+        # exception if the request failed
+        self.error = None
+
+    @property
+    def seconds( self ):
+        return self.connect + self.ttfb + self.download + self.parse
+
+    def __repr__( self ):
+        return '<RequestStats %.3fs %d bytes %d rows %s>' % ( self.seconds, self.bytes, self.rows, self.url )
+
+
+class MicexISSListener:
+    """ Listener of the client which will be called with the measurements.
+    Methods are called from the threads doing the requests.
+    """
+
+    def on_request( self, stats ):
+        """ stats: RequestStats of a finished request.
+        """
+        pass
+
+    def on_stage( self, stage, seconds, rows ):
+        """ stage: 'convert' or 'handler'; rows: number of rows processed.
+        """
+        pass
+
+
+class Histogram:
+    """ Distribution of positive values in logarithmic buckets, BUCKETS per
+    doubling, so percentiles are exact within about 20%. Count, sum, min
+    and max are exact.
+    """
+
+    BUCKETS = 4
+
+    def __init__( self ):
+        self.buckets = {}
+        self.count = 0
+        self.sum = 0
+        self.min = None
+        self.max = None
+
+    def add( self, value ):
+        k = math.floor( math.log2( value ) * self.BUCKETS ) if value > 0 else None
+        self.buckets[ k ] = self.buckets.get( k, 0 ) + 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min( self.min, value )
+        self.max = value if self.max is None else max( self.max, value )
+
+    def percentile( self, q ):
+        """ Upper bound of the bucket holding the q-th percentile (0 < q <= 100).
+        """
+        if self.count == 0:
+            return None
+        rank = q / 100.0 * self.count
+        seen = self.buckets.get( None, 0 )
+        if seen >= rank:
+            return 0
+        for k in sorted( key for key in self.buckets if key is not None ):
+            seen += self.buckets[ k ]
+            if seen >= rank:
+                return min( 2 ** ( ( k + 1 ) / self.BUCKETS ), self.max )
+        return self.max
+
+    def summary( self ):
+        if self.count == 0:
+            return { 'count': 0 }
+        return { 'count': self.count, 'sum': self.sum, 'mean': self.sum / self.count,
+                 'min': self.min, 'max': self.max, 'p50': self.percentile( 50 ),
+                 'p90': self.percentile( 90 ), 'p99': self.percentile( 99 ) }
+
+
+class RequestMetrics( MicexISSListener ):
+    """ Counters and histograms of the requests and stages.
+    """
+
+    REQUEST_FIELDS = ( 'connect', 'ttfb', 'download', 'parse', 'seconds', 'bytes', 'rows' )
+
+    def __init__( self, keep = 0 ):
+        """ keep: number of the last RequestStats kept in self.last
+        """
+        self.lock = threading.Lock()
+        self.keep = keep
+        self.reset()
+
+    def reset( self ):
+        with self.lock:
+            self.requests = 0
+            self.errors = 0
+            self.bytes = 0
+            self.rows = 0
+            self.histograms = { 'request.' + name: Histogram() for name in self.REQUEST_FIELDS }
+            self.last = []
+
+    def on_request( self, stats ):
+        with self.lock:
+            self.requests += 1
+            if stats.error is not None:
+                self.errors += 1
+                return
+            self.bytes += stats.bytes
+            self.rows += stats.rows
+            for name in self.REQUEST_FIELDS:
+                self.histograms[ 'request.' + name ].add( getattr( stats, name ) )
+            if self.keep:
+                self.last.append( stats )
+                del self.last[ :-self.keep ]
+
+    def on_stage( self, stage, seconds, rows ):
+        with self.lock:
+            for name, value in ( ( 'seconds', seconds ), ( 'rows', rows ) ):
+                key = '%s.%s' % ( stage, name )
+                if key not in self.histograms:
+                    self.histograms[ key ] = Histogram()
+                self.histograms[ key ].add( value )
+
+    def summary( self ):
+        """ Counters and histogram summaries as a dict ready for JSON.
+        """
+        with self.lock:
+            return { 'requests': self.requests, 'errors': self.errors, 'bytes': self.bytes, 'rows': self.rows,
+                     'histograms': { name: h.summary() for name, h in sorted( self.histograms.items() ) } }
+
+    def export( self, fname ):
+        with open( fname, 'w' ) as f:
+            json.dump( self.summary(), f, indent = 2 )
+
+    def format( self ):
+        """ Summary as a text table.
+        """
+        summary = self.summary()
+        lines = [ 'requests: %(requests)d, errors: %(errors)d, bytes: %(bytes)d, rows: %(rows)d' % summary,
+                  '%-18s %8s %12s %12s %12s %12s %12s' % ( '', 'count', 'mean', 'p50', 'p90', 'p99', 'max' ) ]
+        for name, h in summary[ 'histograms' ].items():
+            if h[ 'count' ]:
+                lines.append( '%-18s %8d %12.6g %12.6g %12.6g %12.6g %12.6g' % (
+                              name, h[ 'count' ], h[ 'mean' ], h[ 'p50' ], h[ 'p90' ], h[ 'p99' ], h[ 'max' ] ) )
+        return '\n'.join( lines )
@@ -0,0 +1,446 @@
+#!/usr/bin/env python
+"""
+    Local stand-in for ISS serving synthetic data.
+
+    The server answers the requests of MicexISSClient the way ISS does:
+      - trades of the current and previous sessions, paged by the tradeno
+        cursor or the 'start' offset, up to 5000 rows per page, 'reversed';
+      - candles of 1, 10, 60 minutes and days, filtered by from/till and
+        paged by 'start', 500 per page, 'iss.reverse';
+      - candleborders;
+      - history of the securities of a board for a date, 100 per page;
+      - engines, markets, boards and securities of a market (DIRECTORY).
+    Replies have all the columns and the metadata of the real ones, as JSON
+    or CSV, and follow iss.only, iss.meta=off and <block>.columns. Every
+    reply can be delayed to imitate the network, a share of the requests
+    can be answered with 503 to try the retries of the client.
+
+    Data is made up from a fixed seed, so every run serves the same rows.
+
+        server = MockISSServer( trades = 200000, latency = 0.005 )
+        server.start()
+        iss = MicexISSClient( Config( iss_url = server.url ), MyDataHandler, MyData )
+        ...
+        server.stop()
+
+    or from the command line:
+
+        python iss_mock_server.py --port 8080 --trades 200000
+"""
+
+import argparse
+import bisect
+import datetime
+import http.server
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+
+TRADES_PAGE_SIZE = 5000
+CANDLES_PAGE_SIZE = 500
+HISTORY_PAGE_SIZE = 100
+# last trading day of the data; previous_session = 0 is this day
+LAST_DAY = '2018-03-07'
+SESSIONS = 2
+# main session 10:00 - 18:45 Moscow time
+SESSION_START = 10 * 3600
+SESSION_SECONDS = 8 * 3600 + 45 * 60
+
+TRADE_COLUMNS = ( ( 'TRADENO', 'int64' ), ( 'BOARDNAME', 'string' ), ( 'SECID', 'string' ),
+                  ( 'TRADEDATE', 'date' ), ( 'TRADETIME', 'time' ), ( 'PRICE', 'double' ),
+                  ( 'QUANTITY', 'int32' ), ( 'SYSTIME', 'datetime' ), ( 'RECNO', 'int64' ),
+                  ( 'OI_CHANGE', 'int32' ), ( 'SESSIONID', 'int32' ), ( 'BUYSELL', 'string' ) )
+CANDLE_COLUMNS = ( ( 'open', 'double' ), ( 'close', 'double' ), ( 'high', 'double' ), ( 'low', 'double' ),
+                   ( 'value', 'double' ), ( 'volume', 'double' ), ( 'begin', 'datetime' ), ( 'end', 'datetime' ) )
+BORDER_COLUMNS = ( ( 'begin', 'datetime' ), ( 'end', 'datetime' ), ( 'interval', 'int32' ),
+                   ( 'board_group_id', 'int32' ) )
+HISTORY_COLUMNS = ( ( 'BOARDID', 'string' ), ( 'TRADEDATE', 'date' ), ( 'SHORTNAME', 'string' ),
+                    ( 'SECID', 'string' ), ( 'NUMTRADES', 'double' ), ( 'VALUE', 'double' ),
+                    ( 'OPEN', 'double' ), ( 'LOW', 'double' ), ( 'HIGH', 'double' ),
+                    ( 'LEGALCLOSEPRICE', 'double' ), ( 'WAPRICE', 'double' ), ( 'CLOSE', 'double' ),
+                    ( 'VOLUME', 'double' ), ( 'MARKETPRICE2', 'double' ), ( 'MARKETPRICE3', 'double' ),
+                    ( 'ADMITTEDQUOTE', 'double' ), ( 'MP2VALTRD', 'double' ),
+                    ( 'MARKETPRICE3TRADESVALUE', 'double' ), ( 'ADMITTEDVALUE', 'double' ),
+                    ( 'WAVAL', 'double' ) )
+CURSOR_COLUMNS = ( ( 'INDEX', 'int64' ), ( 'TOTAL', 'int64' ), ( 'PAGESIZE', 'int64' ) )
+ENGINE_COLUMNS = ( ( 'id', 'int32' ), ( 'name', 'string' ), ( 'title', 'string' ) )
+MARKET_COLUMNS = ( ( 'id', 'int32' ), ( 'NAME', 'string' ), ( 'title', 'string' ) )
+BOARD_COLUMNS = ( ( 'id', 'int32' ), ( 'board_group_id', 'int32' ), ( 'boardid', 'string' ),
+                  ( 'title', 'string' ), ( 'is_traded', 'int32' ) )
+SECURITY_COLUMNS = ( ( 'SECID', 'string' ), ( 'BOARDID', 'string' ), ( 'SHORTNAME', 'string' ),
+                     ( 'LOTSIZE', 'int32' ), ( 'DECIMALS', 'int32' ) )
+
+# engine -> market -> board -> securities of the directory replies
+DIRECTORY = { 'stock': { 'shares': { 'TQBR': ( 'SBER', 'GAZP', 'LKOH' ), 'TQTF': ( 'FXUS', ) },
+                         'index': { 'RTSI': ( 'RTSI', ), 'SNDX': ( 'IMOEX', ) } },
+              'futures': { 'forts': { 'RFUD': ( 'RIH8', 'SiH8', 'BRJ8' ) } },
+              'currency': { 'selt': { 'CETS': ( 'USD000000TOD', 'USD000UTSTOM' ) } } }
+
+# interval code -> minutes in a candle, 0 - daily candles
+INTERVALS = { 1: 1, 10: 10, 60: 60, 24: 0 }
+
+ROUTES = ( ( 'trades', re.compile( r'^/iss/engines/[^/]+/markets/[^/]+/securities/([^/]+)/trades$' ) ),
+           ( 'borders', re.compile( r'^/iss/engines/[^/]+/markets/[^/]+/boards/([^/]+)/securities/([^/]+)/candleborders$' ) ),
+           ( 'candles', re.compile( r'^/iss/engines/[^/]+/markets/[^/]+/boards/([^/]+)/securities/([^/]+)/candles$' ) ),
+           ( 'history', re.compile( r'^/iss/history/engines/[^/]+/markets/[^/]+/boards/([^/]+)/securities$' ) ),
+           ( 'engines', re.compile( r'^/iss/engines$' ) ),
+           ( 'markets', re.compile( r'^/iss/engines/([^/]+)/markets$' ) ),
+           ( 'boards', re.compile( r'^/iss/engines/([^/]+)/markets/([^/]+)/boards$' ) ),
+           ( 'securities', re.compile( r'^/iss/engines/([^/]+)/markets/([^/]+)/securities$' ) ) )
+
+
+def trading_days( lastDay, count ):
+    """ count weekdays up to lastDay ('YYYY-MM-DD') in ascending order.
+    """
+    day = datetime.date( *map( int, lastDay.split( '-' ) ) )
+    days = []
+    while len( days ) < count:
+        if day.weekday() < 5:
+            days.append( day.isoformat() )
+        day -= datetime.timedelta( days = 1 )
+    return days[ ::-1 ]
+
+
+def _clock( seconds ):
+    return '%02d:%02d:%02d' % ( seconds // 3600, seconds // 60 % 60, seconds % 60 )
+
+
+class MockISSData:
+    """ Synthetic trades, candles and history. Series are made on the
+    first request and kept.
+    """
+
+    def __init__( self, trades = 100000, days = 60, securities = 300, lastDay = LAST_DAY ):
+        """ trades: number of trades in a session
+            days: trading days of candles and history up to lastDay
+            securities: number of securities on a board in history
+        """
+        self.trades = trades
+        self.days = trading_days( lastDay, max( days, SESSIONS ) )
+        self.securities = securities
+        self.lock = threading.Lock()
+        self.sessions = {}
+        self.minutes = {}
+        self.candles = {}
+
+    def session( self, security, prevSession ):
+        """ ( tradenos, times, prices, qtys ) of a session.
+        """
+        key = ( security, prevSession )
+        with self.lock:
+            if key not in self.sessions:
+                rnd = random.Random( '%s/%d' % key )
+                tradeNo = 1000000000 + ( SESSIONS - prevSession ) * 5 * self.trades
+                price = 120000
+                tradenos, prices, qtys = [], [], []
+                for i in range( self.trades ):
+                    tradeNo += rnd.randint( 1, 4 )
+                    price += 10 * rnd.randint( -2, 2 )
+                    tradenos.append( tradeNo )
+                    prices.append( float( price ) )
+                    qtys.append( rnd.randint( 1, 20 ) )
+                times = [ SESSION_START + i * SESSION_SECONDS // self.trades for i in range( self.trades ) ]
+                self.sessions[ key ] = ( tradenos, times, prices, qtys )
+            return self.sessions[ key ]
+
+    def trade_rows( self, security, query ):
+        prevSession = int( query.get( 'previous_session', '0' ) )
+        if prevSession >= SESSIONS:
+            return []
+        tradenos, times, prices, qtys = self.session( security, prevSession )
+        day = self.days[ -1 - prevSession ]
+        limit = min( int( query.get( 'limit', TRADES_PAGE_SIZE ) ), TRADES_PAGE_SIZE )
+        start = int( query.get( 'start', '0' ) )
+        if query.get( 'reversed' ) == '1':
+            idx = range( len( tradenos ) - 1 - start, -1, -1 )
+        else:
+            first = bisect.bisect_left( tradenos, int( query[ 'tradeno' ] ) ) if 'tradeno' in query else 0
+            idx = range( first + start, len( tradenos ) )
+        rows = []
+        for i in idx[ :limit ]:
+            clock = _clock( times[i] )
+            rows.append( [ tradenos[i], 'RFUD', security, day, clock, prices[i], qtys[i],
+                           '%s %s' % ( day, clock ), tradenos[i] * 2 + 1, 0, 2000 + prevSession,
+                           'B' if tradenos[i] % 2 else 'S' ] )
+        return rows
+
+    def minute_candles( self, security ):
+        """ m1 candles of all the days as [open, close, high, low, value, volume, begin, end].
+        """
+        with self.lock:
+            if security not in self.minutes:
+                rnd = random.Random( security )
+                price = 100.0
+                candles = []
+                for day in self.days:
+                    for minute in range( SESSION_SECONDS // 60 ):
+                        prices = [ price ]
+                        for _ in range( 4 ):
+                            price = round( price + 0.01 * rnd.randint( -5, 5 ), 2 )
+                            prices.append( price )
+                        volume = rnd.randint( 10, 1000 )
+                        begin = SESSION_START + minute * 60
+                        candles.append( [ prices[0], prices[-1], max( prices ), min( prices ),
+                                          round( volume * prices[-1], 2 ), volume,
+                                          '%s %s' % ( day, _clock( begin ) ), '%s %s' % ( day, _clock( begin + 59 ) ) ] )
+                self.minutes[ security ] = candles
+            return self.minutes[ security ]
+
+    def candle_series( self, security, interval ):
+        key = ( security, interval )
+        minutes = self.minute_candles( security )
+        with self.lock:
+            if key not in self.candles:
+                size = INTERVALS[ interval ]
+                groups = {}
+                for cd in minutes:
+                    day, clock = cd[6].split( ' ' )
+                    if size == 0:
+                        group = day
+                    else:
+                        seconds = int( clock[ :2 ] ) * 3600 + int( clock[ 3:5 ] ) * 60
+                        group = '%s %s' % ( day, _clock( seconds - seconds % ( size * 60 ) ) )
+                    groups.setdefault( group, [] ).append( cd )
+                candles = []
+                for group, cds in groups.items():
+                    begin = group if size else group + ' 00:00:00'
+                    end = cds[-1][7] if size else group + ' 23:59:59'
+                    candles.append( [ cds[0][0], cds[-1][1], max( cd[2] for cd in cds ), min( cd[3] for cd in cds ),
+                                      round( sum( cd[4] for cd in cds ), 2 ), sum( cd[5] for cd in cds ),
+                                      begin, end ] )
+                self.candles[ key ] = candles
+            return self.candles[ key ]
+
+    def candle_rows( self, security, query ):
+        interval = int( query.get( 'interval', '1' ) )
+        if interval not in INTERVALS:
+            return []
+        dateFrom = query.get( 'from', '' )
+        dateTill = query.get( 'till', '' )
+        rows = [ cd for cd in self.candle_series( security, interval )
+                 if cd[6] >= dateFrom and ( dateTill == '' or cd[6][ :len( dateTill ) ] <= dateTill ) ]
+        if query.get( 'iss.reverse', '' ).lower() == 'true':
+            rows.reverse()
+        start = int( query.get( 'start', '0' ) )
+        return rows[ start:start + CANDLES_PAGE_SIZE ]
+
+    def border_rows( self, security ):
+        rows = []
+        for interval in INTERVALS:
+            series = self.candle_series( security, interval )
+            rows.append( [ series[0][6], series[-1][7], interval, 57 ] )
+        return rows
+
+    def history_rows( self, board, query ):
+        """ ( rows of the page, total number of rows ).
+        """
+        date = query.get( 'date', '' )[ :10 ]
+        if date not in self.days:
+            return [], 0
+        rnd = random.Random( '%s/%s' % ( board, date ) )
+        rows = []
+        for i in range( self.securities ):
+            secId = 'SEC%04d' % i
+            if i % 7 == 0:
+                # no trades this day
+                rows.append( [ board, date, secId, secId, 0, 0 ] + [ None ] * 14 )
+                continue
+            price = round( 10 + i + rnd.random(), 2 )
+            trades = rnd.randint( 1, 50000 )
+            volume = trades * rnd.randint( 1, 100 )
+            value = round( volume * price, 2 )
+            rows.append( [ board, date, secId, secId, trades, value, price, price - 0.5, price + 0.5,
+                           price, price, price, volume, price, price, price, value, value, value, value ] )
+        start = int( query.get( 'start', '0' ) )
+        return rows[ start:start + HISTORY_PAGE_SIZE ], len( rows )
+
+    def directory_blocks( self, kind, names ):
+        """ Blocks of the replies listing engines, markets, boards and securities.
+        """
+        level = DIRECTORY
+        for name in names:
+            level = level.get( name, {} )
+        if kind == 'engines':
+            return [ ( 'engines', ENGINE_COLUMNS, [ [ i + 1, name, name.title() ] for i, name in enumerate( level ) ] ) ]
+        if kind == 'markets':
+            return [ ( 'markets', MARKET_COLUMNS, [ [ i + 1, name, name.title() ] for i, name in enumerate( level ) ] ) ]
+        if kind == 'boards':
+            return [ ( 'boards', BOARD_COLUMNS, [ [ i + 1, 1, name, name, 1 ] for i, name in enumerate( level ) ] ) ]
+        rows = []
+        for board, securities in level.items():
+            rows += [ [ secId, board, secId, 1, 2 ] for secId in securities ]
+        return [ ( 'securities', SECURITY_COLUMNS, rows ) ]
+
+    def reply( self, path, query ):
+        """ Blocks of the reply as [ ( name, columns, rows ) ] or None for an unknown path.
+        """
+        for kind, route in ROUTES:
+            m = route.match( path )
+            if m is None:
+                continue
+            if kind == 'trades':
+                return [ ( 'trades', TRADE_COLUMNS, self.trade_rows( m.group( 1 ), query ) ) ]
+            if kind == 'borders':
+                return [ ( 'borders', BORDER_COLUMNS, self.border_rows( m.group( 2 ) ) ) ]
+            if kind == 'candles':
+                return [ ( 'candles', CANDLE_COLUMNS, self.candle_rows( m.group( 2 ), query ) ) ]
+            if kind in ( 'engines', 'markets', 'boards', 'securities' ):
+                return self.directory_blocks( kind, m.groups() )
+            rows, total = self.history_rows( m.group( 1 ), query )
+            return [ ( 'history', HISTORY_COLUMNS, rows ),
+                     ( 'history.cursor', CURSOR_COLUMNS,
+                       [ [ int( query.get( 'start', '0' ) ), total, HISTORY_PAGE_SIZE ] ] ) ]
+        return None
+
+
+def encode_reply( blocks, query, fmt ):
+    """ Body and content type of the reply with iss.only, iss.meta
+    and <block>.columns applied.
+    """
+    only = query.get( 'iss.only', '' )
+    if only:
+        names = only.split( ',' )
+        blocks = [ block for block in blocks if block[0] in names ]
+    meta = query.get( 'iss.meta', 'on' ) != 'off'
+
+    projected = []
+    for name, columns, rows in blocks:
+        wanted = query.get( name + '.columns', '' )
+        if wanted:
+            names = [ col for col, dtype in columns ]
+            idx = [ names.index( col ) for col in wanted.split( ',' ) if col in names ]
+            columns = [ columns[i] for i in idx ]
+            rows = [ [ row[i] for i in idx ] for row in rows ]
+        projected.append( ( name, columns, rows ) )
+
+    if fmt == '.csv':
+        lines = []
+        for name, columns, rows in projected:
+            lines += [ name, '', ';'.join( col for col, dtype in columns ) ]
+            lines += [ ';'.join( '' if value is None else str( value ) for value in row ) for row in rows ]
+            lines.append( '' )
+        return ( '\r\n'.join( lines ) + '\r\n' ).encode( 'cp1251' ), 'text/csv; charset=windows-1251'
+
+    body = {}
+    for name, columns, rows in projected:
+        block = {}
+        if meta:
+            block[ 'metadata' ] = { col: { 'type': dtype } for col, dtype in columns }
+        block[ 'columns' ] = [ col for col, dtype in columns ]
+        block[ 'data' ] = rows
+        body[ name ] = block
+    return json.dumps( body, ensure_ascii = False ).encode( 'utf-8' ), 'application/json; charset=utf-8'
+
+
+class MockISSHandler( http.server.BaseHTTPRequestHandler ):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are separate writes, don't wait for the ACK of the first one
+    disable_nagle_algorithm = True
+
+    def do_GET( self ):
+        parts = urllib.parse.urlsplit( self.path )
+        query = dict( urllib.parse.parse_qsl( parts.query, keep_blank_values = True ) )
+        path, fmt = os.path.splitext( parts.path )
+        blocks = self.server.data.reply( path, query ) if fmt in ( '.json', '.csv' ) else None
+        if self.server.latency:
+            time.sleep( self.server.latency )
+
+        if self.server.fail():
+            body, contentType, status = b'', 'text/plain', 503
+        elif blocks is None:
+            body, contentType, status = b'', 'text/plain', 404
+        else:
+            body, contentType = encode_reply( blocks, query, fmt )
+            status = 200
+        # counted before the reply, so a client which has read it sees the request counted
+        self.server.count( len( body ) )
+        self.send_response( status )
+        self.send_header( 'Content-Type', contentType )
+        self.send_header( 'Content-Length', str( len( body ) ) )
+        self.end_headers()
+        self.wfile.write( body )
+
+    def log_message( self, *args ):
+        if self.server.verbose:
+            super().log_message( *args )
+
+
+class MockISSServer( http.server.ThreadingHTTPServer ):
+    """ HTTP server with MockISSData. Counts the requests and the bytes sent.
+    """
+
+    daemon_threads = True
+
+    def __init__( self, host = '127.0.0.1', port = 0, latency = 0.0, verbose = False, error_rate = 0.0, **options ):
+        """ port: 0 - any free port, see self.url
+            latency: delay of every reply in seconds
+            error_rate: share of the requests answered with 503
+            options: trades, days, securities, lastDay of MockISSData
+        """
+        super().__init__( ( host, port ), MockISSHandler )
+        self.data = MockISSData( **options )
+        self.latency = latency
+        self.verbose = verbose
+        self.error_rate = error_rate
+        self.random = random.Random( 0 )
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.bytes = 0
+        self.thread = None
+
+    @property
+    def url( self ):
+        """ Base URL for Config.iss_url.
+        """
+        return 'http://%s:%d' % self.server_address[ :2 ]
+
+    def fail( self ):
+        with self.lock:
+            return self.error_rate > 0 and self.random.random() < self.error_rate
+
+    def count( self, size ):
+        with self.lock:
+            self.requests += 1
+            self.bytes += size
+
+    def start( self ):
+        """ Serve in a background thread.
+        """
+        self.thread = threading.Thread( target = self.serve_forever, daemon = True )
+        self.thread.start()
+        return self
+
+    def stop( self ):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser( description = 'Local ISS stand-in with synthetic data' )
+    parser.add_argument( '--host', default = '127.0.0.1' )
+    parser.add_argument( '--port', type = int, default = 8080 )
+    parser.add_argument( '--latency', type = float, default = 0.0, help = 'delay of every reply, seconds' )
+    parser.add_argument( '--trades', type = int, default = 100000, help = 'trades in a session' )
+    parser.add_argument( '--days', type = int, default = 60, help = 'trading days of candles and history' )
+    parser.add_argument( '--securities', type = int, default = 300, help = 'securities of a board in history' )
+    parser.add_argument( '--error-rate', type = float, default = 0.0, help = 'share of the requests failed with 503' )
+    parser.add_argument( '--verbose', action = 'store_true' )
+    args = parser.parse_args()
+
+    server = MockISSServer( args.host, args.port, args.latency, args.verbose, args.error_rate, trades = args.trades,
+                            days = args.days, securities = args.securities )
+    print( 'serving ISS at %s' % server.url )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+"""
+    MOEX Passport cookie kept in a file.
+
+    The passport (MicexPassportCert cookie) got by MicexAuth is saved so
+    that the next runs and the worker processes of a job take it from the
+    file instead of authenticating again. The file is replaced atomically
+    and the renewals are done under a lock file, so when several processes
+    find the passport about to expire only one of them goes to
+    passport.moex.com and the others read its result.
+
+        config = Config( user, password, passport_file = 'passport.lwp' )
+        auth = MicexAuth( config )     # no request if the saved passport is valid
+        auth.start_refresh()           # renewed in the background before expiry
+"""
+
+import contextlib
+import http.cookiejar
+import os
+import time
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+PASSPORT_COOKIE = 'MicexPassportCert'
+# a passport without expiry time is renewed after this number of seconds
+PASSPORT_MAX_AGE = 24 * 3600
+
+
+def find_passport( cookie_jar ):
+    """ The passport cookie of the jar or None if there is no valid one.
+    """
+    for cookie in cookie_jar:
+        if cookie.name == PASSPORT_COOKIE and not cookie.is_expired():
+            return cookie
+    return None
+
+
+def passport_expires( cookie, issued ):
+    """ Epoch time when the passport has to be renewed; issued is
+    the time it was got at, used if the cookie has no expiry time.
+    """
+    if cookie.expires is not None:
+        return cookie.expires
+    return ( issued or time.time() ) + PASSPORT_MAX_AGE
+
+
+class PassportFile:
+    """ Cookies of a jar saved to a file shared by threads and processes.
+    """
+
+    def __init__( self, fname ):
+        self.fname = fname
+        # mtime of the file when it was loaded or saved by this object
+        self.mtime = None
+
+    @contextlib.contextmanager
+    def lock( self ):
+        """ Exclusive lock between the processes, a no-op without fcntl.
+        """
+        if fcntl is None:
+            yield
+            return
+        with open( self.fname + '.lock', 'a' ) as f:
+            fcntl.flock( f.fileno(), fcntl.LOCK_EX )
+            try:
+                yield
+            finally:
+                fcntl.flock( f.fileno(), fcntl.LOCK_UN )
+
+    def changed( self ):
+        """ True if the file has been written since it was loaded or saved here.
+        """
+        try:
+            return os.stat( self.fname ).st_mtime != self.mtime
+        except OSError:
+            return False
+
+    def load( self, cookie_jar ):
+        """ Add the cookies of the file to the jar. Returns False if there is no file.
+        """
+        saved = http.cookiejar.LWPCookieJar()
+        try:
+            mtime = os.stat( self.fname ).st_mtime
+            saved.load( self.fname, ignore_discard = True )
+        except ( OSError, http.cookiejar.LoadError ):
+            return False
+        for cookie in saved:
+            cookie_jar.set_cookie( cookie )
+        self.mtime = mtime
+        return True
+
+    def save( self, cookie_jar ):
+        """ Write the cookies of the jar to the file, readable by the user only.
+        """
+        saved = http.cookiejar.LWPCookieJar()
+        for cookie in cookie_jar:
+            saved.set_cookie( cookie )
+        tmp = '%s.%d.tmp' % ( self.fname, os.getpid() )
+        saved.save( tmp, ignore_discard = True )
+        os.chmod( tmp, 0o600 )
+        os.replace( tmp, self.fname )
+        self.mtime = os.stat( self.fname ).st_mtime
@@ -1,11 +1,16 @@
 import os.path, time
 import numpy as np
+from iss_store import HistoryReader
 import matplotlib.style
 import matplotlib as mpl
 mpl.style.use('classic')
 import matplotlib.pyplot as plt
 
 fname = 'RIH8 070318 19-05-50+0300.txt'
+# for binary files (MyData.store_trades( binary = True ), save_trades_for_session)
+# only this window is read, e.g. ( '2018-03-07 10:00:00', '2018-03-07 11:00:00' );
+# None plots the whole file
+window = None
 
 def readZeroTime( fname ):
     if not os.path.isfile( fname ):
@@ -16,13 +21,20 @@ def readZeroTime( fname ):
     return int( line.split( ' ' )[-1] )
     
 
-zeroTime = readZeroTime( fname )
-
 if not os.path.isfile( fname ):
     raise ValueError( 'wrong file name: %s' % fname )
 
 
-trades = np.loadtxt( fname, skiprows = 1 )
+if fname.endswith( '.bin' ):
+    reader = HistoryReader( fname )
+    records = reader.slice( *window ) if window else reader.records
+    if len( records ) == 0:
+        raise ValueError( 'no trades in %s%s' % ( fname, ' between %s and %s' % window if window else '' ) )
+    zeroTime = int( records[ 'time' ][0] )
+    trades = np.column_stack( ( records[ 'time' ] - zeroTime, records[ 'price' ] ) )
+else:
+    zeroTime = readZeroTime( fname )
+    trades = np.loadtxt( fname, skiprows = 1 )
 
 plt.clf()
 
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+    Candles of any timeframe made locally from m1 candles or from trades.
+
+    One download of m1 candles (or of the trades of a session) is enough
+    for every timeframe: m10, H1, D1, W1, M1, Q1 and bars of any number
+    of minutes are built from it with NumPy, without a loop over rows.
+
+    Bars are cut by Moscow time as ISS does: intraday bars are aligned to
+    the start of the trading day and never span two days, weeks start on
+    Monday, months and quarters on the first day. The trading day starts
+    at the Moscow midnight unless dayStart says otherwise, e.g.
+    dayStart = -5 * 3600 puts the FORTS evening session (19:00) into the
+    next day as the exchange does.
+
+        m1 = iss.get_security_candles( 'stock', 'shares', 'TQBR', 'SBER', '', '', 'm1', columnar = True )
+        bars = resample_all( m1 )                   # { 'm10': CandleColumns, 'H1': ..., ... }
+        m15 = resample_candles( m1, 15 )
+
+    The begin of a bar is the start of its period. The end is the latest
+    end (time of the last trade for trades) of what it was made of, for
+    D1 and longer bars the last second of that trading day as in ISS.
+    For trades value is the sum of price * qty.
+
+    NumPy is needed for this module.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from iss_columns import CandleColumns
+from iss_store import load
+from iss_time import MSK_OFFSET
+
+
+DAY = 86400
+# timeframes of ISS: minutes in a bar or the calendar period
+TIMEFRAMES = { 'm1': 1, 'm10': 10, 'H1': 60, 'D1': 'D', 'W1': 'W', 'M1': 'M', 'Q1': 'Q' }
+
+
+def bar_starts( times, timeFrame, dayStart = 0 ):
+    """ Epoch seconds of the start of the bar of every time.
+        times: epoch seconds (int64 array)
+        timeFrame: code of TIMEFRAMES or a number of minutes
+        dayStart: seconds from the Moscow midnight to the start of a trading day
+    """
+    period = TIMEFRAMES.get( timeFrame, timeFrame )
+    # seconds from the start of the trading day 0 (1970-01-01) in Moscow
+    local = np.asarray( times, dtype = 'int64' ) + MSK_OFFSET - dayStart
+    days = local // DAY
+    if period == 'D':
+        starts = days * DAY
+    elif period == 'W':
+        # 1970-01-01 was Thursday
+        starts = ( days - ( days + 3 ) % 7 ) * DAY
+    elif period in ( 'M', 'Q' ):
+        months = days.astype( 'datetime64[D]' ).astype( 'datetime64[M]' ).astype( 'int64' )
+        if period == 'Q':
+            months -= months % 3
+        starts = months.astype( 'datetime64[M]' ).astype( 'datetime64[D]' ).astype( 'int64' ) * DAY
+    elif isinstance( period, int ) and period > 0:
+        size = period * 60
+        starts = days * DAY + ( local - days * DAY ) // size * size
+    else:
+        raise ValueError( 'unknown timeframe: %r' % ( timeFrame, ) )
+    return starts - MSK_OFFSET + dayStart
+
+
+def _times( values ):
+    values = np.asarray( values )
+    if values.dtype.kind == 'M':
+        values = values.astype( 'datetime64[s]' )
+    return values.astype( 'int64' )
+
+
+def _bars( keys, order, columns, reducers ):
+    """ Reduce the columns over the runs of equal keys (keys are sorted).
+        reducers: 'first', 'last' or a ufunc for every column
+    """
+    if order is not None:
+        keys = keys[ order ]
+        columns = [ col[ order ] for col in columns ]
+    starts = np.concatenate( ( [ 0 ], np.flatnonzero( np.diff( keys ) ) + 1 ) )
+    ends = np.append( starts[ 1: ], len( keys ) ) - 1
+    result = []
+    for col, reducer in zip( columns, reducers ):
+        if reducer == 'first':
+            result.append( col[ starts ] )
+        elif reducer == 'last':
+            result.append( col[ ends ] )
+        else:
+            result.append( reducer.reduceat( col, starts ) )
+    return keys[ starts ], result
+
+
+def _sort_order( times ):
+    """ None if the times are already in order, the sorting permutation otherwise.
+    """
+    if len( times ) < 2 or np.all( times[ 1: ] >= times[ :-1 ] ):
+        return None
+    return np.argsort( times, kind = 'stable' )
+
+
+def _candle_columns( timeFrame, dayStart, begin, opens, closes, highs, lows, values, volumes, ends ):
+    if not isinstance( TIMEFRAMES.get( timeFrame, timeFrame ), int ):
+        ends = bar_starts( ends, 'D', dayStart ) + DAY - 1
+    bars = CandleColumns( max( len( begin ), 1 ) )
+    bars.append_columns( ( opens, closes, highs, lows, values, volumes,
+                           begin.astype( 'datetime64[s]' ), ends.astype( 'datetime64[s]' ) ) )
+    return bars
+
+
+def resample_candles( candles, timeFrame, dayStart = 0 ):
+    """ Bars of timeFrame from candles of a smaller one: CandleColumns or
+    the records of a binary candles file (iss_store.load). Returns CandleColumns.
+    """
+    if np is None:
+        raise ImportError( 'numpy is required for resampling' )
+    if len( candles ) == 0:
+        return CandleColumns()
+    begin = _times( candles[ 'begin' ] )
+    order = _sort_order( begin )
+    keys = bar_starts( begin, timeFrame, dayStart )
+    columns = [ np.asarray( candles[ name ] ) for name in ( 'open', 'close', 'high', 'low', 'value', 'volume' ) ]
+    columns.append( _times( candles[ 'end' ] ) )
+    starts, ( opens, closes, highs, lows, values, volumes, ends ) = _bars(
+        keys, order, columns, ( 'first', 'last', np.maximum, np.minimum, np.add, np.add, np.maximum ) )
+    return _candle_columns( timeFrame, dayStart, starts, opens, closes, highs, lows, values, volumes, ends )
+
+
+def resample_trades( trades, timeFrame, dayStart = 0 ):
+    """ Bars of timeFrame from trades: TradeColumns or the records of
+    a binary trades file (iss_store.load). Returns CandleColumns.
+    """
+    if np is None:
+        raise ImportError( 'numpy is required for resampling' )
+    if len( trades ) == 0:
+        return CandleColumns()
+    times = _times( trades[ 'time' ] )
+    order = _sort_order( times )
+    keys = bar_starts( times, timeFrame, dayStart )
+    prices = np.asarray( trades[ 'price' ], dtype = 'float64' )
+    qtys = np.asarray( trades[ 'qty' ], dtype = 'float64' )
+    starts, ( opens, closes, highs, lows, values, volumes, ends ) = _bars(
+        keys, order, ( prices, prices, prices, prices, prices * qtys, qtys, times ),
+        ( 'first', 'last', np.maximum, np.minimum, np.add, np.add, np.maximum ) )
+    return _candle_columns( timeFrame, dayStart, starts, opens, closes, highs, lows, values, volumes, ends )
+
+
+def nests( small, large ):
+    """ True if every bar of the timeframe small lies within one bar of large.
+    """
+    small = TIMEFRAMES.get( small, small )
+    large = TIMEFRAMES.get( large, large )
+    if isinstance( small, int ):
+        return not isinstance( large, int ) or large % small == 0
+    return ( small, large ) in ( ( 'D', 'W' ), ( 'D', 'M' ), ( 'D', 'Q' ), ( 'M', 'Q' ) )
+
+
+def resample_all( candles, timeFrames = ( 'm10', 'H1', 'D1', 'W1', 'M1', 'Q1' ), dayStart = 0 ):
+    """ Bars of every timeframe from m1 candles as a dict timeframe -> CandleColumns.
+    Each timeframe is built from the shortest series already built whose
+    bars nest into its bars, so the later steps reduce fewer rows.
+    """
+    result = {}
+    for timeFrame in timeFrames:
+        source = candles
+        for built, bars in result.items():
+            if nests( built, timeFrame ) and len( bars ) < len( source ):
+                source = bars
+        result[ timeFrame ] = resample_candles( source, timeFrame, dayStart )
+    return result
+
+
+def read_candles( fname ):
+    """ Candles saved by save_security_candles: binary records (mapped, see
+    iss_store) for a .bin file, CandleColumns read from a text file otherwise.
+    """
+    if fname.endswith( '.bin' ):
+        return load( fname, 'candles' )
+    candles = CandleColumns()
+    with open( fname ) as f:
+        rows = [ line.rstrip( '\n' ).split( '\t' ) for line in f if line.strip() ]
+    candles.append_rows( rows )
+    return candles
@@ -0,0 +1,68 @@
+#!/usr/bin/env python
+"""
+    Retries of ISS requests after transient errors.
+
+    A request is repeated after timeouts, dropped connections, cut replies
+    and the HTTP statuses of an overloaded server (429, 5xx). The pauses
+    grow exponentially with full jitter: a random time between zero and
+    backoff * 2**attempt (at most max_delay), so the workers which failed
+    together don't come back together. Retry-After of the reply is obeyed.
+"""
+
+import http.client
+import logging
+import random
+import time
+import urllib.error
+
+
+RETRY_STATUSES = ( 429, 500, 502, 503, 504 )
+
+log = logging.getLogger( 'iss.retry' )
+
+
+class RetryPolicy:
+    """ How many times and after which pauses a request is repeated.
+    """
+
+    def __init__( self, retries = 5, backoff = 0.5, max_delay = 30.0, statuses = RETRY_STATUSES ):
+        """ retries: number of repetitions after the first attempt, 0 - no retries
+            backoff: upper bound of the first pause in seconds
+            max_delay: upper bound of any pause
+            statuses: HTTP statuses worth repeating the request
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.statuses = statuses
+
+    def is_transient( self, error ):
+        if isinstance( error, urllib.error.HTTPError ):
+            return error.code in self.statuses
+        # URLError, timeouts and connection errors are OSError
+        return isinstance( error, ( OSError, http.client.HTTPException ) )
+
+    def delay( self, attempt, error = None ):
+        """ Pause before the repetition number attempt (from 0).
+        """
+        delay = random.uniform( 0, min( self.max_delay, self.backoff * 2 ** attempt ) )
+        if isinstance( error, urllib.error.HTTPError ) and error.headers is not None:
+            retryAfter = error.headers.get( 'Retry-After' )
+            if retryAfter is not None and retryAfter.isdigit():
+                delay = max( delay, min( float( retryAfter ), self.max_delay ) )
+        return delay
+
+    def call( self, func, *args ):
+        """ Return func( *args ), repeating it after transient errors.
+        """
+        attempt = 0
+        while True:
+            try:
+                return func( *args )
+            except Exception as e:
+                if attempt >= self.retries or not self.is_transient( e ):
+                    raise
+                delay = self.delay( attempt, e )
+                attempt += 1
+                log.warning( 'retry %d of %d in %.1f s after %r', attempt, self.retries, delay, e )
+                time.sleep( delay )
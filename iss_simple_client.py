@@ -8,31 +8,116 @@
     @copyright: 2016 by MOEX
 """
 
-import urllib.request, urllib.error, urllib.parse
 import base64
+import collections
+import concurrent.futures
+import contextlib
+import datetime
 import http.cookiejar
-import json
+import logging
+import os
+import queue
+import re
+import shutil
+import threading
 import time
 
+from iss_cache import MicexISSCache
+from iss_http_pool import MicexHTTPPool
+from iss_json_stream import iter_rows
+from iss_csv_stream import iter_csv_rows
+from iss_columns import ColumnBuffer, TradeColumns, CandleColumns
+from iss_metrics import RequestStats
+from iss_retry import RetryPolicy
+from iss_checkpoint import Checkpoint
+from iss_throttle import TokenBucket, ThrottledOpener
+from iss_passport import PassportFile, find_passport, passport_expires
+from iss_time import iss_time_to_epoch, epoch_to_iss_time
+from iss_store import ( BinaryWriter, CANDLE_FIELDS, HEADER_SIZE, TRADE_FIELDS, candle_record, count_records,
+                        read_header, read_last_record, record_struct )
+
 
 requests = {'history_secs': 'http://iss.moex.com/iss/history/engines/%(engine)s/markets/%(market)s/boards/%(board)s/securities.json?date=%(date)s',
             'sec_trades': 'https://iss.moex.com/iss/engines/%(engine)s/markets/%(market)s/securities/%(sec)s/trades.json?previous_session=%(previous_session)d&limit=%(limit)d&reversed=%(reversed)d',
             'sec_trades1': 'https://iss.moex.com/iss/engines/%(engine)s/markets/%(market)s/securities/%(sec)s/trades.json?previous_session=%(previous_session)d&tradeno=%(tradeno)d&limit=%(limit)d',
 	    'sec_candleborders': 'https://iss.moex.com/iss/engines/%(engine)s/markets/%(market)s/boards/%(board)s/securities/%(sec)s/candleborders.json',
-            'sec_candles': 'https://iss.moex.com/iss/engines/%(engine)s/markets/%(market)s/boards/%(board)s/securities/%(sec)s/candles.json?start=%(start)d&till=%(till)s&from=%(from)s&interval=%(interval)d&iss.reverse=%(reverse)s' }
+            'sec_candles': 'https://iss.moex.com/iss/engines/%(engine)s/markets/%(market)s/boards/%(board)s/securities/%(sec)s/candles.json?start=%(start)d&till=%(till)s&from=%(from)s&interval=%(interval)d&iss.reverse=%(reverse)s',
+            'engines': 'https://iss.moex.com/iss/engines.json',
+            'markets': 'https://iss.moex.com/iss/engines/%(engine)s/markets.json',
+            'boards': 'https://iss.moex.com/iss/engines/%(engine)s/markets/%(market)s/boards.json',
+            'market_secs': 'https://iss.moex.com/iss/engines/%(engine)s/markets/%(market)s/securities.json' }
 # futures, forts, RTSI, RIH8
 # http://iss.moex.com/iss/securities.xml?q=RI
+TRADES_PAGE_SIZE = 5000
 timeFrameCodes = { 'm1': 1, 'm10': 10, 'H1': 60, 'D1': 24, 'W1': 7, 'M1': 31, 'Q1': 4 }
+# candles of these timeframes never span several days,
+# so a candles download can be split by dates
+INTRADAY_TIMEFRAMES = ( 'm1', 'm10', 'H1' )
+CANDLE_COLUMNS = ( 'open', 'close', 'high', 'low', 'value', 'volume', 'begin', 'end' )
+# columns taken from the replies and their types for the CSV format
+CANDLE_TYPES = ( float, float, float, float, float, float, str, str )
+TRADE_COLUMNS = ( 'SYSTIME', 'PRICE', 'QUANTITY', 'TRADENO' )
+TRADE_TYPES = ( str, float, int, int )
+HISTORY_COLUMNS = ( 'SECID', 'LEGALCLOSEPRICE', 'NUMTRADES' )
+HISTORY_TYPES = ( str, float, int )
+# line of the candles text file, columns as in CANDLE_COLUMNS
+CANDLE_LINE = '%f\t%f\t%f\t%f\t%f\t%f\t%s\t%s\n'
+
+# seconds between the checks of stop() of tail_trades during a pause
+TAIL_STOP_STEP = 0.1
+
+# seconds between the attempts to renew the passport after a failure
+PASSPORT_RETRY = 60
+
+# messages of the client; progress of the downloads is logged at DEBUG level
+log = logging.getLogger( 'iss' )
 
 class Config:
-    def __init__(self, user='', password='', proxy_url='', debug_level=0):
+    def __init__(self, user='', password='', proxy_url='', debug_level=0, max_workers=1,
+                 pool_size=4, timeout=30, cache_dir='', cache_max_bytes=1 << 30,
+                 select_columns=True, iss_format='json', iss_url='', passport_file='', passport_refresh=300,
+                 retries=5, retry_backoff=0.5, retry_max_delay=30, requests_per_second=0):
         """ Container for all the configuration options:
             user: username in MOEX Passport to access real-time data and history
             password: password for this user
             proxy_url: proxy URL if any is used, specified as http://proxy:port
             debug_level: 0 - no output, 1 - send debug info to stdout
+            max_workers: default number of parallel requests for the methods
+                         which can split a download into independent parts
+            pool_size: number of keep-alive connections kept per host
+            timeout: network timeout in seconds
+            cache_dir: directory for the disk cache of replies for the past,
+                       no cache if empty
+            cache_max_bytes: size limit of the disk cache
+            select_columns: request only the columns used by the client
+            iss_format: 'json' or 'csv' replies
+            iss_url: base URL of ISS like 'http://127.0.0.1:8080' (a local
+                     server, see iss_mock_server), iss.moex.com if empty
+            passport_file: file to keep the MOEX Passport cookie between runs
+                           and share it with other processes, see iss_passport
+            passport_refresh: seconds before the expiry of the passport
+                              when it is renewed
+            retries: number of repetitions of a request after transient errors
+            retry_backoff, retry_max_delay: bounds of the pauses between
+                                            the repetitions in seconds
+            requests_per_second: limit of the request rate of all the clients
+                                 sharing the opener, 0 - no limit
         """
         self.debug_level = debug_level  
+        self.max_workers = max_workers
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.cache_dir = cache_dir
+        self.cache_max_bytes = cache_max_bytes
+        self.select_columns = select_columns
+        self.iss_format = iss_format
+        self.iss_url = iss_url
+        self.passport_file = passport_file
+        self.passport_refresh = passport_refresh
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.retry_max_delay = retry_max_delay
+        self.requests_per_second = requests_per_second
         self.proxy_url = proxy_url
         self.user = user
         self.password = password
@@ -46,43 +131,102 @@ class MicexAuth:
     def __init__(self, config):
         self.config = config
         self.cookie_jar = http.cookiejar.CookieJar()
+        # the pool is shared with the clients created with this auth,
+        # so the passport cookie is sent over the same connections
+        self.pool = MicexHTTPPool(self.cookie_jar, config.pool_size, config.timeout,
+                                  config.proxy_url, config.debug_level)
+        self.passport = None
+        # time when the passport was got
+        self.issued = None
+        self.lock = threading.Lock()
+        self.store = PassportFile(config.passport_file) if config.passport_file else None
+        self.refresher = None
+        self.stopped = threading.Event()
         if config.user != '':
-            self.auth()
+            # a passport saved by a previous run or another process spares the request
+            if not self._load() or self.expires_in() <= config.passport_refresh:
+                self.refresh()
 
     def auth(self):
         """ one attempt to authenticate
         """
-        # opener for https authorization
-        if self.config.proxy_url:
-            opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": self.config.proxy_url}),
-                                          urllib.request.HTTPCookieProcessor(self.cookie_jar),
-                                          urllib.request.HTTPHandler(debuglevel=self.config.debug_level))
-        else:
-            opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(self.cookie_jar),
-                                          urllib.request.HTTPHandler(debuglevel=self.config.debug_level))
-        base64_str = base64.encodestring((self.config.user + ':' + self.config.password).encode()).decode().replace('\n', '')
-        opener.addheaders = [('Authorization',
-                              'Basic %s' % base64_str)]
-        #opener.addheaders = [('Authorization',
-        #                      'Basic %s' % base64.encodestring(self.config.user + ':' + self.config.password)[:-1])]
-        get_cert = opener.open(self.config.auth_url)
+        base64_str = base64.b64encode((self.config.user + ':' + self.config.password).encode()).decode()
+        get_cert = self.pool.open(self.config.auth_url, {'Authorization': 'Basic %s' % base64_str})
+        get_cert.read()
 
         # we only need a cookie with MOEX Passport (certificate)
-        self.passport = None
-        for cookie in self.cookie_jar:
-            if cookie.name == 'MicexPassportCert':
-                self.passport = cookie
-                break
+        self.passport = find_passport(self.cookie_jar)
+        self.issued = time.time()
+        if self.passport is None:
+            log.warning("Cookie not found!")
+        elif self.store is not None:
+            self.store.save(self.cookie_jar)
+
+    def refresh(self):
+        """ Get a new passport unless a fresh one has been saved to
+        the passport file by another process in the meantime.
+        """
+        with self.lock:
+            with self.store.lock() if self.store is not None else contextlib.nullcontext():
+                if self._load() and self.expires_in() > self.config.passport_refresh:
+                    return
+                self.auth()
+
+    def expires_in(self):
+        """ Seconds until the passport expires, 0 without a passport.
+        """
         if self.passport is None:
-            print("Cookie not found!")
+            return 0
+        return max(passport_expires(self.passport, self.issued) - time.time(), 0)
+
+    def start_refresh(self):
+        """ Renew the passport in a background thread passport_refresh
+        seconds before it expires, so the requests never wait for it.
+        """
+        if self.refresher is None and self.config.user != '':
+            self.stopped.clear()
+            self.refresher = threading.Thread(target=self._refresh_loop, daemon=True)
+            self.refresher.start()
+
+    def stop_refresh(self):
+        self.stopped.set()
+        if self.refresher is not None:
+            self.refresher.join()
+            self.refresher = None
+
+    def _refresh_loop(self):
+        delay = max(self.expires_in() - self.config.passport_refresh, 0)
+        while not self.stopped.wait(delay):
+            try:
+                self.refresh()
+            except Exception as e:
+                log.warning('passport refresh failed: %s', e)
+            delay = self.expires_in() - self.config.passport_refresh
+            if delay <= 0:
+                # no fresh passport: try again later
+                delay = PASSPORT_RETRY
+
+    def _load(self):
+        """ Take the passport from the passport file if it has changed.
+        Returns True if there is a valid passport.
+        """
+        if self.store is not None and self.store.changed() and self.store.load(self.cookie_jar):
+            passport = find_passport(self.cookie_jar)
+            if passport is not None:
+                self.passport = passport
+                self.issued = self.store.mtime
+        if self.passport is not None and self.passport.is_expired():
+            self.passport = None
+        return self.passport is not None
 
     def is_real_time(self):
         if self.config.user == '':
             return False
-        """ repeat auth request if failed last time or cookie expired
+        """ repeat auth request if failed last time or cookie expired,
+        a passport renewed by another process is taken from the file
         """
-        if not self.passport or (self.passport and self.passport.is_expired()):
-            self.auth()
+        if not self._load():
+            self.refresh()
         if self.passport and not self.passport.is_expired():
             return True
         return False
@@ -108,323 +252,320 @@ class MicexISSClient:
     """
 
     def __init__( self, config, handler, container, **kwargs ):
-        """ Create opener for a connection with authorization cookie.
-        It's not possible to reuse the opener used to authenticate because
-        there's no method in opener to remove auth data.
+        """ Take the connection pool for requests to ISS. With authorization
+        the pool of MicexAuth is used so that it sends the passport cookie,
+        the Authorization header is passed only with the auth request itself.
             config: instance of the Config class with configuration options
             auth: instance of the MicexAuth class with authentication info
             handler: user's handler class inherited from MicexISSDataHandler
+                     or an instance of such class
             containet: user's container class
+            opener: ready opener to share with other clients (optional)
         """
         auth = kwargs['auth'] if 'auth' in kwargs else None
-        if auth != None:
-            if config.proxy_url:
-                self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": config.proxy_url}),
-                                                   urllib.request.HTTPCookieProcessor(auth.cookie_jar),
-                                                   urllib.request.HTTPHandler(debuglevel=config.debug_level))
-            else:
-                self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(auth.cookie_jar),
-                                                   urllib.request.HTTPHandler(debuglevel=config.debug_level))
+        if 'opener' in kwargs:
+            # opener shared with other clients, already set up
+            self.opener = kwargs['opener']
         else:
-            if config.proxy_url:
-                self.opener = urllib.request.build_opener(urllib.request.ProxyHandler({"http": config.proxy_url}),
-                                                   urllib.request.HTTPHandler(debuglevel=config.debug_level))
-            else:
-                self.opener = urllib.request.build_opener( urllib.request.HTTPHandler(debuglevel=config.debug_level) )
-        urllib.request.install_opener(self.opener)
-        self.handler = handler(container)
+            self.opener = make_opener( config, auth )
+        self.config = config
+        self.requests = iss_requests( config.iss_url )
+        self.retry = RetryPolicy( config.retries, config.retry_backoff, config.retry_max_delay )
+        # instrumentation, see iss_metrics
+        self.listeners = []
+        # a ready handler object (e.g. one of iss_sinks) can be given instead of the class
+        self.handler = handler if isinstance( handler, MicexISSDataHandler ) else handler(container)
 
     def get_history_securities(self, engine, market, board, date):
         """ Get and parse historical data on all the securities at the
         given engine, market, board
         """
-        url = requests['history_secs'] % {'engine': engine,
-                                          'market': market,
-                                          'board': board,
-                                          'date': date}
-
         # always remember about the 'start' argument to get long replies
         start = 0
         cnt = 1
         while cnt > 0:
-            res = self.opener.open( url + '&start=' + str(start) )
-            #resStr = str( res.read().decode('utf-8') )
-            print( res )
-            #if resStr == '':
-            #    break
-            #jres = json.load(res)
-            jres = json.loads( res.read().decode('utf-8') )
-
-            # the following is also just a simple example
-            # it is recommended to keep metadata separately
-
-            # root node with historical data
-            jhist = jres['history']
-
-            # node with actual data
-            jdata = jhist['data']
-
-            # node with the list of column IDs in 'data' in correct order;
-            # it's also possible to use the iss.json=extended argument instead
-            # to get all the IDs together with data (leads to more traffic)
-            jcols = jhist['columns']
-            secIdx = jcols.index('SECID')
-            closeIdx = jcols.index('LEGALCLOSEPRICE')
-            tradesIdx = jcols.index('NUMTRADES')
-
-            result = []
-            for sec in jdata:
-                result.append((sec[secIdx],
-                               del_null(sec[closeIdx]),
-                               del_null(sec[tradesIdx])))
+            result = self._history_page( engine, market, board, date, start )
             # we return pieces of received data on each iteration
             # in order to be able to handle large volumes of data
             # and to start data processing without waiting for
             # the complete reply
-            self.handler.do(result)
-            cnt = len(jdata)
+            self._handle(result)
+            cnt = len(result)
             start = start + cnt
         return True
 
+    def _history_page( self, engine, market, board, date, start ):
+        """ One page of get_history_securities as a list of ( SECID, close, trades ).
+        """
+        url = self.requests['history_secs'] % {'engine': engine,
+                                          'market': market,
+                                          'board': board,
+                                          'date': date}
+        # the rows are parsed while the reply is being read and
+        # only the needed columns are requested from the 'history' node
+        result = []
+        for secId, close, trades in self._rows( url + '&start=' + str(start), 'history', HISTORY_COLUMNS, HISTORY_TYPES ):
+            result.append((secId,
+                           del_null(close),
+                           del_null(trades)))
+        return result
+
     def get_security_trades( self, engine, market, security, prevSession, isReversed, limit ):
         """ Get and parse historical data on all the securities at the
         given engine, market, board
         """
-        url = requests['sec_trades'] % {'engine': engine,
+        url = self.requests['sec_trades'] % {'engine': engine,
                                         'market': market,
                                         'sec': security,
                                         'previous_session': prevSession,
+                                        'reversed': int( isReversed ),
                                         'limit': limit }
 
-        print(url)
-
-        # always remember about the 'start' argument to get long replies
-
-        res = self.opener.open( url )
-        resStr = str( res.read().decode('utf-8') )
-        #print( resStr )
-        #if resStr == '':
-        #    break
-        #jres = json.load(res)
-        jres = json.loads( resStr )
-
-        # the following is also just a simple example
-        # it is recommended to keep metadata separately
+        log.debug( url )
 
-        # root node with historical data
         # see json response structure here:
         # https://iss.moex.com/iss/engines/futures/markets/forts/securities/RIH8/trades.json?reversed=1&limit=10
-            
-        jhist = jres['trades']
-
-        # node with actual data
-        jdata = jhist['data']
-
-        # node with the list of column IDs in 'data' in correct order;
-        # it's also possible to use the iss.json=extended argument instead
-        # to get all the IDs together with data (leads to more traffic)
-        jcols = jhist['columns']
-        timeIdx = jcols.index('SYSTIME')
-        priceIdx = jcols.index('PRICE')
-        qtyIdx = jcols.index('QUANTITY')
-            
-
         result = []
-        for trade in jdata:
-            result.append((trade[timeIdx],
-                            del_null(trade[priceIdx]),
-                            del_null(trade[qtyIdx])))
+        for systime, price, qty, tradeno in self._rows( url, 'trades', TRADE_COLUMNS, TRADE_TYPES ):
+            result.append((systime,
+                            del_null(price),
+                            del_null(qty)))
         # we return pieces of received data on each iteration
         # in order to be able to handle large volumes of data
         # and to start data processing without waiting for
         # the complete reply
-        self.handler.do( result )
+        self._handle( result )
         
         return True
 
     def get_session_start_end_tradenos( self, engine, market, security, prevSession ):
-        url = requests['sec_trades'] % {'engine': engine,
+        sessionStartTradeNo = int( del_null( self.get_session_edge( engine, market, security, prevSession, False )[3] ) )
+
+        if prevSession == 0:
+            sessionEndTradeNo = int( del_null( self.get_session_edge( engine, market, security, prevSession, True )[3] ) )
+        else:
+            sessionEndTradeNo = int( del_null( self.get_session_edge( engine, market, security,
+                                                                      prevSession - 1, True )[3] ) ) - 1
+
+        return ( sessionStartTradeNo, sessionEndTradeNo )
+
+    def get_session_edge( self, engine, market, security, prevSession, isReversed ):
+        """ The first (the last if isReversed) trade of the session
+        as a ( SYSTIME, PRICE, QUANTITY, TRADENO ) row.
+        """
+        url = self.requests['sec_trades'] % {'engine': engine,
                                         'market': market,
                                         'sec': security,
                                         'previous_session': prevSession,
-                                        'reversed': 0,
+                                        'reversed': int( isReversed ),
                                         'limit': 1 }
 
-        #print( url )
-        res = self.opener.open( url )
-        resStr = str( res.read().decode('utf-8') )
-        jres = json.loads( resStr )
-
-        # the following is also just a simple example
-        # it is recommended to keep metadata separately
-            
-        jhist = jres['trades']
-        jdata = jhist['data']
+        jdata = self._rows( url, 'trades', TRADE_COLUMNS, TRADE_TYPES )
 
         if len( jdata ) == 0:
-            raise ValueError( 'Can\'t get session start tradeno' )
-        
-        jcols = jhist['columns']
-            
-        sessionStartTradeNo = int( del_null( jdata[0][ jcols.index( 'TRADENO' ) ] ) )
+            raise ValueError( 'Can\'t get session %s tradeno' % ( 'end' if isReversed else 'start' ) )
 
-        print( 'session start time:', jdata[0][ jcols.index( 'SYSTIME' ) ] )
+        log.info( 'session %d %s time: %s', prevSession, 'end' if isReversed else 'start', jdata[0][0] )
+        return jdata[0]
+        
 
-        if prevSession == 0:
-            url = requests['sec_trades'] % {'engine': engine,
-                                            'market': market,
-                                            'sec': security,
-                                            'previous_session': prevSession,
-                                            'reversed': 1,
-                                            'limit': 1 }
+    # prev_session = 0 means the current session
+    # -----||----- = n means number of the previous session before current one
+    # workers > 1 splits the session into tradeno shards which are downloaded
+    # in parallel and joined back in tradeno order
+    # columnar = True passes TradeColumns to the handler instead of a list of tuples
+    # stream = True passes every page to the handler as soon as it is parsed
+    # instead of the whole session at once; pages are downloaded ahead in
+    # a separate thread, at most queueSize of them are waiting for the handler
+    def get_trades_for_session( self, engine, market, security, prevSession, workers = None, columnar = False,
+                                stream = False, queueSize = 4 ):
+        if stream:
+            for page in prefetch( self._iter_session_pages( engine, market, security, prevSession, workers ), queueSize ):
+                self._handle( self._convert_trades( page, TradeColumns( len( page ) ) if columnar else [] ) )
+            return True
 
-            res = self.opener.open( url )
-            resStr = str( res.read().decode('utf-8') )
-            jres = json.loads( resStr )
+        result = TradeColumns() if columnar else []
+        for chunk in self._iter_session_trades( engine, market, security, prevSession, workers, columnar ):
+            result.extend( chunk )
 
-            # the following is also just a simple example
-            # it is recommended to keep metadata separately
-                    
-            jhist = jres['trades']
-            jdata = jhist['data']
+        self._handle( result )
+        
+        return True
 
-            if len( jdata ) == 0:
-                raise ValueError( 'Can\'t get session end tradeno' )
-                
-            jcols = jhist['columns']
+    def save_trades_for_session( self, engine, market, security, prevSession, fname = None, workers = None,
+                                 resume = False ):
+        """ Download the trades of the session straight into a binary file
+        (see iss_store), the handler is not called. Returns the file name.
+        With resume = True the file is flushed and a checkpoint is saved after
+        every page, and a download of the same session interrupted in such
+        a run goes on from where it stopped. Without it nothing is synced
+        before the end, a bulk save doesn't pay an fsync per page.
+        """
+        if fname is None:
+            fname = '%s.%d.trades.bin' % ( security, prevSession )
+        startTradeNo, endTradeNo = self.get_session_start_end_tradenos( engine, market, security, prevSession )
+        # the first tradeno tells the session whatever day it is downloaded on
+        checkpoint = Checkpoint( fname, { 'security': security, 'start': startTradeNo } )
+        state = checkpoint.load() if resume and os.path.isfile( fname ) else None
+
+        with BinaryWriter( fname, 'trades', TRADE_FIELDS, append = state is not None, security = security ) as writer:
+            rows = 0
+            if state is not None:
+                rows = state[ 'rows' ]
+                writer.truncate( rows )
+                startTradeNo = state[ 'cursor' ]
+            for page in self._iter_range_pages( engine, market, security, prevSession,
+                                                startTradeNo, endTradeNo, workers ):
+                if len( page ) == 0:
+                    continue
+                writer.write_rows( self._convert_trades( page, [] ) )
+                rows += len( page )
+                if resume:
+                    writer.flush()
+                    checkpoint.save( cursor = int( page[-1][3] ) + 1, rows = rows )
+        checkpoint.remove()
+        return fname
+
+    def tail_trades( self, engine, market, security, fromTradeNo = None, interval = 1.0, maxInterval = 30.0,
+                     stop = None, columnar = False ):
+        """ Follow the trades of the current session. Only the trades newer
+        than the last seen TRADENO are requested; each new batch is passed
+        to the handler and yielded. A full page is followed by the next
+        request at once, an empty poll doubles the pause up to maxInterval.
+            fromTradeNo: first tradeno to get, the session start by default
+            interval: pause between polls while trades are coming, seconds
+            stop: function returning True to finish, or just stop iterating;
+                  it is checked during the pauses too
+            columnar: batches as TradeColumns instead of lists of tuples
+        """
+        if fromTradeNo is None:
+            # only the start of the session is needed, not its end
+            fromTradeNo = int( del_null( self.get_session_edge( engine, market, security, 0, False )[3] ) )
+
+        currTradeNo = fromTradeNo
+        delay = interval
+        while stop is None or not stop():
+            page = self._trades_page( engine, market, security, 0, currTradeNo )
+            if len( page ) > 0:
+                page, currTradeNo = cut_trade_page( page, currTradeNo, False )
+                batch = self._convert_trades( page, TradeColumns() if columnar else [] )
+                self._handle( batch )
+                yield batch
+                delay = interval
+                if len( page ) == TRADES_PAGE_SIZE:
+                    # still catching up with the session
+                    continue
+            else:
+                delay = min( delay * 2, maxInterval )
+            wakeUp = time.monotonic() + delay
+            while stop is None or not stop():
+                left = wakeUp - time.monotonic()
+                if left <= 0:
+                    break
+                time.sleep( min( left, TAIL_STOP_STEP ) )
+
+    def _iter_session_pages( self, engine, market, security, prevSession, workers ):
+        """ Yield raw pages of the session in tradeno order.
+        """
+        startTradeNo, endTradeNo = self.get_session_start_end_tradenos( engine, market, security, prevSession )
+        yield from self._iter_range_pages( engine, market, security, prevSession, startTradeNo, endTradeNo, workers )
 
-            sessionEndTradeNo = int( del_null( jdata[0][ jcols.index( 'TRADENO' ) ] ) )
+    def _iter_range_pages( self, engine, market, security, prevSession, startTradeNo, endTradeNo, workers ):
+        """ Yield raw pages of trades from startTradeNo to endTradeNo in
+        tradeno order. With several workers the shards are downloaded
+        concurrently, each one only a couple of pages ahead of the consumer.
+        """
+        if workers is None:
+            workers = self.config.max_workers
 
-            print( 'session end time:', jdata[0][ jcols.index( 'SYSTIME' ) ] )
-        else:
-            url = requests['sec_trades'] % {'engine': engine,
-                                            'market': market,
-                                            'sec': security,
-                                            'previous_session': ( prevSession - 1 ),
-                                            'reversed': 1,
-                                            'limit': 1 }
+        shards = trade_shards( startTradeNo, endTradeNo, workers )
 
-            res = self.opener.open( url )
-            resStr = str( res.read().decode('utf-8') )
-            jres = json.loads( resStr )
+        def shard_pages( shard ):
+            return self._iter_trade_pages( engine, market, security, prevSession,
+                                           shard[0], shard[1], trim = shard is not shards[-1] )
 
-            # the following is also just a simple example
-            # it is recommended to keep metadata separately
-                    
-            jhist = jres['trades']
-            jdata = jhist['data']
+        if workers <= 1 or len( shards ) == 1:
+            for shard in shards:
+                yield from shard_pages( shard )
+        else:
+            yield from ordered_pages( shard_pages, shards, workers )
 
-            if len( jdata ) == 0:
-                raise ValueError( 'Can\'t get session end tradeno' )
-                
-            jcols = jhist['columns']
+    def _iter_session_trades( self, engine, market, security, prevSession, workers, columnar ):
+        """ Yield the trades of the session by shards in tradeno order,
+        as lists of tuples or as TradeColumns.
+        """
+        startTradeNo, endTradeNo = self.get_session_start_end_tradenos( engine, market, security, prevSession )
 
-            sessionEndTradeNo = int( del_null( jdata[0][ jcols.index( 'TRADENO' ) ] ) ) - 1
-        
-        return ( sessionStartTradeNo, sessionEndTradeNo )
-        
+        if workers is None:
+            workers = self.config.max_workers
 
-    # prev_session = 0 means the current session
-    # -----||----- = n means number of the previous session before current one
-    def get_trades_for_session( self, engine, market, security, prevSession ):
-        startTradeNo, endTradeNo = self.get_session_start_end_tradenos( engine, market, security, prevSession )
+        shards = trade_shards( startTradeNo, endTradeNo, workers )
 
-        result = []
-        currTradeNo = startTradeNo
-        while currTradeNo <= endTradeNo:
-            print( currTradeNo )
-            url = requests['sec_trades1'] % {'engine': engine,
-                                                'market': market,
-                                                'sec': security,
-                                                'previous_session': prevSession,
-                                                'tradeno': currTradeNo,
-                                                'limit': 5000 }
+        def fetch_shard( shard ):
+            # only the last shard may keep trades beyond its end
+            # exactly as the sequential loop does
+            trades = TradeColumns() if columnar else []
+            for page in self._iter_trade_pages( engine, market, security, prevSession,
+                                                shard[0], shard[1], trim = shard is not shards[-1] ):
+                self._convert_trades( page, trades )
+            return trades
 
+        if workers <= 1 or len( shards ) == 1:
+            for shard in shards:
+                yield fetch_shard( shard )
+        else:
+            yield from ordered_map( fetch_shard, shards, workers )
 
-            # always remember about the 'start' argument to get long replies
+    def _iter_trade_pages( self, engine, market, security, prevSession, fromTradeNo, toTradeNo, trim = False ):
+        """ Download trades starting at fromTradeNo page by page until the
+        cursor passes toTradeNo and yield each page as a list of
+        ( SYSTIME, PRICE, QUANTITY, TRADENO ) rows. If trim is set, the trades
+        of the last page with tradeno greater than toTradeNo are dropped.
+        """
+        currTradeNo = fromTradeNo
+        while currTradeNo <= toTradeNo:
+            log.debug( 'trades from tradeno %d', currTradeNo )
+            page = self._trades_page( engine, market, security, prevSession, currTradeNo )
 
-            res = self.opener.open( url )
-            resStr = str( res.read().decode('utf-8') )
-            #print( resStr )
-            #if resStr == '':
-            #    break
-            #jres = json.load(res)
-            jres = json.loads( resStr )
-
-            # the following is also just a simple example
-            # it is recommended to keep metadata separately
-
-            # root node with historical data
-            # see json response structure here:
-            # https://iss.moex.com/iss/engines/futures/markets/forts/securities/RIH8/trades.json?reversed=1&limit=10
-                
-            jhist = jres['trades']
-
-            # node with actual data
-            jdata = jhist['data']
-
-            if len( jdata ) == 0:
+            if len( page ) == 0:
                 break
 
-            # node with the list of column IDs in 'data' in correct order;
-            # it's also possible to use the iss.json=extended argument instead
-            # to get all the IDs together with data (leads to more traffic)
-            jcols = jhist['columns']
-            timeIdx = jcols.index('SYSTIME')
-            priceIdx = jcols.index('PRICE')
-            qtyIdx = jcols.index('QUANTITY')
-            tradenoIdx = jcols.index( 'TRADENO' )    
-
-            chunk = []
-            for trade in jdata:
-                dtime = time.strptime( trade[timeIdx] + '+0300', '%Y-%m-%d %H:%M:%S%z' )
-                timeEpoch = int( time.mktime( dtime ) )
-                chunk.append( ( timeEpoch,
-                                float( del_null( trade[priceIdx] ) ),
-                                int( del_null( trade[qtyIdx] ) ),
-                                int( del_null( trade[tradenoIdx] ) ) ) )
-            # we return pieces of received data on each iteration
-            # in order to be able to handle large volumes of data
-            # and to start data processing without waiting for
-            # the complete reply
-            result += chunk
+            page, currTradeNo = cut_trade_page( page, toTradeNo, trim )
+            yield page
 
-            currTradeNo = int( del_null( jdata[-1][ tradenoIdx ] ) ) + 1
-            
-        self.handler.do( result )
-        
-        return True
+    def _trades_page( self, engine, market, security, prevSession, tradeNo ):
+        """ One page of trades starting from tradeNo as a list of
+        ( SYSTIME, PRICE, QUANTITY, TRADENO ) rows.
+        """
+        url = self.requests['sec_trades1'] % {'engine': engine,
+                                            'market': market,
+                                            'sec': security,
+                                            'previous_session': prevSession,
+                                            'tradeno': tradeNo,
+                                            'limit': TRADES_PAGE_SIZE }
+
+        # rows are decoded while the reply is being read, only
+        # the needed columns of the 'trades' node are requested;
+        # see json response structure here:
+        # https://iss.moex.com/iss/engines/futures/markets/forts/securities/RIH8/trades.json?reversed=1&limit=10
+        return self._rows( url, 'trades', TRADE_COLUMNS, TRADE_TYPES )
 
     def get_security_candleborders( self, engine, market, board, security, timeFrames ):
         """ Get and parse historical data on all the securities at the
         given engine, market, board
         """
-        url = requests['sec_candleborders'] % {'engine': engine,
+        url = self.requests['sec_candleborders'] % {'engine': engine,
                                                'market': market,
                                                'board': board,
                                                'sec': security }
 
         #print(url)
 
-        res = self.opener.open( url )
-        resStr = str( res.read().decode('utf-8') )
-        #print( resStr )
-
-        jres = json.loads( resStr )
-
-        jdata_raw = jres['borders']
-        # node with actual data
-        jcols = jdata_raw['columns']
-        jdata = jdata_raw['data']
-
-        # node with the list of column IDs in 'data' in correct order;
-        # it's also possible to use the iss.json=extended argument instead
-        # to get all the IDs together with data (leads to more traffic)
         #"begin", "end", "interval"
-        beginIdx = jcols.index('begin')
-        endIdx = jcols.index('end')
-        intervalIdx = jcols.index('interval')
-            
+        jdata = self._rows( url, 'borders', ( 'begin', 'end', 'interval' ), ( str, str, int ) )
+        beginIdx = 0
+        endIdx = 1
+        intervalIdx = 2
 
         result = {}
         _timeFrames = list( timeFrames )
@@ -439,63 +580,19 @@ class MicexISSClient:
         
         return result
 
-    def get_security_candles( self, engine, market, board, security, dateFrom, dateTill, timeFrame, reverse = False ):
- 
-        candlesRead = 0
-        candles = []
-
-        reqNo = 0
-        while True:
-            if reqNo % 10 == 0:
-                print( reqNo, end = ' ' )
-            url = requests['sec_candles'] % {'engine': engine,
-                                             'market': market,
-                                             'board': board,
-                                             'sec': security,
-                                             'till': dateTill,
-                                             'from': dateFrom,
-                                             'interval': timeFrameCodes[ timeFrame ],
-                                             'reverse': reverse,
-                                             'start': candlesRead }
-
-            reqNo += 1
-            #print(url)
-
-            res = self.opener.open( url )
-            resStr = str( res.read().decode('utf-8') )
-            #print( resStr )
-
-            jres = json.loads( resStr )
-
-            jdata_raw = jres['candles']
-            # node with actual data
-            jcols = jdata_raw['columns']
-            jdata = jdata_raw['data']
-
-            # node with the list of column IDs in 'data' in correct order;
-            # it's also possible to use the iss.json=extended argument instead
-            # to get all the IDs together with data (leads to more traffic)
-            #"open", "close", "high", "low", "value", "volume", "begin", "end"
-            openIdx = jcols.index('open')
-            closeIdx = jcols.index('close')
-            highIdx = jcols.index('high')
-            lowIdx = jcols.index('low')
-            valueIdx = jcols.index('value')
-            volumeIdx = jcols.index('volume')
-            beginIdx = jcols.index('begin')
-            endIdx = jcols.index('end')
-
-            dataChunk = []
-            for cd in jdata:
-                dataChunk.append( [ cd[ openIdx ], cd[ closeIdx ], cd[ highIdx ], cd[ lowIdx ],
-                                    cd[ valueIdx ], cd[ volumeIdx ], cd[ beginIdx ], cd[ endIdx ] ] )
-
-            if len( dataChunk ) == 0:
-                break
-            
-            candles += dataChunk
-            candlesRead += len( dataChunk )
-        print( '\n' )
+    def get_security_candles( self, engine, market, board, security, dateFrom, dateTill, timeFrame, reverse = False,
+                              workers = None, columnar = False ):
+        """ Get candles of the given timeframe between dateFrom and dateTill.
+        workers > 1 downloads date subranges in parallel (intraday timeframes only).
+        columnar = True returns CandleColumns instead of a list of lists.
+        """
+        candles = CandleColumns() if columnar else []
+        for dataChunk in self._iter_security_candles( engine, market, board, security,
+                                                      dateFrom, dateTill, timeFrame, reverse, workers ):
+            if columnar:
+                candles.append_rows( dataChunk )
+            else:
+                candles += dataChunk
         
         return candles
 
@@ -514,81 +611,579 @@ class MicexISSClient:
             dateFrom = kwargs[ 'time_bounds' ][ 0 ]
             dateTill = kwargs[ 'time_bounds' ][ 1 ]
 
-        fnameOut = '%s.%s.%s.%s.txt' % ( security,
+        # fmt = 'txt' writes tab separated text, 'bin' - binary records (see iss_store)
+        fmt = kwargs.get( 'fmt', 'txt' )
+
+        fnameOut = '%s.%s.%s.%s.%s' % ( security,
                                      dateFrom,
                                      dateTill,
-                                     timeFrame )
+                                     timeFrame,
+                                     fmt )
 
         #print( fnameOut )
 
-        f = open( fnameOut, 'w' )
+        # with resume = True a checkpoint is saved after every page and an interrupted
+        # download goes on after the last candle saved to it; the day of this candle
+        # is requested again. Without it the file isn't synced before the end.
+        resume = kwargs.get( 'resume', False )
+        checkpoint = Checkpoint( fnameOut, { 'board': board, 'security': security, 'timeframe': timeFrame,
+                                             'from': dateFrom, 'till': dateTill } )
+        state = checkpoint.load() if resume and os.path.isfile( fnameOut ) else None
+        lastBegin = state[ 'last' ] if state is not None else ''
+        size = state[ 'size' ] if state is not None else 0
+
+        pages = self._iter_security_candles( engine, market, board, security,
+                                             lastBegin[ :10 ] if lastBegin else dateFrom, dateTill,
+                                             timeFrame, False, kwargs.get( 'workers' ) )
+        if fmt == 'bin':
+            with BinaryWriter( fnameOut, 'candles', CANDLE_FIELDS, append = state is not None,
+                               security = security, board = board, timeframe = timeFrame ) as writer:
+                writer.truncate( size )
+                for dataChunk in pages:
+                    dataChunk = [ cd for cd in dataChunk if cd[6] > lastBegin ]
+                    if dataChunk:
+                        writer.write_rows( [ candle_record( cd ) for cd in dataChunk ] )
+                        size += len( dataChunk )
+                        lastBegin = dataChunk[-1][6]
+                        if resume:
+                            writer.flush()
+                            checkpoint.save( last = lastBegin, size = size )
+        else:
+            f = open( fnameOut, 'r+' if state is not None else 'w' )
+            f.truncate( size )
+            f.seek( size )
+
+            for dataChunk in pages:
+                dataChunk = [ cd for cd in dataChunk if cd[6] > lastBegin ]
+                if dataChunk:
+                    f.write( ''.join( [ CANDLE_LINE % tuple( cd ) for cd in dataChunk ] ) )
+                    lastBegin = dataChunk[-1][6]
+                    if resume:
+                        f.flush()
+                        os.fsync( f.fileno() )
+                        checkpoint.save( last = lastBegin, size = f.tell() )
+
+            f.close()
+        checkpoint.remove()
+
+    def sync_security_candles( self, engine, market, board, security, timeFrame, fname = None, workers = None, fmt = 'txt' ):
+        """ Bring the candles file up to date: only the candles starting from
+        the last saved one are requested, up to the candleborders of the timeframe.
+        The last saved candle may have been incomplete, so it is replaced.
+        The new candles are saved to <fname>.tail first and then replace the
+        end of the file, so the file is never left short: a sync stopped
+        on the way is finished by the next one (see apply_candles_tail).
+        A synced file has no fixed last date, so by default it is named
+        <security>.<board>.<timeframe>.<fmt> and not as the files of
+        save_security_candles; pass fname to go on with such a file.
+        Returns the number of candles written.
+        """
+        if fname is None:
+            fname = '%s.%s.%s.%s' % ( security, board, timeFrame, fmt )
+
+        limits = self.get_security_candleborders( engine, market, board, security, ( timeFrame, ) )
+        if timeFrame not in limits:
+            return 0
+        dateTill = limits[ timeFrame ][1][ :10 ]
+
+        apply_candles_tail( fname )
+        if not os.path.isfile( fname ):
+            tmpName = fname + '.tmp'
+            if fmt == 'bin':
+                BinaryWriter( tmpName, 'candles', CANDLE_FIELDS,
+                              security = security, board = board, timeframe = timeFrame ).close()
+            else:
+                open( tmpName, 'w' ).close()
+            os.replace( tmpName, fname )
 
+        if fmt == 'bin':
+            keepSize, lastBegin = read_last_binary_candle( fname )
+            pack = record_struct( CANDLE_FIELDS ).pack
+            encode = lambda cd: pack( *candle_record( cd ) )
+        else:
+            keepSize, lastBegin = read_last_candle( fname )
+            encode = lambda cd: ( CANDLE_LINE % tuple( cd ) ).encode( 'ascii' )
+        if lastBegin is None:
+            dateFrom = limits[ timeFrame ][0][ :10 ]
+            lastBegin = ''
+        else:
+            dateFrom = lastBegin[ :10 ]
+
+        # the tail starts with the size of the file to keep
+        tmpName = fname + '.tail.tmp'
+        written = 0
+        with open( tmpName, 'wb' ) as f:
+            f.write( b'%d\n' % keepSize )
+            for dataChunk in self._iter_security_candles( engine, market, board, security, dateFrom, dateTill,
+                                                          timeFrame, False, workers ):
+                # the day of the last candle is requested again from its start
+                records = [ encode( cd ) for cd in dataChunk if cd[6] >= lastBegin ]
+                f.write( b''.join( records ) )
+                written += len( records )
+            f.flush()
+            os.fsync( f.fileno() )
+
+        if written == 0:
+            # nothing to replace the last candle with, the file stays as it is
+            os.remove( tmpName )
+            return 0
+        os.replace( tmpName, fname + '.tail' )
+        apply_candles_tail( fname )
+
+        return written
+
+    def _iter_security_candles( self, engine, market, board, security, dateFrom, dateTill, timeFrame, reverse, workers ):
+        """ Yield pages of candles in the order of the sequential download.
+        With several workers the date window is cut into subranges which
+        overlap by one day; candles already seen at the end of the previous
+        subrange are dropped when the subranges are joined.
+        """
+        if workers is None:
+            workers = self.config.max_workers
+
+        ranges = None
+        if workers > 1 and not reverse and timeFrame in INTRADAY_TIMEFRAMES:
+            ranges = self._split_candle_dates( engine, market, board, security,
+                                               dateFrom, dateTill, timeFrame, workers * 4 )
+        if not ranges or len( ranges ) == 1:
+            yield from self._iter_candle_pages( engine, market, board, security,
+                                                dateFrom, dateTill, timeFrame, reverse )
+            return
+
+        def fetch_range( dates ):
+            dataChunk = []
+            for page in self._iter_candle_pages( engine, market, board, security,
+                                                 dates[0], dates[1], timeFrame, False ):
+                dataChunk += page
+            return dataChunk
+
+        lastBegin = ''
+        for dataChunk in ordered_map( fetch_range, ranges, workers ):
+            skip = 0
+            while skip < len( dataChunk ) and dataChunk[ skip ][ 6 ] <= lastBegin:
+                skip += 1
+            if skip < len( dataChunk ):
+                lastBegin = dataChunk[ -1 ][ 6 ]
+                yield dataChunk[ skip: ]
+
+    def _split_candle_dates( self, engine, market, board, security, dateFrom, dateTill, timeFrame, parts ):
+        """ Split the from/till window into date subranges. Empty bounds are
+        taken from the candleborders of the timeframe. The first and the last
+        subranges keep the original bounds. Returns None if the window can't
+        be split.
+        """
+        first, last = dateFrom, dateTill
+        if first == '' or last == '':
+            limits = self.get_security_candleborders( engine, market, board, security, ( timeFrame, ) )
+            if timeFrame not in limits:
+                return None
+            first = first or limits[ timeFrame ][0][ :10 ]
+            last = last or limits[ timeFrame ][1][ :10 ]
+        return candle_date_ranges( dateFrom, dateTill, first, last, parts )
+
+    def _iter_candle_pages( self, engine, market, board, security, dateFrom, dateTill, timeFrame, reverse ):
+        """ Page through the candles with the 'start' argument and yield
+        each page as a list of [open, close, high, low, value, volume, begin, end].
+        """
         candlesRead = 0
-        #candles = []
 
         reqNo = 0
         while True:
-            if reqNo % 10 == 0:
-                print( reqNo, end = ' ' )
-            url = requests['sec_candles'] % {'engine': engine,
-                                             'market': market,
-                                             'board': board,
-                                             'sec': security,
-                                             'till': dateTill,
-                                             'from': dateFrom,
-                                             'interval': timeFrameCodes[ timeFrame ],
-                                             'reverse': False,
-                                             'start': candlesRead }
-
+            log.debug( 'candles page %d of %s %s..%s', reqNo, security, dateFrom, dateTill )
             reqNo += 1
-            #print(url)
 
-            res = self.opener.open( url )
-            resStr = str( res.read().decode('utf-8') )
-            #print( resStr )
-
-            jres = json.loads( resStr )
-
-            jdata_raw = jres['candles']
-            # node with actual data
-            jcols = jdata_raw['columns']
-            jdata = jdata_raw['data']
-
-            # node with the list of column IDs in 'data' in correct order;
-            # it's also possible to use the iss.json=extended argument instead
-            # to get all the IDs together with data (leads to more traffic)
-            #"open", "close", "high", "low", "value", "volume", "begin", "end"
-            openIdx = jcols.index('open')
-            closeIdx = jcols.index('close')
-            highIdx = jcols.index('high')
-            lowIdx = jcols.index('low')
-            valueIdx = jcols.index('value')
-            volumeIdx = jcols.index('volume')
-            beginIdx = jcols.index('begin')
-            endIdx = jcols.index('end')
-
-            #dataChunk = []
-            dataChunkSize = 0
-            for cd in jdata:
-                #dataChunk.append( [ cd[ openIdx ], cd[ closeIdx ], cd[ highIdx ], cd[ lowIdx ],
-                #                    cd[ valueIdx ], cd[ volumeIdx ], cd[ beginIdx ], cd[ endIdx ] ] )
-                f.write( '%f\t%f\t%f\t%f\t%f\t%f\t%s\t%s\n' % ( cd[ openIdx ], cd[ closeIdx ], cd[ highIdx ], cd[ lowIdx ],
-                                                                cd[ valueIdx ], cd[ volumeIdx ], cd[ beginIdx ], cd[ endIdx ] ) )
-                dataChunkSize += 1
-
-            #if len( dataChunk ) == 0:
-            #    break
-            if dataChunkSize == 0:
+            dataChunk = self._candles_page( engine, market, board, security, dateFrom, dateTill,
+                                            timeFrame, reverse, candlesRead )
+
+            if len( dataChunk ) == 0:
                 break
             
-            #candles += dataChunk
-            #candlesRead += len( dataChunk )
-            candlesRead += dataChunkSize
-        print( '\n' )
+            yield dataChunk
+            candlesRead += len( dataChunk )
 
-        f.close()
-        
-        #print( candles )
+    def _candles_page( self, engine, market, board, security, dateFrom, dateTill, timeFrame, reverse, start ):
+        """ One page of candles from the start offset as a list of
+        [open, close, high, low, value, volume, begin, end].
+        """
+        url = self.requests['sec_candles'] % {'engine': engine,
+                                         'market': market,
+                                         'board': board,
+                                         'sec': security,
+                                         'till': dateTill,
+                                         'from': dateFrom,
+                                         'interval': timeFrameCodes[ timeFrame ],
+                                         'reverse': reverse,
+                                         'start': start }
+
+        #print(url)
+
+        # only the candle columns are requested and taken from the reply while it is read
+        return [ list( cd ) for cd in self._rows( url, 'candles', CANDLE_COLUMNS, CANDLE_TYPES ) ]
+
+    def add_listener( self, listener ):
+        """ Add a listener (iss_metrics.MicexISSListener, e.g. RequestMetrics)
+        to get the measurements of every request and of the handler calls.
+        """
+        self.listeners.append( listener )
+
+    def remove_listener( self, listener ):
+        self.listeners.remove( listener )
+
+    def _handle( self, data ):
+        """ Pass the data to the handler.
+        """
+        if not self.listeners:
+            self.handler.do( data )
+            return
+        started = time.perf_counter()
+        self.handler.do( data )
+        self._stage( 'handler', time.perf_counter() - started, len( data ) )
+
+    def _convert_trades( self, page, trades ):
+        """ Add the raw trades of the page to trades: a list of
+        ( epoch time, price, qty, tradeno ) tuples or TradeColumns.
+        """
+        started = time.perf_counter()
+        if isinstance( trades, ColumnBuffer ):
+            trades.append_rows( page )
+        else:
+            trades += [ trade_tuple( trade ) for trade in page ]
+        if self.listeners:
+            self._stage( 'convert', time.perf_counter() - started, len( page ) )
+        return trades
+
+    def _stage( self, stage, seconds, rows ):
+        for listener in self.listeners:
+            listener.on_stage( stage, seconds, rows )
+
+    def _rows( self, url, block, columns, types ):
+        """ Request url and return the rows of the block as a list of tuples
+        of the given columns. Unless Config.select_columns is off, only these
+        columns are requested from ISS. With Config.iss_format = 'csv' the
+        reply is CSV and the values are converted with types. The request
+        is repeated after transient errors, see iss_retry.
+        """
+        if self.config.select_columns:
+            url = select_columns( url, block, columns )
+        if self.config.iss_format == 'csv':
+            url = url.replace( '.json', '.csv', 1 )
+            url += ( '&' if '?' in url else '?' ) + 'iss.dp=point'
+        return self.retry.call( self._read_rows, url, block, columns, types )
+
+    def _read_rows( self, url, block, columns, types ):
+        # the rows are collected inside the retry: a page cut by an error is requested again as a whole
+        if self.listeners:
+            return list( self._measured_rows( url, block, columns, types ) )
+        return list( self._parse( self.opener.open( url ), block, columns, types ) )
+
+    def _parse( self, res, block, columns, types ):
+        if self.config.iss_format == 'csv':
+            return iter_csv_rows( res, block, columns, types )
+        return iter_rows( res, block, columns )
+
+    def _measured_rows( self, url, block, columns, types ):
+        """ _rows with the RequestStats of the request passed to the listeners
+        when the rows are over.
+        """
+        stats = RequestStats( url )
+        started = time.perf_counter()
+        try:
+            res = self.opener.open( url )
+        except Exception as e:
+            stats.error = e
+            stats.ttfb = time.perf_counter() - started
+            self._request_done( stats )
+            raise
+        stats.connect = getattr( res, 'connect_time', 0.0 )
+        stats.ttfb = time.perf_counter() - started - stats.connect
+
+        reader = MeasuredReader( res )
+        rows = self._parse( reader, block, columns, types )
+        spent = 0.0
+        try:
+            while True:
+                started = time.perf_counter()
+                try:
+                    row = next( rows )
+                except StopIteration:
+                    break
+                finally:
+                    spent += time.perf_counter() - started
+                stats.rows += 1
+                yield row
+        except Exception as e:
+            stats.error = e
+            raise
+        finally:
+            rows.close()
+            stats.download = reader.seconds
+            stats.parse = max( spent - reader.seconds, 0.0 )
+            stats.bytes = reader.bytes
+            self._request_done( stats )
+
+    def _request_done( self, stats ):
+        for listener in self.listeners:
+            listener.on_request( stats )
+
+
+class MeasuredReader:
+    """ Response wrapper counting the bytes and the time of reads.
+    """
+
+    def __init__( self, res ):
+        self.res = res
+        self.bytes = 0
+        self.seconds = 0.0
+
+    def read( self, *args ):
+        started = time.perf_counter()
+        data = self.res.read( *args )
+        self.seconds += time.perf_counter() - started
+        self.bytes += len( data )
+        return data
+
+    def __getattr__( self, name ):
+        return getattr( self.res, name )
+
+
+def iss_requests( baseUrl = '' ):
+    """ The requests table with ISS at baseUrl instead of iss.moex.com.
+    """
+    if baseUrl == '':
+        return requests
+    return { name: re.sub( r'^https?://iss\.moex\.com', baseUrl.rstrip( '/' ), url )
+             for name, url in requests.items() }
+
+
+def select_columns( url, block, columns ):
+    """ Add the arguments which make ISS return only the given columns
+    of the block, without metadata and other blocks.
+    """
+    return url + ( '&' if '?' in url else '?' ) + 'iss.meta=off&iss.only=%s&%s.columns=%s' % ( block, block, ','.join( columns ) )
+
+
+def make_opener( config, auth = None ):
+    """ Opener for ISS requests: the pool of auth (or a new pool
+    without cookies) with the rate limit and the disk cache if they
+    are configured. Replies from the cache don't take tokens of the limit.
+    """
+    if auth != None:
+        opener = auth.pool
+    else:
+        opener = MicexHTTPPool(None, config.pool_size, config.timeout,
+                               config.proxy_url, config.debug_level)
+    if config.requests_per_second:
+        opener = ThrottledOpener(opener, TokenBucket(config.requests_per_second))
+    if config.cache_dir:
+        opener = MicexISSCache(opener, config.cache_dir, config.cache_max_bytes)
+    return opener
+
+
+def candle_date_ranges( dateFrom, dateTill, first, last, parts = None, days = None ):
+    """ Split the days from first to last ('YYYY-MM-DD') into parts subranges
+    (or subranges of the given number of days) for candle requests.
+    Adjacent subranges share one day, the first and the last ones keep the
+    original dateFrom and dateTill. Returns None if the dates can't be parsed.
+    """
+    try:
+        first = datetime.date.fromisoformat( first ).toordinal()
+        last = datetime.date.fromisoformat( last ).toordinal()
+    except ValueError:
+        return None
+
+    if parts is None:
+        parts = max( ( last - first + days ) // days, 1 )
+    bounds = [ lo for lo, hi in split_range( first, last, parts ) ]
+    ranges = []
+    for i, lo in enumerate( bounds ):
+        rangeFrom = dateFrom if i == 0 else datetime.date.fromordinal( lo ).isoformat()
+        rangeTill = dateTill if i == len( bounds ) - 1 else datetime.date.fromordinal( bounds[ i + 1 ] ).isoformat()
+        ranges.append( ( rangeFrom, rangeTill ) )
+    return ranges
+
+
+def trade_shards( startTradeNo, endTradeNo, workers ):
+    """ Tradeno shards of a session for the given number of workers.
+    """
+    if workers > 1:
+        return split_range( startTradeNo, endTradeNo, workers * 4, TRADES_PAGE_SIZE )
+    return [ ( startTradeNo, endTradeNo ) ]
+
+
+def cut_trade_page( page, toTradeNo, trim ):
+    """ Return the page (without trades past toTradeNo if trim is set)
+    and the tradeno to request the next page from.
+    """
+    nextTradeNo = int( del_null( page[-1][3] ) ) + 1
+    if trim and nextTradeNo > toTradeNo + 1:
+        page = [ trade for trade in page if del_null( trade[3] ) <= toTradeNo ]
+    return page, nextTradeNo
+
+
+def split_range( first, last, parts, minSize = 1 ):
+    """ Split the closed integer range [first, last] into at most parts
+    adjacent closed subranges not shorter than minSize (except the last one).
+    """
+    size = max( ( last - first + parts ) // parts, minSize )
+    return [ ( lo, min( lo + size - 1, last ) ) for lo in range( first, last + 1, size ) ]
+
+
+def ordered_map( func, items, workers ):
+    """ Call func for every item using a pool of worker threads and yield
+    the results in the order of items. Only a few calls per worker are
+    kept in flight, so finished results don't pile up in memory.
+    """
+    with concurrent.futures.ThreadPoolExecutor( max_workers = workers ) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append( pool.submit( func, item ) )
+            if len( pending ) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+# end of items in a feeding queue
+_END = object()
+
+
+def _feed( iterable, q, stopped ):
+    """ Put the items of iterable into the bounded queue q, waiting while it's
+    full. An exception is passed to the consumer. Gives up if stopped is set.
+    """
+    def put( item ):
+        while not stopped.is_set():
+            try:
+                q.put( item, timeout = 0.1 )
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for item in iterable:
+            if not put( ( item, None ) ):
+                return
+        put( ( _END, None ) )
+    except BaseException as e:
+        put( ( _END, e ) )
+
+
+def _drain( q ):
+    while True:
+        item, error = q.get()
+        if item is _END:
+            if error is not None:
+                raise error
+            return
+        yield item
+
+
+def prefetch( iterable, size = 4 ):
+    """ Iterate over iterable in a background thread with at most size items
+    ready in the queue. The download stage waits while the processing stage
+    is behind, so memory is bounded by size items.
+    """
+    q = queue.Queue( size )
+    stopped = threading.Event()
+    threading.Thread( target = _feed, args = ( iterable, q, stopped ), daemon = True ).start()
+    try:
+        yield from _drain( q )
+    finally:
+        stopped.set()
+
+
+def ordered_pages( func, items, workers, depth = 2 ):
+    """ Like ordered_map, but func( item ) returns an iterator of pages.
+    Every item is consumed in a worker thread into its own queue of depth
+    pages, the pages are yielded in the order of items. Workers of the later
+    items wait while their queues are full.
+    """
+    stopped = threading.Event()
+    with concurrent.futures.ThreadPoolExecutor( max_workers = workers ) as pool:
+        try:
+            pending = collections.deque()
+            for item in items:
+                q = queue.Queue( depth )
+                pool.submit( lambda item, q: _feed( func( item ), q, stopped ), item, q )
+                pending.append( q )
+                if len( pending ) >= 2 * workers:
+                    yield from _drain( pending.popleft() )
+            while pending:
+                yield from _drain( pending.popleft() )
+        finally:
+            stopped.set()
+
+
+def read_last_candle( fname ):
+    """ Find the last candle line of a file written by save_security_candles.
+    Returns ( size of the file without this line, its 'begin' )
+    or ( 0, None ) if there is no such file or it is empty.
+    """
+    if not os.path.isfile( fname ):
+        return 0, None
+    with open( fname, 'rb' ) as f:
+        f.seek( 0, os.SEEK_END )
+        size = f.tell()
+        tail = b''
+        pos = size
+        # read backwards until the start of the last line is found
+        while pos > 0 and tail.rstrip( b'\n' ).rfind( b'\n' ) < 0:
+            step = min( 4096, pos )
+            pos -= step
+            f.seek( pos )
+            tail = f.read( step ) + tail
+    body = tail.rstrip( b'\n' )
+    if body == b'':
+        return 0, None
+    lineStart = pos + body.rfind( b'\n' ) + 1
+    lastLine = body[ body.rfind( b'\n' ) + 1: ].decode( 'utf-8' )
+    return lineStart, lastLine.split( '\t' )[6]
+
+
+def read_last_binary_candle( fname ):
+    """ Find the last record of a binary candles file.
+    Returns ( size of the file without this record, its 'begin' )
+    or ( size of the header, None ) if the file has no records.
+    A record cut by an interrupted write is left out of the size too.
+    """
+    header = read_header( fname )
+    if header[ 'fields' ] != CANDLE_FIELDS:
+        raise ValueError( 'columns of %s differ' % fname )
+    count = count_records( fname )
+    if count == 0:
+        return HEADER_SIZE, None
+    last = read_last_record( fname )
+    return HEADER_SIZE + ( count - 1 ) * record_struct( CANDLE_FIELDS ).size, epoch_to_iss_time( last[6] )
+
+
+def apply_candles_tail( fname ):
+    """ Replace the end of fname by <fname>.tail saved by sync_security_candles
+    and remove the tail. Nothing is done if there is no tail. The tail
+    is renamed into place only when complete, and applying it again after
+    a crash gives the same file.
+    """
+    tailName = fname + '.tail'
+    if not os.path.isfile( tailName ):
+        return
+    with open( tailName, 'rb' ) as tail, open( fname, 'r+b' ) as f:
+        keepSize = int( tail.readline() )
+        f.truncate( keepSize )
+        f.seek( keepSize )
+        shutil.copyfileobj( tail, f )
+        f.flush()
+        os.fsync( f.fileno() )
+    os.remove( tailName )
+
+
+def trade_tuple( trade ):
+    """ Convert ( SYSTIME, PRICE, QUANTITY, TRADENO ) row of ISS
+    to ( epoch time, price, qty, tradeno ) tuple
+    """
+    return ( iss_time_to_epoch( trade[0] ),
+             float( del_null( trade[1] ) ),
+             int( del_null( trade[2] ) ),
+             int( del_null( trade[3] ) ) )
 
 
 def del_null(num):
@@ -12,11 +12,12 @@
     @copyright: 2016 by MOEX
 """
 
-import sys, time
+import logging, sys, time
 from iss_simple_client import Config
 from iss_simple_client import MicexAuth
 from iss_simple_client import MicexISSClient
 from iss_simple_client import MicexISSDataHandler
+from iss_store import BinaryWriter, TRADE_FIELDS
 
 SEC = 'RIH8'
 
@@ -46,7 +47,10 @@ class MyData:
         print("=" * 49)
 
 
-    def store_trades( self ):
+    def store_trades( self, binary = False ):
+        """ Save trades as text relative to zeroTime or,
+        if binary is set, as binary records (see iss_store).
+        """
         zeroTime = self.history[0][0]
         endTime = self.history[-1][0]
 
@@ -57,6 +61,11 @@ class MyData:
         #removing ':' from name
         fname = fname.translate( str.maketrans( '', '', ':' ) )
 
+        if binary:
+            with BinaryWriter( fname[ :-4 ] + '.bin', 'trades', TRADE_FIELDS, security = SEC ) as writer:
+                writer.write_rows( self.history )
+            return
+
         f = open( fname, 'w' )
         f.write( 'zeroTime: %d\n' % zeroTime )
         for sec in self.history:
@@ -71,12 +80,14 @@ class MyDataHandler(MicexISSDataHandler):
     def do(self, market_data):
         """ Just as an example we add all the chunks to one list.
         In real application other options should be considered because some
-        server replies may be too big to be kept in memory.
+        server replies may be too big to be kept in memory (see iss_sinks).
         """
-        self.data.history = self.data.history + market_data
+        self.data.history.extend( market_data )
 
 
 def main():
+    # messages of the client; level = logging.DEBUG shows the progress of downloads
+    logging.basicConfig( level = logging.INFO, format = '%(message)s' )
     my_config = Config( user='', password='', proxy_url='' )
     my_auth = MicexAuth(my_config)
     if my_auth.is_real_time():
@@ -111,6 +122,8 @@ def main():
     #	http://iss.moex.com/iss/engines/currency/markets
     #	https://iss.moex.com/iss/engines/currency/markets/selt/boards
     #	https://iss.moex.com/iss/engines/currency/markets/selt/boards/CETS/securities
+    #   or let iss_directory find them (the lists are kept in the file for a day):
+    #   MicexISSDirectory( iss, 'iss_directory.json' ).find( 'USD000000TOD' )
     #	now the request is fulfilled:
     #   https://iss.moex.com/iss/engines/currency/markets/selt/boards/CETS/securities/USD000000TOD/candleborders.json
     #   last argument is a list of timeframes for which the query to be done
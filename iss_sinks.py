@@ -0,0 +1,126 @@
+#!/usr/bin/env python
+"""
+    Ready handlers for the pages of trades passed by the ISS client.
+
+    With get_trades_for_session( ..., stream = True ) every page goes to the
+    handler as soon as it is parsed, and these handlers don't keep the pages,
+    so the memory used doesn't depend on the size of the session. Pages may
+    be lists of ( time, price, qty, tradeno ) tuples or TradeColumns.
+
+    A handler object is given to MicexISSClient instead of the handler class:
+
+        sink = TradeFileSink( 'RIH8.trades.bin' )
+        iss = MicexISSClient( config, sink, None )
+        iss.get_trades_for_session( 'futures', 'forts', 'RIH8', 1, stream = True )
+        sink.close()
+"""
+
+from iss_simple_client import MicexISSDataHandler
+from iss_columns import TradeColumns, ColumnBuffer
+from iss_store import BinaryWriter, TRADE_FIELDS
+
+
+class TradeFileSink( MicexISSDataHandler ):
+    """ Writes the pages to a file: binary records (see iss_store)
+    or tab separated text lines.
+    """
+
+    def __init__( self, fname, binary = True, **info ):
+        self.fname = fname
+        self.binary = binary
+        if binary:
+            self.data = BinaryWriter( fname, 'trades', TRADE_FIELDS, **info )
+        else:
+            self.data = open( fname, 'w' )
+
+    def do( self, market_data ):
+        if isinstance( market_data, ColumnBuffer ):
+            if self.binary:
+                self.data.write_columns( market_data )
+                return
+            market_data = zip( *( market_data[ name ].tolist() for name, dtype in TRADE_FIELDS ) )
+        if self.binary:
+            self.data.write_rows( market_data )
+        else:
+            self.data.write( ''.join( [ '%d\t%f\t%d\t%d\n' % trade for trade in market_data ] ) )
+
+    def close( self ):
+        self.data.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *exc ):
+        self.close()
+
+
+class NumpyAppendSink( MicexISSDataHandler ):
+    """ Appends the pages to TradeColumns kept in self.data:
+    8 bytes per value instead of a Python tuple per trade.
+    """
+
+    def __init__( self ):
+        self.data = TradeColumns()
+
+    def do( self, market_data ):
+        if isinstance( market_data, ColumnBuffer ):
+            self.data.extend( market_data )
+        elif len( market_data ) > 0:
+            self.data.append_columns( list( zip( *market_data ) ) )
+
+
+class TradeAggregator:
+    """ Running totals of trades.
+    """
+
+    def __init__( self ):
+        self.count = 0
+        self.volume = 0
+        self.turnover = 0.0
+        self.high = None
+        self.low = None
+        self.first = None
+        self.last = None
+        self.firstTime = None
+        self.lastTime = None
+
+    def vwap( self ):
+        return self.turnover / self.volume if self.volume else None
+
+
+class AggregateSink( MicexISSDataHandler ):
+    """ Keeps only the aggregates of all the trades seen (TradeAggregator
+    in self.data): count, volume, turnover, VWAP, high/low, first/last.
+    """
+
+    def __init__( self ):
+        self.data = TradeAggregator()
+
+    def do( self, market_data ):
+        if len( market_data ) == 0:
+            return
+        agg = self.data
+        if isinstance( market_data, ColumnBuffer ):
+            times, prices, qtys = market_data.time, market_data.price, market_data.qty
+            turnover = float( ( prices * qtys ).sum() )
+            high, low = float( prices.max() ), float( prices.min() )
+            volume = int( qtys.sum() )
+            first, last = float( prices[0] ), float( prices[-1] )
+            firstTime, lastTime = int( times[0] ), int( times[-1] )
+        else:
+            turnover = sum( trade[1] * trade[2] for trade in market_data )
+            high = max( trade[1] for trade in market_data )
+            low = min( trade[1] for trade in market_data )
+            volume = sum( trade[2] for trade in market_data )
+            first, last = market_data[0][1], market_data[-1][1]
+            firstTime, lastTime = market_data[0][0], market_data[-1][0]
+
+        if agg.count == 0:
+            agg.first, agg.firstTime = first, firstTime
+            agg.high, agg.low = high, low
+        agg.count += len( market_data )
+        agg.volume += volume
+        agg.turnover += turnover
+        agg.high = max( agg.high, high )
+        agg.low = min( agg.low, low )
+        agg.last, agg.lastTime = last, lastTime
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+    Compact binary files for saved candles and trades.
+
+    A file is a fixed size text header followed by fixed width little-endian
+    records, one per candle or trade:
+
+        ISSBIN1
+        {"kind": "candles", "fields": [["open", "<f8"], ...], ...}
+        <records>
+
+    The header is padded with spaces to HEADER_SIZE bytes. Records are
+    written with the struct module, so saving doesn't need NumPy; reading
+    maps the file with numpy.memmap without parsing anything. Times are
+    epoch seconds (UTC), see iss_time.
+"""
+
+import json
+import os
+import struct
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from iss_time import iss_time_to_epoch
+
+
+MAGIC = b'ISSBIN1\n'
+HEADER_SIZE = 512
+
+# NumPy dtype of every column; datetime64[s] columns are written as int64
+CANDLE_FIELDS = ( ( 'open', '<f8' ),
+                  ( 'close', '<f8' ),
+                  ( 'high', '<f8' ),
+                  ( 'low', '<f8' ),
+                  ( 'value', '<f8' ),
+                  ( 'volume', '<f8' ),
+                  ( 'begin', '<M8[s]' ),
+                  ( 'end', '<M8[s]' ) )
+
+TRADE_FIELDS = ( ( 'time', '<i8' ),
+                 ( 'price', '<f8' ),
+                 ( 'qty', '<i8' ),
+                 ( 'tradeno', '<i8' ) )
+
+_structCodes = { '<f8': 'd', '<i8': 'q', '<M8[s]': 'q' }
+
+
+def _struct_code( dtype ):
+    # '|S<n>' is a byte string of n bytes padded with zeros
+    if dtype.startswith( '|S' ):
+        return dtype[ 2: ] + 's'
+    return _structCodes[ dtype ]
+
+
+def record_struct( fields ):
+    """ struct.Struct for one record of the given fields.
+    """
+    return struct.Struct( '<' + ''.join( _struct_code( dtype ) for name, dtype in fields ) )
+
+
+def read_header( fname ):
+    """ Return the header of a binary file as a dict.
+    """
+    with open( fname, 'rb' ) as f:
+        head = f.read( HEADER_SIZE )
+    if not head.startswith( MAGIC ) or len( head ) < HEADER_SIZE:
+        raise ValueError( 'not an ISS binary file: %s' % fname )
+    header = json.loads( head[ len( MAGIC ): ].decode( 'utf-8' ) )
+    header[ 'fields' ] = tuple( tuple( field ) for field in header[ 'fields' ] )
+    return header
+
+
+class BinaryWriter:
+    """ Writer of records to a binary file. A new file gets a header,
+    an existing one is appended (its fields must match).
+    """
+
+    def __init__( self, fname, kind, fields, append = False, **info ):
+        """ fname: file name
+            kind: 'candles', 'trades' or another name stored in the header
+            fields: ( name, dtype ) of the columns
+            append: keep the records of an existing file
+            info: other values to keep in the header (security, timeframe...)
+        """
+        self.fname = fname
+        self.fields = tuple( fields )
+        self.packer = record_struct( self.fields )
+        if append and os.path.isfile( fname ) and os.path.getsize( fname ) >= HEADER_SIZE:
+            if read_header( fname )[ 'fields' ] != self.fields:
+                raise ValueError( 'columns of %s differ' % fname )
+            self.f = open( fname, 'r+b' )
+            # a record cut by an interrupted write is dropped
+            size = os.path.getsize( fname )
+            self.f.truncate( size - ( size - HEADER_SIZE ) % self.packer.size )
+            self.f.seek( 0, os.SEEK_END )
+        else:
+            self.f = open( fname, 'wb' )
+            header = dict( info, kind = kind, fields = self.fields )
+            head = MAGIC + json.dumps( header ).encode( 'utf-8' )
+            if len( head ) >= HEADER_SIZE:
+                raise ValueError( 'header is too long' )
+            self.f.write( head + b' ' * ( HEADER_SIZE - 1 - len( head ) ) + b'\n' )
+        self.rows = 0
+
+    def write_rows( self, rows ):
+        """ Write records given as sequences of numbers in the order of fields.
+        """
+        pack = self.packer.pack
+        self.f.write( b''.join( [ pack( *row ) for row in rows ] ) )
+        self.rows += len( rows )
+
+    def write_columns( self, columns ):
+        """ Write a ColumnBuffer (iss_columns) with the same fields.
+        """
+        if len( columns ) == 0:
+            return
+        records = np.empty( len( columns ), dtype = list( self.fields ) )
+        for name, dtype in self.fields:
+            records[ name ] = columns[ name ]
+        self.f.write( records.tobytes() )
+        self.rows += len( columns )
+
+    def truncate( self, rows ):
+        """ Keep only the first rows records of the file.
+        """
+        self.f.truncate( HEADER_SIZE + rows * self.packer.size )
+        self.f.seek( 0, os.SEEK_END )
+
+    def flush( self ):
+        """ Make the records written so far durable.
+        """
+        self.f.flush()
+        os.fsync( self.f.fileno() )
+
+    def close( self ):
+        self.flush()
+        self.f.close()
+
+    def __enter__( self ):
+        return self
+
+    def __exit__( self, *exc ):
+        self.close()
+
+
+def candle_record( cd ):
+    """ [open, close, high, low, value, volume, begin, end] row of ISS as a record.
+    """
+    return ( float( cd[0] or 0 ), float( cd[1] or 0 ), float( cd[2] or 0 ), float( cd[3] or 0 ),
+             float( cd[4] or 0 ), float( cd[5] or 0 ), iss_time_to_epoch( cd[6] ), iss_time_to_epoch( cd[7] ) )
+
+
+def count_records( fname ):
+    """ Number of complete records in a binary file.
+    """
+    header = read_header( fname )
+    return ( os.path.getsize( fname ) - HEADER_SIZE ) // record_struct( header[ 'fields' ] ).size
+
+
+def read_last_record( fname ):
+    """ Last record of a binary file as a tuple of numbers or None.
+    """
+    header = read_header( fname )
+    packer = record_struct( header[ 'fields' ] )
+    count = count_records( fname )
+    if count == 0:
+        return None
+    with open( fname, 'rb' ) as f:
+        f.seek( HEADER_SIZE + ( count - 1 ) * packer.size )
+        return packer.unpack( f.read( packer.size ) )
+
+
+def read_first_record( fname ):
+    """ First record of a binary file as a tuple of numbers or None.
+    """
+    packer = record_struct( read_header( fname )[ 'fields' ] )
+    with open( fname, 'rb' ) as f:
+        f.seek( HEADER_SIZE )
+        data = f.read( packer.size )
+    return packer.unpack( data ) if len( data ) == packer.size else None
+
+
+def trades_summary( fname ):
+    """ rows, first and last time and tradeno of a binary trades file as a dict.
+    """
+    summary = { 'rows': count_records( fname ) }
+    if summary[ 'rows' ]:
+        first = read_first_record( fname )
+        last = read_last_record( fname )
+        summary.update( first_time = first[0], last_time = last[0], first_tradeno = first[3], last_tradeno = last[3] )
+    return summary
+
+
+def load( fname, kind = None, mode = 'r' ):
+    """ Map the records of a binary file as a NumPy structured array,
+    columns are accessed as arr[ 'price' ] etc. Nothing is read in advance.
+    If kind is given, the file must have been written with this kind.
+    """
+    if np is None:
+        raise ImportError( 'numpy is required to load binary files' )
+    header = read_header( fname )
+    if kind is not None and header[ 'kind' ] != kind:
+        raise ValueError( '%s keeps %s, not %s' % ( fname, header[ 'kind' ], kind ) )
+    dtype = np.dtype( list( header[ 'fields' ] ) )
+    count = ( os.path.getsize( fname ) - HEADER_SIZE ) // dtype.itemsize
+    if count == 0:
+        return np.zeros( 0, dtype )
+    return np.memmap( fname, dtype = dtype, mode = mode, offset = HEADER_SIZE, shape = ( count, ) )
+
+
+def load_candles( fname ):
+    return load( fname, 'candles' )
+
+
+def load_trades( fname ):
+    return load( fname, 'trades' )
+
+
+# one time of every INDEX_STEP records is kept in the sparse index
+INDEX_STEP = 1024
+
+
+def to_epoch( t ):
+    """ Time for HistoryReader queries: epoch seconds, numpy.datetime64
+    or ISS 'YYYY-MM-DD[ HH:MM:SS]' Moscow time string.
+    """
+    if isinstance( t, str ):
+        return iss_time_to_epoch( t )
+    if np is not None and isinstance( t, np.datetime64 ):
+        return int( t.astype( 'datetime64[s]' ).astype( 'int64' ) )
+    return int( t )
+
+
+class HistoryReader:
+    """ Random access by time to a binary file of candles or trades.
+    The file is memory-mapped, only a sparse index with the time of every
+    INDEX_STEP-th record is kept in memory. A query does a binary search
+    in the index and then in one block of the file, and returns a view
+    of the mapped records, so nothing outside of the result is read.
+    """
+
+    def __init__( self, fname, step = INDEX_STEP ):
+        self.fname = fname
+        self.header = read_header( fname )
+        self.records = load( fname )
+        self.step = step
+        # records are in time order: by 'begin' for candles, by 'time' for trades
+        timeField = 'begin' if self.header[ 'kind' ] == 'candles' else 'time'
+        self.times = self.records[ timeField ].view( 'int64' ) if len( self.records ) else np.zeros( 0, 'int64' )
+        self.index = np.array( self.times[ ::step ] )
+
+    def __len__( self ):
+        return len( self.records )
+
+    def position( self, t ):
+        """ Number of the first record with time >= t.
+        """
+        t = to_epoch( t )
+        k = int( np.searchsorted( self.index, t, 'left' ) )
+        if k == 0:
+            return 0
+        lo = ( k - 1 ) * self.step
+        hi = min( k * self.step, len( self.times ) )
+        return lo + int( np.searchsorted( self.times[ lo:hi ], t, 'left' ) )
+
+    def slice( self, t0, t1 ):
+        """ Records with t0 <= time < t1 as a view of the mapped file.
+        """
+        return self.records[ self.position( t0 ):self.position( t1 ) ]
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+    Request rate limiting toward ISS.
+
+    TokenBucket lets through 'rate' requests per second on average with
+    bursts up to 'burst' requests. ThrottledOpener wraps an opener, so that
+    all the workers using it share one bucket.
+"""
+
+import threading
+import time
+
+
+class TokenBucket:
+    """ Thread-safe token bucket.
+    """
+
+    def __init__( self, rate, burst = None ):
+        """ rate: tokens added per second
+            burst: bucket size, rate (at least 1) by default
+        """
+        self.rate = float( rate )
+        self.burst = float( burst if burst is not None else max( rate, 1 ) )
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire( self, tokens = 1 ):
+        """ Take tokens, sleeping until they are available.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min( self.burst, self.tokens + ( now - self.stamp ) * self.rate )
+                self.stamp = now
+                if self.tokens >= tokens:
+                    self.tokens -= tokens
+                    return
+                wait = ( tokens - self.tokens ) / self.rate
+            time.sleep( wait )
+
+
+class ThrottledOpener:
+    """ Opener which takes a token from the bucket before every request.
+    """
+
+    def __init__( self, opener, bucket ):
+        self.opener = opener
+        self.bucket = bucket
+
+    def open( self, url, headers = None ):
+        self.bucket.acquire()
+        return self.opener.open( url, headers )
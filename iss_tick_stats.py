@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+"""
+    Statistics of the trades of a session computed with NumPy.
+
+    The functions take trades as columns: TradeColumns got with
+    get_trades_for_session( ..., columnar = True ) or the records of a
+    binary trades file (iss_store.load_trades), both have time (epoch
+    seconds), price, qty and tradeno. Everything is done with whole-array
+    operations, so a session of millions of trades takes milliseconds.
+
+        trades = iss.get_trades_for_session( 'futures', 'forts', 'RIH8', 1, columnar = True )
+        vwap( trades )
+        prices, volumes = volume_at_price( trades, tick = 10 )
+        seconds = time_buckets( trades, 1 )        # trades, volume, vwap... of every second
+        sigma = rolling_volatility( trades, 100 )
+
+    NumPy is needed for this module.
+"""
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# fields of the result of time_buckets
+BUCKET_FIELDS = [ ( 'start', 'int64' ),
+                  ( 'trades', 'int64' ),
+                  ( 'volume', 'int64' ),
+                  ( 'value', 'float64' ),
+                  ( 'open', 'float64' ),
+                  ( 'close', 'float64' ),
+                  ( 'high', 'float64' ),
+                  ( 'low', 'float64' ),
+                  ( 'vwap', 'float64' ) ]
+
+
+def _column( trades, name, dtype ):
+    if np is None:
+        raise ImportError( 'numpy is required for trade statistics' )
+    return np.asarray( trades[ name ], dtype = dtype )
+
+
+def vwap( trades ):
+    """ Volume weighted average price of the trades, nan if there is no volume.
+    """
+    price = _column( trades, 'price', 'float64' )
+    qty = _column( trades, 'qty', 'float64' )
+    volume = qty.sum()
+    return float( np.dot( price, qty ) / volume ) if volume else float( 'nan' )
+
+
+def running_vwap( trades ):
+    """ VWAP of the session up to every trade.
+    """
+    price = _column( trades, 'price', 'float64' )
+    qty = _column( trades, 'qty', 'float64' )
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        return np.cumsum( price * qty ) / np.cumsum( qty )
+
+
+def volume_at_price( trades, tick = None ):
+    """ Volume profile: ( prices, volumes ) with the ascending traded prices
+    and the quantity traded at each. With tick the prices are rounded to
+    the multiples of tick first.
+    """
+    price = _column( trades, 'price', 'float64' )
+    qty = _column( trades, 'qty', 'int64' )
+    if tick:
+        levels = np.round( price / tick ).astype( 'int64' )
+        low = levels.min() if len( levels ) else 0
+        span = levels.max() - low + 1 if len( levels ) else 0
+        if span <= 4 * len( levels ) + 1024:
+            # a dense range of levels: counted without sorting
+            volumes = np.bincount( levels - low, weights = qty, minlength = span )
+            traded = np.flatnonzero( np.bincount( levels - low, minlength = span ) )
+            return ( traded + low ) * tick, volumes[ traded ].astype( 'int64' )
+        keys, inverse = np.unique( levels, return_inverse = True )
+        prices = keys * tick
+    else:
+        prices, inverse = np.unique( price, return_inverse = True )
+    return prices, np.bincount( inverse.ravel(), weights = qty, minlength = len( prices ) ).astype( 'int64' )
+
+
+def time_buckets( trades, seconds = 1 ):
+    """ Aggregates of the trades in every interval of the given number of
+    seconds which has trades, as a structured array of BUCKET_FIELDS:
+    start of the interval (epoch seconds), number of trades, volume, value,
+    open, close, high, low and vwap. Trades must be in time order as they
+    come from ISS.
+    """
+    time = _column( trades, 'time', 'int64' )
+    price = _column( trades, 'price', 'float64' )
+    qty = _column( trades, 'qty', 'int64' )
+    if len( time ) == 0:
+        return np.zeros( 0, BUCKET_FIELDS )
+    keys = time // seconds * seconds
+    starts = np.concatenate( ( [ 0 ], np.flatnonzero( np.diff( keys ) ) + 1 ) )
+    ends = np.append( starts[ 1: ], len( keys ) )
+    buckets = np.zeros( len( starts ), BUCKET_FIELDS )
+    buckets[ 'start' ] = keys[ starts ]
+    buckets[ 'trades' ] = ends - starts
+    buckets[ 'volume' ] = np.add.reduceat( qty, starts )
+    buckets[ 'value' ] = np.add.reduceat( price * qty, starts )
+    buckets[ 'open' ] = price[ starts ]
+    buckets[ 'close' ] = price[ ends - 1 ]
+    buckets[ 'high' ] = np.maximum.reduceat( price, starts )
+    buckets[ 'low' ] = np.minimum.reduceat( price, starts )
+    with np.errstate( invalid = 'ignore', divide = 'ignore' ):
+        buckets[ 'vwap' ] = buckets[ 'value' ] / buckets[ 'volume' ]
+    return buckets
+
+
+def tradeno_gaps( trades, maxStep = 1 ):
+    """ Positions i where tradeno[ i + 1 ] - tradeno[ i ] is not within
+    1..maxStep: lost pages (a jump) or repeated and disordered trades
+    (a step <= 0). Trade numbers of FORTS are common to all the contracts,
+    so there maxStep should be large or only the steps <= 0 matter.
+    """
+    tradeno = _column( trades, 'tradeno', 'int64' )
+    steps = np.diff( tradeno )
+    return np.flatnonzero( ( steps < 1 ) | ( steps > maxStep ) )
+
+
+def rolling_volatility( trades, window ):
+    """ Standard deviation of the log returns between consecutive trades
+    over the last window returns, for every trade; nan for the first window
+    trades. The sums are taken from cumulative sums, not window by window.
+    """
+    price = _column( trades, 'price', 'float64' )
+    result = np.full( len( price ), np.nan )
+    if window < 2 or len( price ) <= window:
+        return result
+    returns = np.diff( np.log( price ) )
+    sums = np.concatenate( ( [ 0.0 ], np.cumsum( returns ) ) )
+    squares = np.concatenate( ( [ 0.0 ], np.cumsum( returns * returns ) ) )
+    s = sums[ window: ] - sums[ :-window ]
+    s2 = squares[ window: ] - squares[ :-window ]
+    variance = ( s2 - s * s / window ) / ( window - 1 )
+    result[ window: ] = np.sqrt( np.maximum( variance, 0.0 ) )
+    return result
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+    Conversion of ISS timestamps to epoch seconds.
+
+    ISS gives times ('SYSTIME' of trades, 'begin'/'end' of candles) as
+    'YYYY-MM-DD HH:MM:SS' strings in Moscow time. time.strptime + time.mktime
+    per row is slow and mktime uses the timezone of the host. Here the epoch
+    of every date is computed once and cached, the time of day is added by
+    plain arithmetic, and the Moscow offset (UTC+3) is applied always.
+"""
+
+import calendar
+import datetime
+import time
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+# ISS times are Moscow time (UTC+3)
+MSK_OFFSET = 3 * 3600
+# the history of a date may be published or completed by ISS up to this number of days later
+HISTORY_MARGIN_DAYS = 2
+
+# 'YYYY-MM-DD' -> epoch of the Moscow midnight of this date
+_dayStart = {}
+
+
+def iss_day_to_epoch( date ):
+    """ Epoch seconds of the Moscow midnight of 'YYYY-MM-DD' date.
+    """
+    epoch = _dayStart.get( date )
+    if epoch is None:
+        epoch = calendar.timegm( ( int( date[ :4 ] ), int( date[ 5:7 ] ), int( date[ 8:10 ] ), 0, 0, 0 ) ) - MSK_OFFSET
+        _dayStart[ date ] = epoch
+    return epoch
+
+
+def iss_time_to_epoch( value ):
+    """ Epoch seconds of ISS 'YYYY-MM-DD HH:MM:SS' (or 'YYYY-MM-DD') Moscow time.
+    """
+    epoch = _dayStart.get( value[ :10 ] )
+    if epoch is None:
+        epoch = iss_day_to_epoch( value[ :10 ] )
+    if len( value ) < 19:
+        return epoch
+    return epoch + int( value[ 11:13 ] ) * 3600 + int( value[ 14:16 ] ) * 60 + int( value[ 17:19 ] )
+
+
+def iss_times_to_epoch( values ):
+    """ Convert a page of ISS times at once: int64 array if NumPy
+    is available, a list of ints otherwise.
+    """
+    if np is not None:
+        return np.array( values, dtype = 'datetime64[s]' ).astype( 'int64' ) - MSK_OFFSET
+    return [ iss_time_to_epoch( value ) for value in values ]
+
+
+def epoch_to_iss_time( epoch ):
+    """ Format epoch seconds back as ISS 'YYYY-MM-DD HH:MM:SS' Moscow time.
+    """
+    tm = time.gmtime( epoch + MSK_OFFSET )
+    return '%04d-%02d-%02d %02d:%02d:%02d' % tm[ :6 ]
+
+
+def msk_today():
+    """ Today's date in Moscow as 'YYYY-MM-DD'.
+    """
+    return time.strftime( '%Y-%m-%d', time.gmtime( time.time() + MSK_OFFSET ) )
+
+
+def last_final_history_date( today = None ):
+    """ The last date ('YYYY-MM-DD') whose history won't change any more:
+    HISTORY_MARGIN_DAYS before today in Moscow.
+    """
+    day = datetime.date.fromisoformat( today or msk_today() )
+    return ( day - datetime.timedelta( days = HISTORY_MARGIN_DAYS ) ).isoformat()
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+    Archive of the trades of a security over many sessions.
+
+    Every session is kept in its own binary file of iss_store named by its
+    first tradeno, which stays the same whatever day it is downloaded on:
+
+        <root>/<security>/<first tradeno>.trades.bin
+        <root>/<security>/index.json
+
+    The index keeps the rows, the first and last tradeno and time of every
+    session. update() asks ISS only for the first trade of each recent
+    session (one request per session): a session whose first tradeno is
+    in the index is not downloaded again, the end of a new one is the
+    trade before the next session. The current session is saved as
+    incomplete and is continued from its last trade by the next update.
+
+        archive = TradeArchive( iss, 'trades', 'futures', 'forts', 'RIH8' )
+        archive.update( 3 )                    # the current and 2 previous sessions
+        trades = archive.read( '2018-03-06 10:00:00', '2018-03-07 12:00:00' )
+        trades[ 'time' ], trades[ 'price' ]...
+
+    Queries map only the files of the sessions in the range (see HistoryReader).
+"""
+
+import json
+import logging
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from iss_simple_client import del_null, ordered_map
+from iss_store import BinaryWriter, HistoryReader, TRADE_FIELDS, load, to_epoch, trades_summary
+
+
+log = logging.getLogger( 'iss.archive' )
+
+
+class TradeArchive:
+    """ Sessions of trades of one security saved under root with an index.
+    """
+
+    def __init__( self, client, root, engine, market, security, workers = None ):
+        """ client: MicexISSClient used for the downloads
+            workers: threads downloading a session, Config.max_workers by default
+        """
+        self.client = client
+        self.engine = engine
+        self.market = market
+        self.security = security
+        self.workers = workers
+        self.dir = os.path.join( root, security )
+        self.indexFile = os.path.join( self.dir, 'index.json' )
+        # sessions in tradeno order
+        self.sessions = []
+        if os.path.isfile( self.indexFile ):
+            with open( self.indexFile ) as f:
+                self.sessions = json.load( f )[ 'sessions' ]
+
+    def find( self, startTradeNo ):
+        """ Index entry of the session starting at startTradeNo or None.
+        """
+        for entry in self.sessions:
+            if entry[ 'start_tradeno' ] == startTradeNo:
+                return entry
+        return None
+
+    def update( self, count = 1 ):
+        """ Download the sessions among the last count ones (0 - the current)
+        which are not in the archive or are incomplete. Returns their index entries.
+        """
+        starts = list( ordered_map( self._session_start, range( count ), self.workers or self.client.config.max_workers ) )
+        updated = []
+        for prevSession, start in enumerate( starts ):
+            if start is None:
+                continue
+            entry = self.find( start )
+            if entry is not None and entry[ 'complete' ]:
+                continue
+            if prevSession == 0:
+                end = self._edge( prevSession, True )
+            elif starts[ prevSession - 1 ] is not None:
+                end = starts[ prevSession - 1 ] - 1
+            else:
+                end = self._edge( prevSession, True )
+            updated.append( self._download( prevSession, start, end, entry, complete = prevSession > 0 ) )
+        return updated
+
+    def read( self, t0, t1 ):
+        """ Trades with t0 <= time < t1 of all the sessions as a NumPy structured
+        array of TRADE_FIELDS. Times as for HistoryReader: epoch seconds,
+        datetime64 or ISS 'YYYY-MM-DD[ HH:MM:SS]' Moscow time.
+        """
+        t0, t1 = to_epoch( t0 ), to_epoch( t1 )
+        parts = [ HistoryReader( self._path( entry ) ).slice( t0, t1 ) for entry in self.sessions
+                  if entry[ 'rows' ] and entry[ 'first_time' ] < t1 and entry[ 'last_time' ] >= t0 ]
+        return self._join( parts )
+
+    def read_tradenos( self, first, last ):
+        """ Trades with first <= tradeno <= last of all the sessions.
+        """
+        parts = []
+        for entry in self.sessions:
+            if entry[ 'rows' ] and entry[ 'first_tradeno' ] <= last and entry[ 'last_tradeno' ] >= first:
+                records = load( self._path( entry ), 'trades' )
+                tradenos = records[ 'tradeno' ]
+                parts.append( records[ np.searchsorted( tradenos, first, 'left' ):
+                                       np.searchsorted( tradenos, last, 'right' ) ] )
+        return self._join( parts )
+
+    def _join( self, parts ):
+        if np is None:
+            raise ImportError( 'numpy is required to read the archive' )
+        if not parts:
+            return np.zeros( 0, list( TRADE_FIELDS ) )
+        return np.concatenate( parts )
+
+    def _path( self, entry ):
+        return os.path.join( self.dir, entry[ 'file' ] )
+
+    def _session_start( self, prevSession ):
+        try:
+            return self._edge( prevSession, False )
+        except ValueError as e:
+            log.warning( '%s: no session %d: %s', self.security, prevSession, e )
+            return None
+
+    def _edge( self, prevSession, isReversed ):
+        return int( del_null( self.client.get_session_edge( self.engine, self.market, self.security,
+                                                            prevSession, isReversed )[3] ) )
+
+    def _download( self, prevSession, start, end, entry, complete ):
+        """ Save the trades of the session from start (or after the saved
+        ones of an incomplete entry) to end and update the index.
+        """
+        name = '%d.trades.bin' % start
+        fname = os.path.join( self.dir, name )
+        os.makedirs( self.dir, exist_ok = True )
+        if entry is not None:
+            # continue an incomplete session; trades written after the last index update are dropped
+            out = BinaryWriter( fname, 'trades', TRADE_FIELDS, append = True, security = self.security )
+            out.truncate( entry[ 'rows' ] )
+            fromTradeNo = entry[ 'last_tradeno' ] + 1 if entry[ 'rows' ] else start
+            target = fname
+        else:
+            target = fname + '.tmp'
+            out = BinaryWriter( target, 'trades', TRADE_FIELDS, security = self.security )
+            fromTradeNo = start
+        with out:
+            if fromTradeNo <= end:
+                for page in self.client._iter_range_pages( self.engine, self.market, self.security, prevSession,
+                                                           fromTradeNo, end, self.workers ):
+                    out.write_rows( self.client._convert_trades( page, [] ) )
+        if target != fname:
+            os.replace( target, fname )
+
+        new = dict( trades_summary( fname ), file = name, start_tradeno = start, end_tradeno = end,
+                    complete = complete )
+        self.sessions = sorted( [ e for e in self.sessions if e[ 'start_tradeno' ] != start ] + [ new ],
+                                key = lambda e: e[ 'start_tradeno' ] )
+        self._save_index()
+        log.info( '%s: session %d from tradeno %d, %d trades%s', self.security, prevSession, start,
+                  new[ 'rows' ], '' if complete else ' so far' )
+        return new
+
+    def _save_index( self ):
+        tmp = self.indexFile + '.tmp'
+        with open( tmp, 'w' ) as f:
+            json.dump( { 'security': self.security, 'engine': self.engine, 'market': self.market,
+                         'sessions': self.sessions }, f, indent = 1 )
+        os.replace( tmp, self.indexFile )
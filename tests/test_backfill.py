@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+    Backfill by worker processes against the local mock ISS (iss_mock_server):
+    joined sessions equal save_trades_for_session, the index tells a finished
+    session from the current one, and the current one is continued by a re-run.
+
+        python -m pytest tests
+"""
+
+import filecmp
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from iss_backfill import MicexISSBackfill
+from iss_mock_server import MockISSServer
+from iss_simple_client import Config, MicexISSClient, MicexISSDataHandler
+
+
+class BackfillTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.server = MockISSServer( trades = 12000 ).start()
+        self.config = Config( iss_url = self.server.url, max_workers = 2 )
+        self.out = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        self.server.stop()
+        shutil.rmtree( self.out )
+
+    def backfill( self, prevSession ):
+        backfill = MicexISSBackfill( self.config, self.out, processes = 2, parts = 3 )
+        session, = backfill.run( [ ( 'futures', 'forts', 'RIH8', prevSession ) ] )
+        self.assertIsNone( session.error )
+        return session
+
+    def reference( self, prevSession ):
+        iss = MicexISSClient( self.config, MicexISSDataHandler, list )
+        return iss.save_trades_for_session( 'futures', 'forts', 'RIH8', prevSession,
+                                            fname = os.path.join( self.out, 'reference.bin' ) )
+
+    def index( self ):
+        with open( os.path.join( self.out, 'index.json' ) ) as f:
+            return json.load( f )
+
+    def test_finished_session( self ):
+        session = self.backfill( 1 )
+        self.assertTrue( filecmp.cmp( session.fname, self.reference( 1 ), shallow = False ) )
+        entry = self.index()[ session.key ]
+        self.assertTrue( entry[ 'complete' ] )
+        self.assertEqual( entry[ 'rows' ], 12000 )
+
+        # a re-run asks only for the session edges
+        requests = self.server.requests
+        self.backfill( 1 )
+        self.assertEqual( self.server.requests - requests, 2 )
+        self.assertEqual( os.listdir( os.path.join( self.out, 'shards' ) ), [] )
+
+    def test_current_session_is_continued( self ):
+        full = self.server.data.session( 'RIH8', 0 )
+        self.server.data.sessions[ ( 'RIH8', 0 ) ] = tuple( column[ :7000 ] for column in full )
+        session = self.backfill( 0 )
+        entry = self.index()[ session.key ]
+        self.assertFalse( entry[ 'complete' ] )
+        self.assertEqual( entry[ 'rows' ], 7000 )
+
+        # the session goes on: only the new trades are downloaded
+        self.server.data.sessions[ ( 'RIH8', 0 ) ] = full
+        session = self.backfill( 0 )
+        self.assertEqual( self.index()[ session.key ][ 'rows' ], 12000 )
+        self.assertTrue( filecmp.cmp( session.fname, self.reference( 0 ), shallow = False ) )
+
+    def test_shards_of_another_split_are_dropped( self ):
+        backfill = MicexISSBackfill( self.config, self.out, processes = 2, parts = 2 )
+        session, = backfill.run( [ ( 'futures', 'forts', 'RIH8', 1 ) ] )
+        # a shard left by an interrupted run with another number of parts
+        stale = os.path.join( self.out, 'shards', '%s.%d-%d.bin' % ( session.key, session.startTradeNo, 1 ) )
+        shutil.copyfile( session.fname, stale )
+        del backfill.index[ session.key ]
+        backfill.save_index()
+        session = self.backfill( 1 )
+        self.assertFalse( os.path.exists( stale ) )
+        self.assertTrue( filecmp.cmp( session.fname, self.reference( 1 ), shallow = False ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+    Freshness policy of the reply cache (iss_cache.is_immutable) at the
+    boundaries of trades, history and candles, and the history replies
+    kept by MicexISSCache against the local mock ISS (iss_mock_server).
+
+        python -m pytest tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from iss_cache import MicexISSCache, is_immutable
+from iss_http_pool import MicexHTTPPool
+from iss_mock_server import MockISSServer
+
+
+ISS = 'http://iss.moex.com/iss'
+TRADES = ISS + '/engines/futures/markets/forts/securities/RIH8/trades.json?previous_session=%s'
+HISTORY = ISS + '/history/engines/stock/markets/shares/boards/TQBR/securities.json?date=%s'
+CANDLES = ISS + '/engines/futures/markets/forts/boards/RFUD/securities/RIH8/candles.json?from=2018-01-01&till=%s'
+# a Wednesday
+TODAY = '2018-03-07'
+
+
+class ImmutableTest( unittest.TestCase ):
+
+    def test_trades( self ):
+        self.assertTrue( is_immutable( TRADES % 1 + '&tradeno=100', TODAY ) )
+        self.assertTrue( is_immutable( ( TRADES % 1 + '&tradeno=100' ).replace( '.json', '.csv' ), TODAY ) )
+        # the current session grows, previous_session alone shifts every day
+        self.assertFalse( is_immutable( TRADES % 0 + '&tradeno=100', TODAY ) )
+        self.assertFalse( is_immutable( TRADES % 1, TODAY ) )
+        self.assertFalse( is_immutable( TRADES % 1 + '&reversed=1&limit=1', TODAY ) )
+
+    def test_history( self ):
+        self.assertTrue( is_immutable( HISTORY % '2018-03-05', TODAY ) )
+        self.assertTrue( is_immutable( HISTORY % '2018-03-05&start=100', TODAY ) )
+        # the last days may be published later
+        self.assertFalse( is_immutable( HISTORY % '2018-03-06', TODAY ) )
+        self.assertFalse( is_immutable( HISTORY % TODAY, TODAY ) )
+        self.assertFalse( is_immutable( HISTORY % '', TODAY ) )
+
+    def test_candles( self ):
+        self.assertTrue( is_immutable( CANDLES % '2018-03-06' + '&interval=1', TODAY ) )
+        self.assertTrue( is_immutable( CANDLES % '2018-03-06', TODAY ) )
+        self.assertFalse( is_immutable( CANDLES % TODAY + '&interval=60', TODAY ) )
+        self.assertFalse( is_immutable( CANDLES % '' + '&interval=24', TODAY ) )
+        # the candle of the current week, month or quarter still changes
+        self.assertTrue( is_immutable( CANDLES % '2018-03-04' + '&interval=7', TODAY ) )
+        self.assertFalse( is_immutable( CANDLES % '2018-03-05' + '&interval=7', TODAY ) )
+        self.assertTrue( is_immutable( CANDLES % '2018-02-28' + '&interval=31', TODAY ) )
+        self.assertFalse( is_immutable( CANDLES % '2018-03-01' + '&interval=31', TODAY ) )
+        self.assertTrue( is_immutable( CANDLES % '2017-12-31' + '&interval=4', TODAY ) )
+        self.assertFalse( is_immutable( CANDLES % '2018-01-01' + '&interval=4', TODAY ) )
+
+    def test_other( self ):
+        self.assertFalse( is_immutable( ISS + '/engines/stock/markets/shares/securities.json', TODAY ) )
+
+
+class HistoryCacheTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.server = MockISSServer( days = 5, securities = 10 ).start()
+        self.path = tempfile.mkdtemp()
+        self.cache = MicexISSCache( MicexHTTPPool(), self.path )
+
+    def tearDown( self ):
+        self.server.stop()
+        shutil.rmtree( self.path )
+
+    def fetch( self, url ):
+        with self.cache.open( url ) as res:
+            return res.read()
+
+    def test_rows_are_cached( self ):
+        for ext in ( 'json', 'csv' ):
+            url = self.server.url + '/iss/history/engines/stock/markets/shares/boards/TQBR/securities.%s?date=2018-03-06' % ext
+            data = self.fetch( url )
+            requests = self.server.requests
+            self.assertEqual( self.fetch( url ), data )
+            self.assertEqual( self.server.requests, requests )
+
+    def test_empty_page_is_not_cached( self ):
+        for ext in ( 'json', 'csv' ):
+            # a day without history, as one not published yet
+            url = self.server.url + '/iss/history/engines/stock/markets/shares/boards/TQBR/securities.%s?date=2018-03-04' % ext
+            self.fetch( url )
+            requests = self.server.requests
+            self.fetch( url )
+            self.assertEqual( self.server.requests, requests + 1 )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""
+    Bulk history download against the local mock ISS (iss_mock_server):
+    days without history are saved as empty only HISTORY_MARGIN_DAYS after
+    the date, the last days are requested again by the next run, also
+    through the reply cache.
+
+        python -m pytest tests
+"""
+
+import datetime
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from iss_history_bulk import MicexISSHistoryBulk, date_range
+from iss_mock_server import MockISSServer
+from iss_simple_client import Config, MicexISSClient, MicexISSDataHandler
+from iss_store import count_records
+from iss_time import last_final_history_date, msk_today
+
+
+class HistoryBulkTest( unittest.TestCase ):
+
+    def setUp( self ):
+        today = datetime.date.fromisoformat( msk_today() )
+        self.dateFrom = ( today - datetime.timedelta( days = 10 ) ).isoformat()
+        self.dateTill = today.isoformat()
+        # history up to 5 days ago, the later days are not published yet
+        lastDay = ( today - datetime.timedelta( days = 5 ) ).isoformat()
+        self.server = MockISSServer( days = 10, securities = 120, lastDay = lastDay ).start()
+        self.dir = tempfile.mkdtemp()
+        config = Config( iss_url = self.server.url, max_workers = 4, cache_dir = os.path.join( self.dir, 'cache' ) )
+        self.bulk = MicexISSHistoryBulk( MicexISSClient( config, MicexISSDataHandler, list ),
+                                         os.path.join( self.dir, 'history' ) )
+
+    def tearDown( self ):
+        self.server.stop()
+        shutil.rmtree( self.dir )
+
+    def run_bulk( self ):
+        return self.bulk.run( 'stock', 'shares', ( 'TQBR', ), self.dateFrom, self.dateTill )
+
+    def test_empty_days( self ):
+        counts = self.run_bulk()
+        dates = date_range( self.dateFrom, self.dateTill )
+        published = [ date for date in dates if date in self.server.data.days ]
+        self.assertEqual( counts[ 'fetched' ], len( published ) )
+        self.assertEqual( counts[ 'empty' ], len( dates ) - len( published ) )
+
+        lastFinal = last_final_history_date()
+        recent = []
+        for date in dates:
+            fname = self.bulk.store.path( 'stock', 'shares', 'TQBR', date )
+            if date in published:
+                self.assertEqual( count_records( fname ), 120 )
+            elif date <= lastFinal:
+                self.assertEqual( count_records( fname ), 0 )
+            else:
+                self.assertFalse( os.path.exists( fname ) )
+                recent.append( date )
+        self.assertEqual( len( recent ), 2 )
+
+        # the last days are asked for again, not taken from the cache
+        requests = self.server.requests
+        counts = self.run_bulk()
+        self.assertEqual( counts[ 'skipped' ], len( dates ) - len( recent ) )
+        self.assertEqual( self.server.requests - requests, len( recent ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
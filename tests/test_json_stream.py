@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+    iss_json_stream gives the rows json.loads gives, whatever the size of
+    the pieces the body is read by and whatever the strings in the rows.
+
+        python -m pytest tests
+"""
+
+import io
+import json
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from iss_json_stream import iter_rows
+
+
+# strings which look like the end of a row to the batch decoding
+WORDS = ( 'a],[b', '],', ']', 'x"]', 'ф],', '\\', 'plain', '' )
+
+
+class IterRowsTest( unittest.TestCase ):
+
+    def reply( self, rows, separators = None, ensureAscii = True ):
+        doc = { 'trades': { 'metadata': { 'N': { 'type': 'int64' } }, 'columns': [ 'N', 'S', 'F' ], 'data': rows },
+                'trades.cursor': { 'columns': [ 'INDEX', 'TOTAL' ], 'data': [ [ 0, len( rows ) ] ] } }
+        return json.dumps( doc, separators = separators, ensure_ascii = ensureAscii ).encode( 'utf-8' )
+
+    def test_rows( self ):
+        rnd = random.Random( 1 )
+        for trial in range( 100 ):
+            rows = [ [ i, rnd.choice( WORDS ) + rnd.choice( WORDS ), rnd.random() ]
+                     for i in range( rnd.randint( 0, 60 ) ) ]
+            body = self.reply( rows, rnd.choice( ( None, ( ',', ':' ), ( ',\n', ': ' ) ) ), rnd.random() < 0.5 )
+            for chunkSize in ( 1, 3, 17, 256, 65536 ):
+                self.assertEqual( list( iter_rows( io.BytesIO( body ), 'trades', ( 'S', 'N' ), chunkSize ) ),
+                                  [ ( row[1], row[0] ) for row in rows ] )
+
+    def test_other_block( self ):
+        body = self.reply( [ [ 1, 'a', 0.5 ] ] * 10 )
+        self.assertEqual( list( iter_rows( io.BytesIO( body ), 'trades.cursor', ( 'TOTAL', ) ) ), [ ( 10, ) ] )
+        self.assertEqual( list( iter_rows( io.BytesIO( body ), 'candles', ( 'N', ) ) ), [] )
+
+    def test_missing_column( self ):
+        with self.assertRaises( ValueError ):
+            list( iter_rows( io.BytesIO( self.reply( [ [ 1, 'a', 0.5 ] ] ) ), 'trades', ( 'PRICE', ) ) )
+
+
+if __name__ == '__main__':
+    unittest.main()
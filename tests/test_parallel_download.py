@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+"""
+    Downloads split into parallel shards give exactly what the sequential
+    download gives. Run against the local mock ISS (iss_mock_server):
+
+        python -m pytest tests
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from iss_mock_server import MockISSServer
+from iss_simple_client import Config, MicexISSClient, MicexISSDataHandler
+
+
+class ResultHandler( MicexISSDataHandler ):
+    """ Keeps the data of the last call.
+    """
+
+    def __init__( self ):
+        self.result = None
+
+    def do( self, data ):
+        self.result = data
+
+
+class ParallelDownloadTest( unittest.TestCase ):
+
+    @classmethod
+    def setUpClass( cls ):
+        cls.server = MockISSServer( trades = 23000, days = 20 ).start()
+
+    @classmethod
+    def tearDownClass( cls ):
+        cls.server.stop()
+
+    def client( self ):
+        return MicexISSClient( Config( iss_url = self.server.url ), ResultHandler(), None )
+
+    def trades( self, prevSession, workers ):
+        iss = self.client()
+        iss.get_trades_for_session( 'futures', 'forts', 'RIH8', prevSession, workers = workers )
+        return iss.handler.result
+
+    def test_trades( self ):
+        for prevSession in ( 0, 1 ):
+            sequential = self.trades( prevSession, 1 )
+            self.assertEqual( len( sequential ), 23000 )
+            for workers in ( 2, 4 ):
+                self.assertEqual( self.trades( prevSession, workers ), sequential )
+
+    def test_sequential_trades_requests( self ):
+        # one shard as the loop before the shards: two boundary requests,
+        # 5 pages of 23000 trades and the empty page after the session
+        requests = self.server.requests
+        self.trades( 1, 1 )
+        self.assertEqual( self.server.requests - requests, 2 + 5 + 1 )
+
+    def test_candles( self ):
+        iss = self.client()
+        for timeFrame in ( 'm1', 'm10', 'H1' ):
+            sequential = iss.get_security_candles( 'stock', 'shares', 'TQBR', 'SBER', '', '', timeFrame, workers = 1 )
+            self.assertTrue( sequential )
+            for workers in ( 2, 4 ):
+                self.assertEqual( iss.get_security_candles( 'stock', 'shares', 'TQBR', 'SBER', '', '', timeFrame,
+                                                            workers = workers ), sequential )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python
+"""
+    Saves interrupted with resume = True go on from their checkpoint and
+    give the file of an uninterrupted save; without resume no checkpoint
+    is kept. Run against the local mock ISS (iss_mock_server):
+
+        python -m pytest tests
+"""
+
+import filecmp
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from iss_mock_server import MockISSServer
+from iss_simple_client import Config, MicexISSClient, MicexISSDataHandler, make_opener
+
+
+class Interrupted( Exception ):
+    pass
+
+
+class InterruptingOpener:
+    """ Opener failing on the request after the given number of requests.
+    """
+
+    def __init__( self, opener, requests ):
+        self.opener = opener
+        self.left = requests
+
+    def open( self, url, headers = None ):
+        if self.left == 0:
+            raise Interrupted( url )
+        self.left -= 1
+        return self.opener.open( url, headers )
+
+
+class ResumeTest( unittest.TestCase ):
+
+    @classmethod
+    def setUpClass( cls ):
+        cls.server = MockISSServer( trades = 23000, days = 5 ).start()
+        cls.config = Config( iss_url = cls.server.url, max_workers = 1 )
+
+    @classmethod
+    def tearDownClass( cls ):
+        cls.server.stop()
+
+    def setUp( self ):
+        self.cwd = os.getcwd()
+        self.dir = tempfile.mkdtemp()
+        os.chdir( self.dir )
+
+    def tearDown( self ):
+        os.chdir( self.cwd )
+        shutil.rmtree( self.dir )
+
+    def client( self, requests = None ):
+        opener = make_opener( self.config )
+        if requests is not None:
+            opener = InterruptingOpener( opener, requests )
+        return MicexISSClient( self.config, MicexISSDataHandler, list, opener = opener )
+
+    def save_trades( self, fname, requests = None, resume = False ):
+        return self.client( requests ).save_trades_for_session( 'futures', 'forts', 'RIH8', 1, fname = fname,
+                                                                  resume = resume )
+
+    def save_candles( self, fmt, requests = None, resume = False ):
+        self.client( requests ).save_security_candles( 'futures', 'forts', 'RFUD', 'RIH8', 'm1', fmt = fmt,
+                                                       resume = resume )
+        names = [ name for name in os.listdir( '.' ) if name.startswith( 'RIH8.' ) and name.endswith( '.' + fmt ) ]
+        self.assertEqual( len( names ), 1 )
+        return names[0]
+
+    def test_trades( self ):
+        reference = self.save_trades( 'reference.bin' )
+        # two edges and two pages are saved
+        with self.assertRaises( Interrupted ):
+            self.save_trades( 'resumed.bin', 4, resume = True )
+        self.assertTrue( os.path.isfile( 'resumed.bin.ckpt' ) )
+
+        requests = self.server.requests
+        self.save_trades( 'resumed.bin', resume = True )
+        # two edges, the 3 pages left and the empty page after the session
+        self.assertEqual( self.server.requests - requests, 2 + 3 + 1 )
+        self.assertFalse( os.path.exists( 'resumed.bin.ckpt' ) )
+        self.assertTrue( filecmp.cmp( reference, 'resumed.bin', shallow = False ) )
+
+    def test_no_checkpoint_without_resume( self ):
+        with self.assertRaises( Interrupted ):
+            self.save_trades( 'trades.bin', 4 )
+        self.assertFalse( os.path.exists( 'trades.bin.ckpt' ) )
+
+    def test_candles( self ):
+        for fmt in ( 'txt', 'bin' ):
+            reference = self.save_candles( fmt )
+            os.rename( reference, 'reference.' + fmt )
+            # the candleborders and two pages of 500 candles
+            with self.assertRaises( Interrupted ):
+                self.save_candles( fmt, 3, resume = True )
+            self.assertTrue( os.path.isfile( reference + '.ckpt' ) )
+            self.save_candles( fmt, resume = True )
+            self.assertFalse( os.path.exists( reference + '.ckpt' ) )
+            self.assertTrue( filecmp.cmp( 'reference.' + fmt, reference, shallow = False ) )
+            os.remove( reference )
+
+
+if __name__ == '__main__':
+    unittest.main()
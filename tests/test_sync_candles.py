@@ -0,0 +1,100 @@
+#!/usr/bin/env python
+"""
+    sync_security_candles against the local mock ISS (iss_mock_server):
+    a file cut short is brought back to the full one, and a tail left by
+    a sync stopped while applying it is applied again by the next sync.
+
+        python -m pytest tests
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from iss_mock_server import MockISSServer
+from iss_simple_client import Config, MicexISSClient, MicexISSDataHandler, apply_candles_tail
+from iss_store import CANDLE_FIELDS, record_struct
+
+
+CANDLE_SIZE = record_struct( CANDLE_FIELDS ).size
+
+
+class SyncCandlesTest( unittest.TestCase ):
+
+    @classmethod
+    def setUpClass( cls ):
+        cls.server = MockISSServer( days = 3 ).start()
+        cls.iss = MicexISSClient( Config( iss_url = cls.server.url, max_workers = 2 ), MicexISSDataHandler, list )
+
+    @classmethod
+    def tearDownClass( cls ):
+        cls.server.stop()
+
+    def setUp( self ):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown( self ):
+        shutil.rmtree( self.dir )
+
+    def sync( self, fmt ):
+        fname = os.path.join( self.dir, 'RIH8.RFUD.H1.' + fmt )
+        return fname, self.iss.sync_security_candles( 'futures', 'forts', 'RFUD', 'RIH8', 'H1', fname = fname, fmt = fmt )
+
+    def read( self, fname ):
+        with open( fname, 'rb' ) as f:
+            return f.read()
+
+    def cut( self, fmt, full, candles ):
+        """ The file without its last candles, a binary one with a cut record too.
+        """
+        if fmt == 'bin':
+            return full[ :len( full ) - candles * CANDLE_SIZE - 5 ]
+        return b''.join( full.splitlines( True )[ :-candles ] )
+
+    def test_update( self ):
+        for fmt in ( 'txt', 'bin' ):
+            fname, written = self.sync( fmt )
+            full = self.read( fname )
+            self.assertGreater( written, 0 )
+
+            with open( fname, 'wb' ) as f:
+                f.write( self.cut( fmt, full, 10 ) )
+            fname, written = self.sync( fmt )
+            # the candles cut off and the last one kept, which is replaced
+            self.assertEqual( written, 11 if fmt == 'txt' else 12 )
+            self.assertEqual( self.read( fname ), full )
+
+            # nothing new: only the last candle is replaced
+            self.assertEqual( self.sync( fmt )[1], 1 )
+            self.assertEqual( self.read( fname ), full )
+            self.assertFalse( os.path.exists( fname + '.tail' ) )
+
+    def test_tail_is_applied_again( self ):
+        for fmt in ( 'txt', 'bin' ):
+            fname, written = self.sync( fmt )
+            full = self.read( fname )
+            # a sync stopped while appending its tail: the file is cut after the kept size
+            keepSize = len( self.cut( fmt, full, 5 ) )
+            with open( fname + '.tail', 'wb' ) as f:
+                f.write( b'%d\n' % keepSize + full[ keepSize: ] )
+            with open( fname, 'wb' ) as f:
+                f.write( full[ :keepSize + 7 ] )
+
+            apply_candles_tail( fname )
+            self.assertEqual( self.read( fname ), full )
+            self.assertFalse( os.path.exists( fname + '.tail' ) )
+            # and the same by the next sync
+            with open( fname + '.tail', 'wb' ) as f:
+                f.write( b'%d\n' % keepSize + full[ keepSize: ] )
+            with open( fname, 'wb' ) as f:
+                f.write( full[ :keepSize + 7 ] )
+            self.sync( fmt )
+            self.assertEqual( self.read( fname ), full )
+
+
+if __name__ == '__main__':
+    unittest.main()
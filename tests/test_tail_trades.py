@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+"""
+    tail_trades against the local mock ISS (iss_mock_server): the trades
+    of a growing current session come once each, and stop() ends a long
+    pause at once.
+
+        python -m pytest tests
+"""
+
+import os
+import sys
+import threading
+import time
+import unittest
+
+sys.path.insert( 0, os.path.dirname( os.path.dirname( os.path.abspath( __file__ ) ) ) )
+
+from iss_mock_server import MockISSServer
+from iss_simple_client import Config, MicexISSClient, MicexISSDataHandler
+
+
+class BatchCounter( MicexISSDataHandler ):
+    """ Counts the batches passed to it.
+    """
+
+    def __init__( self ):
+        self.batches = 0
+
+    def do( self, data ):
+        self.batches += 1
+
+
+class TailTradesTest( unittest.TestCase ):
+
+    def setUp( self ):
+        self.server = MockISSServer( trades = 12000 ).start()
+        self.iss = MicexISSClient( Config( iss_url = self.server.url ), BatchCounter(), None )
+        self.full = self.server.data.session( 'RIH8', 0 )
+        self.server.data.sessions[ ( 'RIH8', 0 ) ] = tuple( column[ :7000 ] for column in self.full )
+
+    def tearDown( self ):
+        self.server.stop()
+
+    def test_growing_session( self ):
+        requests = self.server.requests
+        tail = self.iss.tail_trades( 'futures', 'forts', 'RIH8', interval = 0.01 )
+        trades = next( tail ) + next( tail )
+        # the session start, a full page and the rest
+        self.assertEqual( self.server.requests - requests, 1 + 2 )
+        self.assertEqual( len( trades ), 7000 )
+
+        self.server.data.sessions[ ( 'RIH8', 0 ) ] = self.full
+        trades += next( tail )
+        tail.close()
+        self.assertEqual( self.iss.handler.batches, 3 )
+        self.assertEqual( [ trade[3] for trade in trades ], self.full[0] )
+
+    def test_stop_during_pause( self ):
+        stopped = threading.Event()
+        tail = self.iss.tail_trades( 'futures', 'forts', 'RIH8', interval = 30, maxInterval = 30,
+                                     stop = stopped.is_set )
+        next( tail )
+        next( tail )
+        threading.Timer( 0.2, stopped.set ).start()
+        started = time.monotonic()
+        self.assertEqual( list( tail ), [] )
+        self.assertLess( time.monotonic() - started, 5 )
+
+
+if __name__ == '__main__':
+    unittest.main()